@@ -0,0 +1,322 @@
+#api: versioned JSON API over venues, artists and shows
+#
+# Listings are keyset-paginated (?cursor=, ?limit=), accept sparse fieldsets
+# (?fields=name,city) and are streamed row by row from column tuples, so a
+# large page is never built in memory as ORM objects or as one JSON string.
+import json
+from datetime import date
+
+from flask import Blueprint, Response, abort, current_app, jsonify, request, stream_with_context
+from sqlalchemy import tuple_
+
+from app import split_shows, tagged_with, genre_names, encode_cursor, decode_cursor, calendar_filters, nearby_filters, match_limit
+from extensions import db
+import bookings
+import matches
+import nearby
+from filters import to_datetime
+from models import Venue, Artist, Show, venue_genres, artist_genres
+from parallel import gather
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+VENUE_FIELDS = {
+    'id': Venue.id,
+    'name': Venue.name,
+    'city': Venue.city,
+    'state': Venue.state,
+    'address': Venue.address,
+    'phone': Venue.phone,
+    'image_link': Venue.image_link,
+    'facebook_link': Venue.facebook_link,
+    'website': Venue.website,
+    'seeking_talent': Venue.seeking_talent,
+    'seeking_description': Venue.seeking_description,
+    'upcoming_shows_count': Venue.upcoming_shows_count,
+    'past_shows_count': Venue.past_shows_count,
+}
+
+ARTIST_FIELDS = {
+    'id': Artist.id,
+    'name': Artist.name,
+    'city': Artist.city,
+    'state': Artist.state,
+    'phone': Artist.phone,
+    'image_link': Artist.image_link,
+    'facebook_link': Artist.facebook_link,
+    'website': Artist.website,
+    'seeking_venue': Artist.seeking_venue,
+    'seeking_description': Artist.seeking_description,
+    'upcoming_shows_count': Artist.upcoming_shows_count,
+    'past_shows_count': Artist.past_shows_count,
+}
+
+SHOW_FIELDS = {
+    'id': Show.id,
+    'start_time': Show.start_time,
+    'end_time': Show.end_time,
+    'artist_id': Artist.id,
+    'artist_name': Artist.name,
+    'artist_image_link': Artist.image_link,
+    'venue_id': Venue.id,
+    'venue_name': Venue.name,
+    'venue_image_link': Venue.image_link,
+}
+
+
+def to_json(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def dumps(value):
+    return json.dumps(value, default=to_json, separators=(',', ':'))
+
+
+def selected_fields(available, required):
+    # ?fields=a,b -> the requested subset (plus the fields the cursor needs),
+    # in the order given; all fields when the parameter is absent
+    fields = request.args.get('fields')
+    if not fields:
+        return list(available)
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        abort(400, 'Unknown field(s): {}'.format(', '.join(unknown)))
+    return [name for name in required if name not in names] + names
+
+
+def page_limit():
+    limit = request.args.get('limit', current_app.config.get('API_PAGE_SIZE', 100), type=int)
+    return max(1, min(limit, current_app.config.get('API_MAX_PAGE_SIZE', 10000)))
+
+
+def stream_page(query, names, limit, cursor_for):
+    # streams {"data": [...], "next_cursor": ...}; one row beyond `limit` is
+    # fetched only to learn whether there is a next page
+    rows = query.limit(limit + 1).yield_per(current_app.config.get('API_STREAM_BATCH', 500))
+
+    def generate():
+        yield '{"data":['
+        last = None
+        for position, row in enumerate(rows):
+            if position == limit:
+                yield '],"next_cursor":' + dumps(cursor_for(last)) + '}'
+                return
+            last = dict(zip(names, row))
+            yield (',' if position else '') + dumps(last)
+        yield '],"next_cursor":null}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def list_entities(model, fields, association, owner):
+    names = selected_fields(fields, ['id'])
+    query = db.session.query(*[fields[name] for name in names])
+
+    genres = request.args.getlist('genre')
+    if genres:
+        query = query.filter(model.id.in_(tagged_with(association, owner, genres)))
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            query = query.filter(model.id > int(cursor))
+        except ValueError:
+            abort(400, 'Malformed cursor')
+
+    query = query.order_by(model.id)
+    return stream_page(query, names, page_limit(), lambda row: str(row['id']))
+
+
+def entity_detail(model, fields, entity_id):
+    names = selected_fields(fields, ['id'])
+    row = db.session.query(*[fields[name] for name in names]).filter(model.id == entity_id).first()
+    if row is None:
+        abort(404, '{} {} not found'.format(model.__name__, entity_id))
+    return dict(zip(names, row))
+
+
+def booking_conflicts(kind, model, owner_id):
+    # the venue's or artist's shows overlapping [?start, ?end), i.e. what a
+    # new booking in that window would clash with, and any pairs among them
+    # that already overlap each other
+    if db.session.query(model.id).filter(model.id == owner_id).first() is None:
+        abort(404, '{} {} not found'.format(model.__name__, owner_id))
+    try:
+        start_time = to_datetime(request.args['start'])
+        end_time = to_datetime(request.args['end'])
+        # times with and without a UTC offset are compared in UTC
+        ends_first = bookings.utc(end_time) <= bookings.utc(start_time)
+    except (KeyError, TypeError, ValueError, OverflowError):
+        abort(400, 'start and end must be given as timestamps')
+    if ends_first:
+        abort(400, 'end must be after start')
+
+    shows = bookings.overlapping(kind, owner_id, start_time, end_time)
+    return Response(dumps({
+        'start': start_time,
+        'end': end_time,
+        'shows': [{'id': show_id, 'start_time': start, 'end_time': end} for show_id, start, end in shows],
+        'clashes': [list(pair) for pair in bookings.clashes(shows)],
+    }), mimetype='application/json')
+
+
+def match_list(kind, owner_id, fields):
+    # the owner's precomputed matches, best first: {"data": [{...,
+    # "score", "shared_genres"}]}; ?fields= picks the candidate's fields
+    names = selected_fields(fields, ['id'])
+    rows = matches.ranked(kind, owner_id, [fields[name] for name in names], match_limit())
+    if rows is None:
+        abort(404, '{} {} not found'.format(kind.capitalize(), owner_id))
+    return Response(dumps({
+        'data': [dict(zip(names, row[1:]), score=score, shared_genres=shared) for score, shared, row in rows],
+    }), mimetype='application/json')
+
+
+#  Venues
+#  ----------------------------------------------------------------
+
+@api.route('/venues')
+def venues():
+    return list_entities(Venue, VENUE_FIELDS, venue_genres, 'venue_id')
+
+
+@api.route('/venues/nearby')
+def nearby_venues():
+    # the /venues/nearby search: {"data": [{..., "distance_km"}]}, nearest first
+    names = selected_fields(VENUE_FIELDS, ['id'])
+    rows = nearby.find([VENUE_FIELDS[name] for name in names], *nearby_filters())
+    return Response(dumps({
+        'data': [dict(zip(names, row[1:]), distance_km=round(distance, 3)) for distance, row in rows],
+    }), mimetype='application/json')
+
+
+@api.route('/venues/<int:venue_id>')
+def show_venue(venue_id):
+    data, genres, rows = gather(
+        lambda: entity_detail(Venue, VENUE_FIELDS, venue_id),
+        lambda: genre_names(venue_genres, 'venue_id', venue_id),
+        lambda: db.session.query(Show.start_time, Artist.id, Artist.name, Artist.image_link).join(
+            Artist, Show.artist_id == Artist.id
+        ).filter(Show.venue_id == venue_id).order_by(Show.start_time).all(),
+    )
+    data['genres'] = genres
+    data['past_shows'], data['upcoming_shows'] = split_shows(rows, ('artist_id', 'artist_name', 'artist_image_link'))
+    data['past_shows_count'] = len(data['past_shows'])
+    data['upcoming_shows_count'] = len(data['upcoming_shows'])
+    return Response(dumps(data), mimetype='application/json')
+
+
+@api.route('/venues/<int:venue_id>/conflicts')
+def venue_conflicts(venue_id):
+    return booking_conflicts('venue', Venue, venue_id)
+
+
+@api.route('/venues/<int:venue_id>/matches')
+def venue_matches(venue_id):
+    return match_list('venue', venue_id, ARTIST_FIELDS)
+
+
+#  Artists
+#  ----------------------------------------------------------------
+
+@api.route('/artists')
+def artists():
+    return list_entities(Artist, ARTIST_FIELDS, artist_genres, 'artist_id')
+
+
+@api.route('/artists/<int:artist_id>')
+def show_artist(artist_id):
+    data, genres, rows = gather(
+        lambda: entity_detail(Artist, ARTIST_FIELDS, artist_id),
+        lambda: genre_names(artist_genres, 'artist_id', artist_id),
+        lambda: db.session.query(Show.start_time, Venue.id, Venue.name, Venue.image_link).join(
+            Venue, Show.venue_id == Venue.id
+        ).filter(Show.artist_id == artist_id).order_by(Show.start_time).all(),
+    )
+    data['genres'] = genres
+    data['past_shows'], data['upcoming_shows'] = split_shows(rows, ('venue_id', 'venue_name', 'venue_image_link'))
+    data['past_shows_count'] = len(data['past_shows'])
+    data['upcoming_shows_count'] = len(data['upcoming_shows'])
+    return Response(dumps(data), mimetype='application/json')
+
+
+@api.route('/artists/<int:artist_id>/conflicts')
+def artist_conflicts(artist_id):
+    return booking_conflicts('artist', Artist, artist_id)
+
+
+@api.route('/artists/<int:artist_id>/matches')
+def artist_matches(artist_id):
+    return match_list('artist', artist_id, VENUE_FIELDS)
+
+
+#  Shows
+#  ----------------------------------------------------------------
+
+@api.route('/shows')
+def shows():
+    names = selected_fields(SHOW_FIELDS, ['id', 'start_time'])
+    query = db.session.query(*[SHOW_FIELDS[name] for name in names]).select_from(Show).join(
+        Artist, Show.artist_id == Artist.id
+    ).join(Venue, Show.venue_id == Venue.id)
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        after = decode_cursor(cursor)
+        if after is None:
+            abort(400, 'Malformed cursor')
+        query = query.filter(tuple_(Show.start_time, Show.id) > tuple_(*after))
+
+    query = query.order_by(Show.start_time, Show.id)
+    return stream_page(query, names, page_limit(), lambda row: encode_cursor(row['start_time'], row['id']))
+
+
+@api.route('/shows/calendar')
+def show_calendar():
+    # the /shows/calendar filters; a page of shows grouped by day:
+    # {"start", "end", "days": [{"date", "shows": [...]}], "next_cursor"}
+    names = selected_fields(SHOW_FIELDS, ['id', 'start_time'])
+    query, first_day, last_day = calendar_filters(
+        db.session.query(*[SHOW_FIELDS[name] for name in names]).select_from(Show).join(
+            Artist, Show.artist_id == Artist.id
+        ).join(Venue, Show.venue_id == Venue.id)
+    )
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        after = decode_cursor(cursor)
+        if after is None:
+            abort(400, 'Malformed cursor')
+        query = query.filter(tuple_(Show.start_time, Show.id) > tuple_(*after))
+
+    limit = page_limit()
+    shows = [dict(zip(names, row)) for row in query.order_by(Show.start_time, Show.id).limit(limit + 1)]
+    next_cursor = None
+    if len(shows) > limit:
+        shows = shows[:limit]
+        next_cursor = encode_cursor(shows[-1]['start_time'], shows[-1]['id'])
+
+    days = []
+    for show in shows:
+        day = show['start_time'].date()
+        if not days or days[-1]['date'] != day:
+            days.append({'date': day, 'shows': []})
+        days[-1]['shows'].append(show)
+    return Response(dumps({
+        'start': first_day,
+        'end': last_day,
+        'days': days,
+        'next_cursor': next_cursor,
+    }), mimetype='application/json')
+
+
+#  Errors
+#  ----------------------------------------------------------------
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def api_error(error):
+    return jsonify({'error': error.description}), error.code
@@ -2,55 +2,507 @@
 # Imports
 #----------------------------------------------------------------------------#
 
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, flash, redirect, url_for, abort
-from flask_moment import Moment
+from flask import Flask, Blueprint, render_template, request, flash, redirect, url_for, abort, jsonify, Response, current_app
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from flask_wtf import FlaskForm as Form
-from flask_migrate import Migrate
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
+import base64
+import csv
+import io
+import os
 import sys
-from flask_sqlalchemy import SQLAlchemy
+import config
+from sqlalchemy import case, delete, func, literal, select, tuple_, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from itertools import groupby
+from extensions import db, migrate, moment
 
 #----------------------------------------------------------------------------#
-# App Config.
+# Models.
 #----------------------------------------------------------------------------#
+from models import *
+import search
+import nearby
+import matches
+import bookings
+import counters
+import cache
+from cache import page_cache, page_key, cached_page, expire_at
+from conditional import conditional
+import metrics
+import audit
+import assets
+import parallel
+from parallel import gather
+from importer import import_command
+#----------------------------------------------------------------------------#
+# Filters.
+#----------------------------------------------------------------------------#
+
+from filters import format_datetime, to_datetime
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+#----------------------------------------------------------------------------#
+# Views.
+#----------------------------------------------------------------------------#
 
-# TODO: connect to a local postgresql database
+# routes are collected here and attached to the app in create_app
+main = Blueprint('main', __name__)
 
 #----------------------------------------------------------------------------#
-# Models.
+# Shows.
 #----------------------------------------------------------------------------#
-from models import *
+
+def is_upcoming(start_time, now):
+  # a show starting right now is still upcoming; naive timestamps are
+  # compared in local time, like the database does
+  if start_time.tzinfo is None:
+    now = now.replace(tzinfo=None)
+  return start_time >= now
+
+def split_shows(rows, keys):
+  # partitions (start_time, id, name, image_link) rows into past and upcoming
+  # show dicts, using `keys` as the names of the id, name and image fields
+  now = datetime.now().astimezone()
+  past_shows = []
+  upcoming_shows = []
+  for start_time, *values in rows:
+    show = dict(zip(keys, values))
+    show["start_time"] = start_time
+    if is_upcoming(start_time, now):
+      upcoming_shows.append(show)
+    else:
+      past_shows.append(show)
+  return past_shows, upcoming_shows
+
+def parse_show(row):
+  # a show row: artist_id, venue_id, start_time and optionally end_time or a
+  # duration in minutes; raises ValueError with a message for the user
+  try:
+    show = {"artist_id": int(row.get("artist_id")), "venue_id": int(row.get("venue_id"))}
+  except (TypeError, ValueError):
+    raise ValueError("expected an artist id and a venue id")
+  try:
+    show["start_time"] = to_datetime(row.get("start_time"))
+    if row.get("end_time"):
+      show["end_time"] = to_datetime(row["end_time"])
+    elif row.get("duration") not in (None, ""):
+      show["end_time"] = show["start_time"] + timedelta(minutes=int(row["duration"]))
+    else:
+      show["end_time"] = show["start_time"] + DEFAULT_SHOW_DURATION
+    # times with and without a UTC offset are compared in UTC
+    ends_first = bookings.utc(show["end_time"]) <= bookings.utc(show["start_time"])
+  except (TypeError, ValueError, OverflowError):
+    raise ValueError("expected a start time and an optional end time or duration in minutes")
+  if ends_first:
+    raise ValueError("the show must end after it starts")
+  return show
+
+def schedule_shows(rows, partial=False):
+  # validates show rows (see parse_show) and inserts them in one
+  # transaction. Returns (created, errors) where errors are (row number,
+  # message) pairs; unless `partial`, any error means nothing is inserted.
+  shows = []
+  errors = []
+  for number, row in enumerate(rows, start=1):
+    try:
+      shows.append((number, parse_show(row)))
+    except ValueError as error:
+      errors.append((number, str(error)))
+
+  # every referenced artist and venue is checked in one round trip
+  artist_ids = {show["artist_id"] for _, show in shows}
+  venue_ids = {show["venue_id"] for _, show in shows}
+  known = set(db.session.execute(
+    select(literal("artist"), Artist.id).where(Artist.id.in_(artist_ids)).union_all(
+      select(literal("venue"), Venue.id).where(Venue.id.in_(venue_ids))
+    )
+  ).all()) if shows else set()
+
+  bookable = []
+  for number, show in shows:
+    if ("artist", show["artist_id"]) not in known:
+      errors.append((number, "no artist with id {}".format(show["artist_id"])))
+    elif ("venue", show["venue_id"]) not in known:
+      errors.append((number, "no venue with id {}".format(show["venue_id"])))
+    else:
+      bookable.append((number, show))
+
+  # double bookings, against existing shows and within the batch
+  conflicts = dict(bookings.check(bookable))
+  errors.extend(conflicts.items())
+  valid = [show for number, show in bookable if number not in conflicts]
+  errors.sort()
+
+  if not valid or (errors and not partial):
+    return 0, errors
+  try:
+    db.session.execute(Show.__table__.insert(), valid)
+    counters.record(valid)
+    matches.rescore((show["artist_id"], show["venue_id"]) for show in valid)
+    db.session.commit()
+  except IntegrityError:
+    # Postgres' exclusion constraints caught a booking made concurrently
+    db.session.rollback()
+    return 0, sorted(errors + [(number, "clashes with a show booked meanwhile") for number, show in bookable if number not in conflicts])
+  pages = {page_key("artist", show["artist_id"]) for show in valid} | {page_key("venue", show["venue_id"]) for show in valid}
+  page_cache.invalidate(*pages)
+  return len(valid), errors
+
 #----------------------------------------------------------------------------#
-# Filters.
+# Deleting.
+#----------------------------------------------------------------------------#
+
+DELETABLE = {
+  "venue": (Venue, Show.venue_id, venue_genres, "artist", Show.artist_id),
+  "artist": (Artist, Show.artist_id, artist_genres, "venue", Show.venue_id),
+}
+
+def delete_entities(kind, ids):
+  # deletes venues or artists with their shows and genre links using
+  # set-based statements, never loading the rows. On Postgres the foreign
+  # keys cascade, so it is a single DELETE; elsewhere the shows and links
+  # are deleted first. Returns the ids that existed.
+  model, owner, association, other_kind, other = DELETABLE[kind]
+  found = [row_id for row_id, in db.session.query(model.id).filter(model.id.in_(ids))]
+  if not found:
+    return []
+
+  stale_pages = [page_key(kind, row_id) for row_id in found] + [
+    page_key(other_kind, other_id) for other_id, in db.session.query(other).filter(owner.in_(found)).distinct()
+  ]
+  counters.forget(kind, found)
+  if not bookings.on_postgres():
+    db.session.execute(delete(Show.__table__).where(owner.in_(found)))
+    db.session.execute(delete(association).where(association.c[kind + "_id"].in_(found)))
+  db.session.execute(delete(model.__table__).where(model.id.in_(found)))
+  search.forget(model, found)
+  if kind == "venue":
+    nearby.forget(found)
+  matches.forget(kind, found)
+  db.session.commit()
+  page_cache.invalidate(*stale_pages)
+  return found
+
+def delete_batch(kind):
+  # many venues or artists at once: {"ids": [1, 2, 3]} as JSON, or repeated
+  # `ids` form fields. Answers with the deleted ids and those not found.
+  limit = current_app.config.get('DELETE_BATCH_MAX_IDS', 1000)
+  if request.is_json:
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+      return jsonify({"error": "expected a JSON object with ids"}), 400
+    ids = payload.get("ids")
+  else:
+    ids = request.form.getlist("ids")
+  try:
+    if not isinstance(ids, list):
+      raise TypeError(ids)
+    ids = sorted({int(row_id) for row_id in ids})
+  except (TypeError, ValueError):
+    return jsonify({"error": "ids must be a list of integers"}), 400
+  if not ids or len(ids) > limit:
+    return jsonify({"error": "Delete between 1 and {} {}s at once.".format(limit, kind)}), 400
+
+  try:
+    deleted = delete_entities(kind, ids)
+  except SQLAlchemyError:
+    db.session.rollback()
+    current_app.logger.exception('Deleting %ss %s failed', kind, ids)
+    return jsonify({"error": "the {}s could not be deleted".format(kind)}), 500
+  finally:
+    db.session.close()
+  return jsonify({"deleted": deleted, "missing": sorted(set(ids) - set(deleted))})
+
+#----------------------------------------------------------------------------#
+# Editing.
+#----------------------------------------------------------------------------#
+
+EDITABLE = {
+  "venue": (Venue, venue_genres),
+  "artist": (Artist, artist_genres),
+}
+
+def unchanged(old, new):
+  # the forms send '' for empty text and False for unticked boxes
+  return (old or None) == (new or None)
+
+def edit_entity(kind, row_id, version, values, genres):
+  # updates a venue or artist from an edit form: `values` maps columns to
+  # the submitted values, `genres` is the submitted genre names and
+  # `version` the row version the form was filled from (None: the current
+  # one). Only changed columns and genre links are written, in one UPDATE
+  # guarded by the version, which it bumps. Returns None for an unknown
+  # row, else "updated", "unchanged" or "conflict" when the row was edited
+  # since the form was filled.
+  model, association = EDITABLE[kind]
+  owner = association.c[kind + "_id"]
+  table = model.__table__
+  values = dict(values, genre_mask=genre_mask(genre_ids(genres)))
+  current = db.session.query(model.version, *[table.c[name] for name in values]).filter(model.id == row_id).first()
+  if current is None:
+    return None
+  expected = current.version if version is None else version
+  if expected != current.version:
+    return "conflict"
+
+  stored = dict(zip(values, current[1:]))
+  changes = {name: value for name, value in values.items() if not unchanged(stored[name], value)}
+  had = {genre_id for genre_id, in db.session.query(association.c.genre_id).filter(owner == row_id)}
+  wanted = set(genre_ids(genres))
+  if not changes and had == wanted:
+    return "unchanged"
+
+  # a genre-only edit still bumps the version, and with it updated_at
+  written = db.session.execute(
+    update(table).where(table.c.id == row_id, table.c.version == expected).values(version=table.c.version + 1, **changes)
+  )
+  if written.rowcount != 1:
+    db.session.rollback()
+    return "conflict"
+  if had - wanted:
+    db.session.execute(delete(association).where(owner == row_id, association.c.genre_id.in_(had - wanted)))
+  if wanted - had:
+    db.session.execute(association.insert(), [{kind + "_id": row_id, "genre_id": genre_id} for genre_id in sorted(wanted - had)])
+  stored.update(changes)
+  if set(changes) & set(search.SEARCH_FIELDS):
+    search.reindex(model, row_id, [stored[field] for field in search.SEARCH_FIELDS])
+  if set(changes) & {"latitude", "longitude"}:
+    nearby.relocate(row_id, stored["latitude"], stored["longitude"])
+  if set(changes) & set(matches.MATCH_FIELDS):
+    matches.refresh(kind, row_id)
+  db.session.commit()
+  return "updated"
+
+#----------------------------------------------------------------------------#
+# Genres.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+def tagged_with(association, owner, names):
+  # ids of the venues/artists tagged with every one of the given genres,
+  # answered from the (genre_id, owner_id) index of the association table
+  required = set(names)
+  owner_id = association.c[owner]
+  return db.session.query(owner_id).filter(
+    association.c.genre_id.in_(genre_ids(required))
+  ).group_by(owner_id).having(func.count() == len(required))
+
+def genre_counts(association, owner, names):
+  # {genre: number of venues/artists}, within those matching `names` if given
+  query = db.session.query(association.c.genre_id, func.count()).group_by(association.c.genre_id)
+  if names:
+    query = query.filter(association.c[owner].in_(tagged_with(association, owner, names)))
+  counts = dict(query.all())
+  return {name: counts.get(genre_id, 0) for genre_id, name in enumerate(GENRES, start=1)}
+
+def genre_names(association, owner, owner_id):
+  # genre names of one venue/artist, without loading the ORM object
+  rows = db.session.query(Genre.name).join(
+    association, association.c.genre_id == Genre.id
+  ).filter(association.c[owner] == owner_id).order_by(Genre.id)
+  return [name for name, in rows]
 
-app.jinja_env.filters['datetime'] = format_datetime
+#----------------------------------------------------------------------------#
+# Page cache invalidation.
+#----------------------------------------------------------------------------#
+
+def venue_pages(venue_id):
+  # a venue's own page plus every artist page that lists a show there
+  artist_ids = db.session.query(Show.artist_id).filter(Show.venue_id == venue_id).distinct()
+  return [page_key('venue', venue_id)] + [page_key('artist', artist_id) for artist_id, in artist_ids]
+
+def artist_pages(artist_id):
+  # an artist's own page plus every venue page that lists one of their shows
+  venue_ids = db.session.query(Show.venue_id).filter(Show.artist_id == artist_id).distinct()
+  return [page_key('artist', artist_id)] + [page_key('venue', venue_id) for venue_id, in venue_ids]
+
+#----------------------------------------------------------------------------#
+# Pagination.
+#----------------------------------------------------------------------------#
+
+def encode_cursor(start_time, row_id):
+  # opaque keyset cursor pointing just past (start_time, id)
+  raw = '{}|{}'.format(start_time.isoformat(), row_id)
+  return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+  # returns (start_time, id), or None when the cursor is malformed
+  try:
+    raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    start_time, row_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(start_time), int(row_id)
+  except (ValueError, UnicodeError):
+    return None
+
+#----------------------------------------------------------------------------#
+# Calendar.
+#----------------------------------------------------------------------------#
+
+def calendar_day(name, default):
+  value = request.args.get(name)
+  if not value:
+    return default
+  try:
+    return date.fromisoformat(value)
+  except ValueError:
+    abort(400, '{} must be a date (YYYY-MM-DD)'.format(name))
+
+def calendar_window():
+  # ?start= through ?end=, both included; the coming week by default
+  first_day = calendar_day('start', date.today())
+  return first_day, calendar_day('end', first_day + timedelta(days=6))
+
+def calendar_filters(query):
+  # narrows a Show query to ?start= through ?end= (dates, both included;
+  # the coming week by default), the venues in ?city= and ?state=, one
+  # ?venue_id= or ?artist_id=, and artists tagged with every ?genre=.
+  # Returns the query and the first and last day. The time range is
+  # answered from the (start_time, id) index, or per venue from
+  # (venue_id, start_time) once the venue filters have narrowed it down.
+  first_day, last_day = calendar_window()
+  span = (last_day - first_day).days + 1
+  limit = current_app.config.get('CALENDAR_MAX_DAYS', 92)
+  if not 1 <= span <= limit:
+    abort(400, 'end must be on or after start, and at most {} days later'.format(limit - 1))
+  query = query.filter(
+    Show.start_time >= datetime.combine(first_day, time.min),
+    Show.start_time < datetime.combine(last_day + timedelta(days=1), time.min),
+  )
+
+  places = []
+  if request.args.get('city'):
+    places.append(Venue.city == request.args['city'])
+  if request.args.get('state'):
+    places.append(Venue.state == request.args['state'])
+  if places:
+    query = query.filter(Show.venue_id.in_(db.session.query(Venue.id).filter(*places)))
+  for name, column in (('venue_id', Show.venue_id), ('artist_id', Show.artist_id)):
+    if request.args.get(name):
+      owner_id = request.args.get(name, type=int)
+      if owner_id is None:
+        abort(400, '{} must be a number'.format(name))
+      query = query.filter(column == owner_id)
+  genres = request.args.getlist('genre')
+  if genres:
+    query = query.filter(Show.artist_id.in_(tagged_with(artist_genres, 'artist_id', genres)))
+  return query, first_day, last_day
+
+#----------------------------------------------------------------------------#
+# Nearby venues.
+#----------------------------------------------------------------------------#
+
+def nearby_filters():
+  # the search point from ?lat=&lng=, or from ?city=&state= through the
+  # Place table; ?radius= in km (at most, and by default,
+  # NEARBY_MAX_RADIUS_KM), ?limit= and ?upcoming=1 for venues with shows to
+  # come. Returns (latitude, longitude, radius, limit, upcoming).
+  config = current_app.config
+  latitude = request.args.get('lat', type=float)
+  longitude = request.args.get('lng', type=float)
+  if latitude is None and longitude is None and request.args.get('city'):
+    latitude, longitude = nearby.locate(request.args['city'], request.args.get('state'))
+    if latitude is None:
+      abort(400, 'no coordinates known for {}, {}'.format(request.args['city'], request.args.get('state')))
+  if not nearby.valid(latitude, longitude):
+    abort(400, 'lat and lng must be given in degrees, or city and state')
+
+  max_radius = config.get('NEARBY_MAX_RADIUS_KM', 500)
+  radius = request.args.get('radius', max_radius, type=float)
+  if not 0 < radius <= max_radius:
+    abort(400, 'radius must be above 0 and at most {} km'.format(max_radius))
+  limit = request.args.get('limit', config.get('NEARBY_RESULTS', 20), type=int)
+  limit = max(1, min(limit, config.get('NEARBY_MAX_RESULTS', 1000)))
+  return latitude, longitude, radius, limit, bool(request.args.get('upcoming'))
+
+#----------------------------------------------------------------------------#
+# Matchmaking.
+#----------------------------------------------------------------------------#
+
+def match_limit():
+  # ?limit=, at most (and by default) the MATCH_LIST_SIZE entries kept per list
+  size = current_app.config.get('MATCH_LIST_SIZE', 20)
+  return max(1, min(request.args.get('limit', size, type=int), size))
+
+def match_page(kind, row_id):
+  # the venues suggested for an artist or the artists for a venue, read
+  # from the precomputed lists in matches.py
+  model = matches.SIDES[kind][0]
+  other = matches.SIDES[matches.OTHER[kind]][0]
+  name = db.session.query(model.name).filter(model.id == row_id).scalar()
+  if name is None:
+    abort(404)
+  rows = matches.ranked(kind, row_id, [other.name, other.city, other.state, other.image_link, other.upcoming_shows_count], match_limit()) or []
+  data = [{
+    "id": other_id,
+    "name": other_name,
+    "city": city,
+    "state": state,
+    "image_link": image_link,
+    "num_upcoming_shows": upcoming_shows,
+    "score": score,
+    "shared_genres": shared,
+  } for score, shared, (other_id, other_name, city, state, image_link, upcoming_shows) in rows]
+  return render_template('pages/matches.html', kind=kind, owner={"id": row_id, "name": name}, matches=data)
+
+#----------------------------------------------------------------------------#
+# Conditional GET.
+#----------------------------------------------------------------------------#
+
+# Validators for @conditional: one small query each, returning the values a
+# page depends on, or None when the page does not exist.
+
+def deleted_at(model):
+  return select(Deletion.deleted_at).where(Deletion.table_name == model.__tablename__).scalar_subquery()
+
+def detail_validator(model, owner_id, own_key, other, other_key):
+  # the entity, its shows and the other side of those shows; the number of
+  # shows still to come and the last one to have started date the
+  # past/upcoming split. Adding or removing a show also moves the entity's
+  # updated_at, through its show counters.
+  now = datetime.now()
+  return db.session.query(
+    model.updated_at,
+    func.max(Show.updated_at),
+    func.max(other.updated_at),
+    func.sum(case((Show.start_time >= now, 1), else_=0)),
+    func.max(case((Show.start_time < now, Show.start_time))),
+  ).outerjoin(Show, own_key == model.id).outerjoin(other, other_key == other.id).filter(
+    model.id == owner_id
+  ).group_by(model.id, model.updated_at).first()
+
+def venue_validator(venue_id):
+  return detail_validator(Venue, venue_id, Show.venue_id, Artist, Show.artist_id)
+
+def artist_validator(artist_id):
+  return detail_validator(Artist, artist_id, Show.artist_id, Venue, Show.venue_id)
+
+def listing_validator(model):
+  # the newest change and the last deletion, both served by an index or a
+  # single row; filters and cursors are covered by the URL in the ETag
+  def validator():
+    return db.session.query(func.max(model.updated_at), deleted_at(model)).one()
+  return validator
+
+def shows_validator():
+  return db.session.query(
+    select(func.max(Show.updated_at)).scalar_subquery(),
+    select(func.max(Venue.updated_at)).scalar_subquery(),
+    select(func.max(Artist.updated_at)).scalar_subquery(),
+    deleted_at(Show),
+  ).one()
+
+def calendar_validator():
+  # the default window starts today, so the days it resolves to date the
+  # page as much as the shows in it do
+  return tuple(shows_validator()) + calendar_window()
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
-@app.route('/')
+@main.route('/')
 def index():
   return render_template('pages/home.html')
 
@@ -58,55 +510,90 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@main.route('/venues')
+@conditional(listing_validator(Venue))
 def venues():
-  # TODO: replace with real venues data.
-  #       num_upcoming_shows should be aggregated based on number of upcoming shows per venue.
-  event_venue = Venue.query.order_by('id').all()
-  data = []
+  # venues grouped by (city, state) with their upcoming show counts, read
+  # from the counters on Venue (see counters.py) without touching Show.
+  # ?genre=Jazz&genre=Blues narrows the list to venues tagged with both.
+  genres = request.args.getlist('genre')
+  query = db.session.query(
+    Venue.id,
+    Venue.name,
+    Venue.city,
+    Venue.state,
+    Venue.upcoming_shows_count,
+  )
+  if genres:
+    query = query.filter(Venue.id.in_(tagged_with(venue_genres, 'venue_id', genres)))
+  rows = query.order_by(Venue.state, Venue.city, Venue.id).all()
 
-  for venue in event_venue:
+  data = []
+  for (city, state), area_rows in groupby(rows, key=lambda row: (row[2], row[3])):
     data += [{
-      "city": venue.city,
-      "state": venue.state,
-      "venues":[{
-        "id": venue.id,
-        "name": venue.name,
-      }]
+      "city": city,
+      "state": state,
+      "venues": [{
+        "id": venue_id,
+        "name": name,
+        "num_upcoming_shows": num_upcoming_shows,
+      } for venue_id, name, _, _, num_upcoming_shows in area_rows]
     }]
 
-  return render_template('pages/venues.html', areas=data);
-
-@app.route('/venues/search', methods=['POST'])
+  return render_template('pages/venues.html', areas=data, genres=genres);
+
+@main.route('/venues/nearby')
+def nearby_venues():
+  # venues nearest a point or city first, within a radius; the bare page
+  # shows the search form only
+  if not any(request.args.get(name) for name in ('lat', 'lng', 'city')):
+    return render_template('pages/nearby_venues.html', venues=None, states=STATES)
+  latitude, longitude, radius, limit, upcoming = nearby_filters()
+  rows = nearby.find(
+    [Venue.name, Venue.city, Venue.state, Venue.address, Venue.upcoming_shows_count],
+    latitude, longitude, radius, limit, upcoming,
+  )
+  data = [{
+    "id": venue_id,
+    "name": name,
+    "city": city,
+    "state": state,
+    "address": address,
+    "num_upcoming_shows": upcoming_shows,
+    "distance_km": distance,
+  } for distance, (venue_id, name, city, state, address, upcoming_shows) in rows]
+  return render_template('pages/nearby_venues.html', venues=data, radius=radius, states=STATES)
+
+@main.route('/venues/<int:venue_id>/matches')
+def venue_matches(venue_id):
+  return match_page("venue", venue_id)
+
+@main.route('/venues/search', methods=['POST'])
 def search_venues():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for Hop should return "The Musical Hop".
-  # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  search_request = request.form.get('search_term', '')
-  word = format(search_request.lower())
-  search_query = '%{}%'.format(word)
-
-  by_name = Venue.name.ilike(search_query)
-  by_city = Venue.city.ilike(search_query)
-  by_state = Venue.state.ilike(search_query)
-
-  results = Venue.query.filter(by_name | by_city | by_state).all()
-
-  response = {
-    'count':len(results),
-    'data': results
-  }
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
-
-@app.route('/venues/<int:venue_id>')
+  # case-insensitive partial match on name, city and state, served from the
+  # trigram indexes on Postgres and the in-process index elsewhere.
+  search_term = request.form.get('search_term', '')
+  response = search.find(Venue, search_term)
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
+
+@main.route('/venues/<int:venue_id>')
+@conditional(venue_validator)
+@cached_page('venue')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
-  venue_info = Venue.query.filter_by(id=venue_id).first()
+  # the venue, its genres and its shows (one indexed query on
+  # (venue_id, start_time)) are independent, so gather can run them side by side
+  venue_info, _genres, show_data = gather(
+    lambda: Venue.query.filter_by(id=venue_id).first(),
+    lambda: genre_names(venue_genres, "venue_id", venue_id),
+    lambda: db.session.query(Show.start_time, Artist.id, Artist.name, Artist.image_link).join(Artist, Show.artist_id == Artist.id).filter(Show.venue_id == venue_id).order_by(Show.start_time).all(),
+  )
+  if venue_info is None:
+    abort(404)
 
   _id = venue_info.id
   _name = venue_info.name
-  _genres = venue_info.genres.split(", ")
   _address = venue_info.address
   _city = venue_info.city
   _state = venue_info.state
@@ -116,34 +603,12 @@ def show_venue(venue_id):
   _seeking_talent = venue_info.seeking_talent
   _seeking_description = venue_info.seeking_description
   _image_link = venue_info.image_link
-  _upcoming_shows = []
-  _past_shows = []
-
-  past_data = db.session.query(Show.start_time, Artist.id, Artist.name, Artist.image_link).join(Venue, Artist).filter(Show.start_time < datetime.today(), Show.venue_id==venue_info.id).all()
-  upcoming_data = db.session.query(Show.start_time, Artist.id, Artist.name, Artist.image_link).join(Venue, Artist).filter(Show.start_time > datetime.today(), Show.venue_id==venue_info.id).all()
-
-  for start_time, artist_id, artist_name, image_link in upcoming_data:
-    _upcoming_shows += [
-      {
-        "artist_id": artist_id,
-        "artist_name": artist_name,
-        "artist_image_link": image_link,
-        "start_time": str(start_time)
-      }
-    ]
 
-  
-  for start_time, artist_id, artist_name, image_link in past_data:
-    _past_shows += [
-      {
-        "artist_id": artist_id,
-        "artist_name": artist_name,
-        "artist_image_link": image_link,
-        "start_time": str(start_time)
-      }
-    ]
+  # split into past and upcoming in a single pass
+  _past_shows, _upcoming_shows = split_shows(show_data, ("artist_id", "artist_name", "artist_image_link"))
+  if _upcoming_shows:
+    expire_at(_upcoming_shows[0]["start_time"])
 
-  
   data={
     "id": _id,
     "name": _name,
@@ -159,20 +624,20 @@ def show_venue(venue_id):
     "image_link": _image_link,
     "past_shows": _past_shows,
     "upcoming_shows": _upcoming_shows,
-    "past_shows_count": len(past_data),
-    "upcoming_shows_count": len(upcoming_data),
+    "past_shows_count": len(_past_shows),
+    "upcoming_shows_count": len(_upcoming_shows),
   }
   return render_template('pages/show_venue.html', venue=data)
 
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@main.route('/venues/create', methods=['GET'])
 def create_venue_form():
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/create', methods=['POST'])
+@main.route('/venues/create', methods=['POST'])
 def create_venue_submission():
   # TODO: insert form data as a new Venue record in the db, instead
   # TODO: modify data to be the data object returned from db insertion
@@ -183,12 +648,15 @@ def create_venue_submission():
     state = request.form.get('state')
     phone = request.form.get('phone')
     address = request.form.get('address')
-    genres = ", ".join(request.form.getlist('genres'))
+    genres = Genre.named(request.form.getlist('genres'))
     facebook_link = request.form.get('facebook_link')
     image_link = request.form.get('image_link')
     website_link = request.form.get('website_link')
     seeking_talent = request.form.get('seeking_talent', type=bool)
     seeking_description = request.form.get('seeking_description')
+    latitude, longitude = nearby.locate(
+      city, state, request.form.get('latitude', type=float), request.form.get('longitude', type=float)
+    )
 
     venue = Venue()
     venue.name = name
@@ -202,9 +670,14 @@ def create_venue_submission():
     venue.website = website_link
     venue.seeking_talent = seeking_talent
     venue.seeking_description = seeking_description
+    venue.latitude = latitude
+    venue.longitude = longitude
+    venue.genre_mask = genre_mask(genre.id for genre in genres)
 
 
     db.session.add(venue)
+    db.session.flush()
+    matches.refresh('venue', venue.id)
     db.session.commit()
   except:
     error = True
@@ -223,65 +696,72 @@ def create_venue_submission():
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@main.route('/venues/<int:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
   # TODO: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
-  error = False
+  # the venue's shows and genre links go with it, in set-based statements
   try:
-    delete_venues = Venue.query.get(venue_id)
-    db.session.delete(delete_venues)
-    db.session.commit()
-  except:
+    deleted = delete_entities("venue", [venue_id])
+  except SQLAlchemyError:
     db.session.rollback()
+    current_app.logger.exception('Deleting venue %s failed', venue_id)
+    abort(500)
   finally:
     db.session.close()
+  if not deleted:
+    abort(404)
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
-  if not error:
-        return render_template('pages/home.html'), 200
-  else:
-    abort(500)
+  return render_template('pages/home.html'), 200
+
+@main.route('/venues/delete', methods=['POST'])
+def delete_venues():
+  return delete_batch("venue")
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@main.route('/artists')
+@conditional(listing_validator(Artist))
 def artists():
-  # TODO: replace with real data returned from querying the database
-  data = db.session.query(Artist).all()
-  return render_template('pages/artists.html', artists=data)
-
-@app.route('/artists/search', methods=['POST'])
+  # ?genre=Jazz&genre=Blues narrows the list to artists tagged with both
+  genres = request.args.getlist('genre')
+  query = db.session.query(Artist.id, Artist.name, Artist.upcoming_shows_count)
+  if genres:
+    query = query.filter(Artist.id.in_(tagged_with(artist_genres, 'artist_id', genres)))
+  data = query.order_by(Artist.id).all()
+  return render_template('pages/artists.html', artists=data, genres=genres)
+
+@main.route('/artists/delete', methods=['POST'])
+def delete_artists():
+  return delete_batch("artist")
+
+@main.route('/artists/search', methods=['POST'])
 def search_artists():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
-  # search for "band" should return "The Wild Sax Band".
-  search_request = request.form.get('search_term', '')
-  word = format(search_request.lower())
-  search_query = '%{}%'.format(word)
-
-  by_name = Artist.name.ilike(search_query)
-  by_city = Artist.city.ilike(search_query)
-  by_state = Artist.state.ilike(search_query)
-
-  results = Artist.query.filter(by_name | by_city | by_state).all()
-
-  response = {
-    'count':len(results),
-    'data': results
-  }
-  
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
-
-@app.route('/artists/<int:artist_id>')
+  # case-insensitive partial match on name, city and state, served from the
+  # trigram indexes on Postgres and the in-process index elsewhere.
+  search_term = request.form.get('search_term', '')
+  response = search.find(Artist, search_term)
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
+
+@main.route('/artists/<int:artist_id>')
+@conditional(artist_validator)
+@cached_page('artist')
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
   # TODO: replace with real artist data from the artist table, using artist_id
-  artist_info = Artist.query.filter_by(id=artist_id).first()
+  # the artist, its genres and its shows (one indexed query on
+  # (artist_id, start_time)) are independent, so gather can run them side by side
+  artist_info, _genres, show_data = gather(
+    lambda: Artist.query.filter_by(id=artist_id).first(),
+    lambda: genre_names(artist_genres, "artist_id", artist_id),
+    lambda: db.session.query(Show.start_time, Venue.id, Venue.name, Venue.image_link).join(Venue, Show.venue_id == Venue.id).filter(Show.artist_id == artist_id).order_by(Show.start_time).all(),
+  )
+  if artist_info is None:
+    abort(404)
 
   _id = artist_info.id
   _name = artist_info.name
-  _genres = artist_info.genres.split(", ")
   _city = artist_info.city
   _state = artist_info.state
   _phone = artist_info.phone
@@ -290,34 +770,12 @@ def show_artist(artist_id):
   _seeking_venue = artist_info.seeking_venue
   _seeking_description = artist_info.seeking_description
   _image_link = artist_info.image_link
-  _upcoming_shows = []
-  _past_shows = []
 
-  past_data = db.session.query(Show.start_time, Venue.id, Venue.name, Venue.image_link).join(Venue, Artist).filter(Show.start_time < datetime.today(),Show.artist_id==artist_info.id).all()
-  upcoming_data = db.session.query(Show.start_time, Venue.id, Venue.name, Venue.image_link).join(Venue, Artist).filter(Show.start_time > datetime.today(),Show.artist_id==artist_info.id).all()
-  
+  # split into past and upcoming in a single pass
+  _past_shows, _upcoming_shows = split_shows(show_data, ("venue_id", "venue_name", "venue_image_link"))
+  if _upcoming_shows:
+    expire_at(_upcoming_shows[0]["start_time"])
 
-  for start_time, venue_id, venue_name, image_link in upcoming_data:
-    _upcoming_shows += [
-      {
-        "venue_id": venue_id,
-        "venue_name": venue_name,
-        "venue_image_link": image_link,
-        "start_time": str(start_time)
-      }
-    ]
-
-  
-  for start_time, venue_id, venue_name, image_link in past_data:
-    _past_shows += [
-      {
-        "venue_id": venue_id,
-        "venue_name": venue_name,
-        "venue_image_link": image_link,
-        "start_time": str(start_time)
-      }
-    ]
-  
   data={
     "id": _id,
     "name": _name,
@@ -332,22 +790,26 @@ def show_artist(artist_id):
     "image_link": _image_link,
     "past_shows": _past_shows,
     "upcoming_shows": _upcoming_shows,
-    "past_shows_count": len(past_data),
-    "upcoming_shows_count": len(upcoming_data),
+    "past_shows_count": len(_past_shows),
+    "upcoming_shows_count": len(_upcoming_shows),
   }
   
   
   return render_template('pages/show_artist.html', artist=data)
 
+@main.route('/artists/<int:artist_id>/matches')
+def artist_matches(artist_id):
+  return match_page("artist", artist_id)
+
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@main.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
   form = ArtistForm()
   artist = Artist.query.get(artist_id)
 
   form.name.data = artist.name
-  form.genres.data = artist.genres
+  form.genres.data = [genre.name for genre in artist.genres]
   form.city.data = artist.city
   form.state.data = artist.state
   form.phone.data = artist.phone
@@ -357,47 +819,60 @@ def edit_artist(artist_id):
   form.seeking_description.data = artist.seeking_description
   form.image_link.data = artist.image_link
   # TODO: populate form with fields from artist with ID <artist_id>
-  return render_template('forms/edit_artist.html', form=form, artist=artist)
+  return render_template('forms/edit_artist.html', form=form, artist=artist, version=artist.version)
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@main.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
   # TODO: take values from the form submitted, and update existing
   # artist record with ID <artist_id> using the new attributes
   form = ArtistForm(request.form)
+  values = {
+    'name': form.name.data,
+    'city': form.city.data,
+    'state': form.state.data,
+    'phone': form.phone.data,
+    'image_link': form.image_link.data,
+    'facebook_link': form.facebook_link.data,
+    'website': form.website_link.data,
+    'seeking_venue': form.seeking_venue.data,
+    'seeking_description': form.seeking_description.data,
+  }
   try:
-    artist = Artist.query.get(artist_id)
-    if request.method == 'POST':
-      artist.name = form.name.data
-      artist.city = form.city.data
-      artist.state = form.state.data
-      artist.phone = form.phone.data
-      artist.genres = ", ".join(form.genres.data)
-      artist.image_link = form.image_link.data
-      artist.facebook_link = form.facebook_link.data
-      artist.website = form.website_link.data
-      artist.seeking_venue = form.seeking_venue.data
-      artist.seeking_description = form.seeking_description.data
-      
-    db.session.add(artist)
-    db.session.commit()
-    flash('Artist ' + request.form['name'] + ' was successfully updated!')
-  except:
+    outcome = edit_entity('artist', artist_id, request.form.get('version', type=int), values, form.genres.data)
+    if outcome == 'updated':
+      page_cache.invalidate(*artist_pages(artist_id))
+  except SQLAlchemyError:
     db.session.rollback()
-    flash('An error occurred. Artist ' + request.form['name'] + ' could not be updated.')
+    current_app.logger.exception('Editing artist %s failed', artist_id)
+    outcome = 'failed'
   finally:
     db.session.close()
-  return redirect(url_for('show_artist', artist_id=artist_id))
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+  if outcome is None:
+    abort(404)
+  if outcome == 'conflict':
+    # the submitted values stay in the form, against the current version
+    artist = Artist.query.get(artist_id)
+    flash('Artist ' + artist.name + ' was changed by someone else meanwhile. Check the page and submit again to overwrite.')
+    return render_template('forms/edit_artist.html', form=form, artist=artist, version=artist.version), 409
+  if outcome == 'failed':
+    flash('An error occurred. Artist ' + request.form['name'] + ' could not be updated.')
+  else:
+    flash('Artist ' + request.form['name'] + ' was successfully updated!')
+  return redirect(url_for('.show_artist', artist_id=artist_id))
+
+@main.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
   form = VenueForm()
   venue = Venue.query.get(venue_id)
 
   form.name.data = venue.name
-  form.genres.data = venue.genres
+  form.genres.data = [genre.name for genre in venue.genres]
   form.city.data = venue.city
   form.state.data = venue.state
   form.address.data = venue.address
+  form.latitude.data = venue.latitude
+  form.longitude.data = venue.longitude
   form.phone.data = venue.phone
   form.website_link.data = venue.website
   form.facebook_link.data = venue.facebook_link
@@ -406,48 +881,60 @@ def edit_venue(venue_id):
   form.image_link.data = venue.image_link
   
   # TODO: populate form with values from venue with ID <venue_id>
-  return render_template('forms/edit_venue.html', form=form, venue=venue)
+  return render_template('forms/edit_venue.html', form=form, venue=venue, version=venue.version)
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@main.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
 
   form = VenueForm(request.form)
+  values = {
+    'name': form.name.data,
+    'city': form.city.data,
+    'state': form.state.data,
+    'address': form.address.data,
+    'phone': form.phone.data,
+    'image_link': form.image_link.data,
+    'facebook_link': form.facebook_link.data,
+    'website': form.website_link.data,
+    'seeking_talent': form.seeking_talent.data,
+    'seeking_description': form.seeking_description.data,
+  }
   try:
-    venue = Venue.query.get(venue_id)
-    if request.method == 'POST':
-      venue.name = form.name.data
-      venue.city = form.city.data
-      venue.state = form.state.data
-      venue.address = form.address.data
-      venue.phone = form.phone.data
-      venue.genres = ", ".join(form.genres.data)
-      venue.image_link = form.image_link.data
-      venue.facebook_link = form.facebook_link.data
-      venue.website = form.website_link.data
-      venue.seeking_talent = form.seeking_talent.data
-      venue.seeking_description = form.seeking_description.data
-      
-      db.session.add(venue)
-      db.session.commit()
-      flash('venue ' + request.form['name'] + ' was successfully updated!')
-  except:
+    values['latitude'], values['longitude'] = nearby.locate(form.city.data, form.state.data, form.latitude.data, form.longitude.data)
+    outcome = edit_entity('venue', venue_id, request.form.get('version', type=int), values, form.genres.data)
+    if outcome == 'updated':
+      page_cache.invalidate(*venue_pages(venue_id))
+  except SQLAlchemyError:
     db.session.rollback()
-    flash('An error occurred. Venue ' + request.form['name'] + ' could not be updated.')
+    current_app.logger.exception('Editing venue %s failed', venue_id)
+    outcome = 'failed'
   finally:
     db.session.close()
+
+  if outcome is None:
+    abort(404)
+  if outcome == 'conflict':
+    # the submitted values stay in the form, against the current version
+    venue = Venue.query.get(venue_id)
+    flash('Venue ' + venue.name + ' was changed by someone else meanwhile. Check the page and submit again to overwrite.')
+    return render_template('forms/edit_venue.html', form=form, venue=venue, version=venue.version), 409
+  if outcome == 'failed':
+    flash('An error occurred. Venue ' + request.form['name'] + ' could not be updated.')
+  else:
+    flash('venue ' + request.form['name'] + ' was successfully updated!')
   # TODO: take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
-  return redirect(url_for('show_venue', venue_id=venue_id))
+  return redirect(url_for('.show_venue', venue_id=venue_id))
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@main.route('/artists/create', methods=['GET'])
 def create_artist_form():
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
-@app.route('/artists/create', methods=['POST'])
+@main.route('/artists/create', methods=['POST'])
 def create_artist_submission():
     
   # called upon submitting the new artist listing form
@@ -460,7 +947,7 @@ def create_artist_submission():
     city = request.form.get('city')
     state = request.form.get('state')
     phone = request.form.get('phone')
-    genres = ", ".join(request.form.getlist('genres'))
+    genres = Genre.named(request.form.getlist('genres'))
     facebook_link = request.form.get('facebook_link')
     image_link = request.form.get('image_link')
     website_link = request.form.get('website_link')
@@ -478,8 +965,11 @@ def create_artist_submission():
     data.website=website_link
     data.seeking_venue= seeking_venue
     data.seeking_description=seeking_description
+    data.genre_mask=genre_mask(genre.id for genre in genres)
 
     db.session.add(data)
+    db.session.flush()
+    matches.refresh('artist', data.id)
     db.session.commit()
 
   except:
@@ -501,85 +991,280 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@main.route('/shows')
+@conditional(shows_validator)
 def shows():
   # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  #data = Show.query.all()
-  all_shows = Show.query.order_by('id').all()
-  
-  data = []
+  # one joined query for the page, keyset-paginated on (start_time, id) so
+  # the cost of a page does not grow with the size of the Show table.
+  per_page = current_app.config.get('SHOWS_PER_PAGE', 30)
+  cursor = request.args.get('cursor')
+
+  query = db.session.query(
+    Show.id,
+    Show.start_time,
+    Artist.id,
+    Artist.name,
+    Artist.image_link,
+    Venue.id,
+    Venue.name,
+  ).join(Artist, Show.artist_id == Artist.id).join(Venue, Show.venue_id == Venue.id)
+
+  if cursor:
+    after = decode_cursor(cursor)
+    if after is None:
+      abort(400)
+    query = query.filter(tuple_(Show.start_time, Show.id) > tuple_(*after))
+
+  rows = query.order_by(Show.start_time, Show.id).limit(per_page + 1).all()
+  next_cursor = None
+  if len(rows) > per_page:
+    rows = rows[:per_page]
+    next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
 
-  for show in all_shows:
-    name = Artist.query.filter_by(id=show.artist_id).first()
-    venue = Venue.query.filter_by(id=show.venue_id).first()
+  data = []
+  for show_id, start_time, artist_id, artist_name, artist_image_link, venue_id, venue_name in rows:
     data += [{
-      "artist_id": name.id,
-      "artist_name": name.name,
-      "venue_id": venue.id,
-      "venue_name": venue.name,
-      "start_time": str(show.start_time)
+      "artist_id": artist_id,
+      "artist_name": artist_name,
+      "artist_image_link": artist_image_link,
+      "venue_id": venue_id,
+      "venue_name": venue_name,
+      "start_time": start_time
     }]
-  return render_template('pages/shows.html', shows=data)
-
-@app.route('/shows/create')
+  return render_template('pages/shows.html', shows=data, next_cursor=next_cursor)
+
+@main.route('/shows/calendar')
+@conditional(calendar_validator)
+def show_calendar():
+  # shows in a date range, optionally in one city, at one venue, by one
+  # artist or in some genres; grouped by day and keyset-paginated like /shows
+  per_page = current_app.config.get('SHOWS_PER_PAGE', 30)
+  query, first_day, last_day = calendar_filters(db.session.query(
+    Show.id,
+    Show.start_time,
+    Artist.id,
+    Artist.name,
+    Artist.image_link,
+    Venue.id,
+    Venue.name,
+    Venue.city,
+    Venue.state,
+  ).join(Artist, Show.artist_id == Artist.id).join(Venue, Show.venue_id == Venue.id))
+
+  cursor = request.args.get('cursor')
+  if cursor:
+    after = decode_cursor(cursor)
+    if after is None:
+      abort(400)
+    query = query.filter(tuple_(Show.start_time, Show.id) > tuple_(*after))
+
+  rows = query.order_by(Show.start_time, Show.id).limit(per_page + 1).all()
+  next_cursor = None
+  if len(rows) > per_page:
+    rows = rows[:per_page]
+    next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+
+  days = []
+  for day, group in groupby(rows, key=lambda row: row[1].date()):
+    days.append((datetime.combine(day, time.min), [{
+      "artist_id": artist_id,
+      "artist_name": artist_name,
+      "artist_image_link": artist_image_link,
+      "venue_id": venue_id,
+      "venue_name": venue_name,
+      "venue_city": venue_city,
+      "venue_state": venue_state,
+      "start_time": start_time
+    } for _, start_time, artist_id, artist_name, artist_image_link, venue_id, venue_name, venue_city, venue_state in group]))
+  # the filters carried over to the next page
+  args = {name: values for name, values in request.args.lists() if name != 'cursor'}
+  return render_template('pages/calendar.html', days=days, start=first_day, end=last_day,
+    args=args, genres=GENRES, states=STATES, next_cursor=next_cursor)
+
+@main.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+@main.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   # TODO: insert form data as a new Show record in the db, instead
-  error = False
+  # the same checks as the batch form: the artist and venue must exist and
+  # neither may already be booked for that time
+  form = ShowForm(request.form)
   try:
-    artist = request.form.get('artist_id')
-    venue = request.form.get('venue_id')
-    time = request.form.get('start_time')
-
-    data = Show()
-    data.artist_id = artist
-    data.venue_id = venue
-    data.start_time = str(time)
-
-    db.session.add(data)
-    db.session.commit()
+    created, errors = schedule_shows([{
+      "artist_id": form.artist_id.data,
+      "venue_id": form.venue_id.data,
+      "start_time": request.form.get('start_time'),
+      "duration": form.duration.data,
+    }])
   except:
-    error = True
     db.session.rollback()
     print(sys.exc_info())
-  finally:
-    db.session.close()
-  if not error:
-    flash('Show was successfully listed!')
-  else:
     flash('An error occurred. Show could not be listed.')
     abort(500)
+  finally:
+    db.session.close()
+  if errors:
+    flash('Show could not be listed: {}.'.format(errors[0][1]))
+    return render_template('forms/new_show.html', form=form), 400
+  flash('Show was successfully listed!')
   # on successful db insert, flash success
   # TODO: on unsuccessful db insert, flash an error instead.
   # e.g., flash('An error occurred. Show could not be listed.')
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
-@app.errorhandler(404)
+@main.route('/shows/batch')
+def create_show_batch():
+  form = BatchShowForm()
+  return render_template('forms/new_show_batch.html', form=form, errors=[])
+
+@main.route('/shows/batch', methods=['POST'])
+def create_show_batch_submission():
+  # many shows in one transaction, from the batch form or as JSON:
+  #   {"shows": [{"artist_id": 1, "venue_id": 2, "start_time": "...", "duration": 90}], "partial": true}
+  # with `partial`, valid rows are saved and the rest reported per row
+  limit = current_app.config.get('SHOW_BATCH_MAX_ROWS', 1000)
+  if request.is_json:
+    payload = request.get_json(silent=True)
+    shows = payload.get("shows") if isinstance(payload, dict) else None
+    if not isinstance(shows, list) or not all(isinstance(show, dict) for show in shows):
+      return jsonify({"error": "expected a list of shows"}), 400
+    rows = shows
+    partial = bool(payload.get("partial"))
+  else:
+    form = BatchShowForm(request.form)
+    rows = []
+    for line in csv.reader(io.StringIO(form.rows.data or '')):
+      if not any(column.strip() for column in line):
+        continue
+      line = [column.strip() for column in line] + ['', '', '', '']
+      rows.append({
+        "artist_id": line[0] or form.artist_id.data,
+        "venue_id": line[1] or form.venue_id.data,
+        "start_time": line[2],
+        "duration": line[3] or form.duration.data,
+      })
+    partial = form.partial.data
+
+  if not rows or len(rows) > limit:
+    message = "List between 1 and {} shows at once.".format(limit)
+    if request.is_json:
+      return jsonify({"error": message}), 400
+    flash(message)
+    return render_template('forms/new_show_batch.html', form=form, errors=[]), 400
+
+  try:
+    created, errors = schedule_shows(rows, partial)
+  except Exception:
+    db.session.rollback()
+    raise
+  finally:
+    db.session.close()
+
+  errors = [{"row": number, "error": message} for number, message in errors]
+  status = 400 if errors and not created else 200 if errors else 201
+  if request.is_json:
+    return jsonify({"created": created, "errors": errors}), status
+
+  if created:
+    flash('{} shows were successfully listed!'.format(created))
+  if not errors:
+    return render_template('pages/home.html'), status
+  if not created:
+    flash('No shows were listed. Fix the rows below and submit again.')
+  return render_template('forms/new_show_batch.html', form=form, errors=errors), status
+
+#  Genres
+#  ----------------------------------------------------------------
+
+@main.route('/genres')
+def genre_facets():
+  # facet counts per genre; ?genre= restricts them to venues/artists that
+  # already carry all of the given genres
+  genres = request.args.getlist('genre')
+  return jsonify({
+    "venues": genre_counts(venue_genres, 'venue_id', genres),
+    "artists": genre_counts(artist_genres, 'artist_id', genres),
+  })
+
+#  Cache
+#  ----------------------------------------------------------------
+
+@main.route('/cache/stats')
+def cache_stats():
+  # hit/miss counters for sizing PAGE_CACHE_MAX_ENTRIES and PAGE_CACHE_TTL
+  return jsonify(page_cache.stats())
+
+#  Metrics
+#  ----------------------------------------------------------------
+
+@main.route('/metrics')
+def prometheus_metrics():
+  # per-endpoint request, SQL, render and size histograms for Prometheus
+  return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
+#----------------------------------------------------------------------------#
+# App Config.
+#----------------------------------------------------------------------------#
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+def create_app(config_object=None):
+    # builds a configured app; importing this module does no database I/O,
+    # the engine connects on the first query. Schema changes go through
+    # `flask db upgrade`.
+    app = Flask(__name__)
+    app.config.from_object(config_object or config.load())
+    moment.init_app(app)
+    db.init_app(app)
+    migrate.init_app(app, db)
+    cache.init_app(app)
+    search.init_app(app)
+    nearby.init_app(app)
+    parallel.init_app(app)
+    metrics.init_app(app)
+    audit.init_app(app)
+    assets.init_app(app)
+
+    app.jinja_env.filters['datetime'] = format_datetime
+
+    # api.py reuses the helpers above, so it is imported once they exist
+    from api import api
+    app.register_blueprint(main)
+    app.register_blueprint(api)
+    app.cli.add_command(import_command)
+    app.cli.add_command(counters.counters_cli)
+    app.cli.add_command(assets.assets_cli)
+    app.cli.add_command(nearby.geo_cli)
+    app.cli.add_command(matches.matches_cli)
+
+    app.register_error_handler(404, not_found_error)
+    app.register_error_handler(500, server_error)
+
+    # every app logs through the same 'app' logger, so the file handler is
+    # attached once; test runs leave error.log alone
+    log_path = os.path.abspath('error.log')
+    logging_to_file = any(getattr(handler, 'baseFilename', None) == log_path for handler in app.logger.handlers)
+    if not app.debug and not app.testing and not logging_to_file:
+        file_handler = FileHandler(log_path)
+        file_handler.setFormatter(
+            Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+        )
+        app.logger.setLevel(logging.INFO)
+        file_handler.setLevel(logging.INFO)
+        app.logger.addHandler(file_handler)
+        app.logger.info('errors')
+    return app
 
 #----------------------------------------------------------------------------#
 # Launch.
@@ -587,11 +1272,11 @@ if not app.debug:
 
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 '''
@@ -0,0 +1,230 @@
+#assets: fingerprinted, precompressed static files
+#
+#   flask assets build
+#
+# The build copies every file under static/ to static/dist/ with a content
+# hash in its name (css/main.css -> css/main.3f9c2a81d0b4.css), rewrites url()
+# references inside stylesheets to the hashed names, and writes .gz (and .br
+# when the Brotli package is installed) next to each compressible file. The
+# mapping goes to static/dist/manifest.json. Templates link assets through
+# asset_url('css/main.css'): with a manifest that is /assets/<hashed name>,
+# served with the best encoding the browser accepts and cached for a year;
+# without one (no build yet) it falls back to /static.
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+from threading import Lock
+
+import click
+from flask import Blueprint, abort, current_app, request, send_from_directory, url_for
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_DIR = 'dist'
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+COMPRESSIBLE = ('.css', '.js', '.map', '.json', '.svg', '.eot', '.ttf', '.otf', '.txt')
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+ONE_YEAR = 365 * 24 * 3600
+
+assets = Blueprint('assets', __name__, url_prefix='/assets')
+
+
+#----------------------------------------------------------------------------#
+# Build.
+#----------------------------------------------------------------------------#
+
+def source_files(static_dir):
+    # static-relative paths with '/' separators, stylesheets last so the
+    # files they reference are already hashed. An unminified file is left
+    # out when its .min twin exists (bootstrap.css next to bootstrap.min.css).
+    found = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(name for name in dirs if os.path.join(root, name) != os.path.join(static_dir, BUILD_DIR))
+        for name in sorted(files):
+            stem, ext = os.path.splitext(name)
+            if not stem.endswith('.min') and stem + '.min' + ext in files:
+                continue
+            found.append(posixpath.join(*os.path.relpath(os.path.join(root, name), static_dir).split(os.sep)))
+    return sorted(found, key=lambda path: (path.endswith('.css'), path))
+
+
+def rewrite_urls(stylesheet, path, hashed):
+    # url(../fonts/x.woff?v=1#y) -> url(../fonts/x.<hash>.woff?v=1#y), for
+    # references to files already in `hashed`
+    folder = posixpath.dirname(path)
+
+    def replace(match):
+        quote, reference = match.groups()
+        target, suffix = re.match(r'([^?#]*)(.*)', reference).groups()
+        if not target or re.match(r'^(?:[a-z]+:|/)', target):
+            return match.group(0)
+        resolved = posixpath.normpath(posixpath.join(folder, target))
+        if resolved not in hashed:
+            return match.group(0)
+        return 'url({0}{1}{2}{0})'.format(quote, posixpath.relpath(hashed[resolved], folder or '.'), suffix)
+
+    return CSS_URL.sub(replace, stylesheet.decode('utf-8')).encode('utf-8')
+
+
+def compressed_variants(data):
+    # [(encoding, suffix, bytes)] worth keeping, i.e. smaller than the original
+    variants = [('gzip', '.gz', gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        variants.append(('br', '.br', brotli.compress(data, quality=11)))
+    return [variant for variant in variants if len(variant[2]) < len(data)]
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as target:
+        target.write(data)
+
+
+def previous_encodings(dist_dir):
+    try:
+        with open(os.path.join(dist_dir, MANIFEST), encoding='utf-8') as source:
+            encodings = json.load(source)['encodings']
+    except (OSError, ValueError, KeyError):
+        return {}
+    return {
+        name: available for name, available in encodings.items()
+        if os.path.isfile(os.path.join(dist_dir, *name.split('/')))
+    }
+
+
+def build(static_dir):
+    # returns the manifest: {'assets': {path: hashed path},
+    # 'encodings': {hashed path: [encoding, ...]}, 'sizes': {encoding: bytes}}
+    dist_dir = os.path.join(static_dir, BUILD_DIR)
+    hashed = {}
+    # files from earlier builds stay servable, so pages rendered before a
+    # deploy can still load theirs
+    encodings = previous_encodings(dist_dir)
+    sizes = {'identity': 0}
+    for path in source_files(static_dir):
+        with open(os.path.join(static_dir, *path.split('/')), 'rb') as source:
+            data = source.read()
+        if path.endswith('.css'):
+            data = rewrite_urls(data, path, hashed)
+
+        stem, ext = posixpath.splitext(path)
+        hashed[path] = '{}.{}{}'.format(stem, hashlib.sha256(data).hexdigest()[:HASH_LENGTH], ext)
+        target = os.path.join(dist_dir, *hashed[path].split('/'))
+        write_file(target, data)
+        sizes['identity'] += len(data)
+
+        encodings[hashed[path]] = []
+        if ext.lower() in COMPRESSIBLE:
+            for encoding, suffix, variant in compressed_variants(data):
+                write_file(target + suffix, variant)
+                encodings[hashed[path]].append(encoding)
+                sizes[encoding] = sizes.get(encoding, 0) + len(variant)
+
+    manifest = {'assets': hashed, 'encodings': encodings, 'sizes': sizes}
+    # swapped in last, once every file it names exists
+    partial = os.path.join(dist_dir, MANIFEST + '.tmp')
+    write_file(partial, json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+    os.replace(partial, os.path.join(dist_dir, MANIFEST))
+    return manifest
+
+
+#----------------------------------------------------------------------------#
+# Manifest and serving.
+#----------------------------------------------------------------------------#
+
+class Manifest(object):
+    # the built manifest, read once (and again when it changes in debug mode)
+
+    EMPTY = {'assets': {}, 'encodings': {}}
+
+    def __init__(self):
+        self.lock = Lock()
+        self.path = None
+        self.loaded_at = None
+        self.data = None
+
+    def get(self):
+        app = current_app
+        if self.data is not None and not app.debug:
+            return self.data
+        path = os.path.join(app.static_folder, BUILD_DIR, MANIFEST)
+        try:
+            modified = os.stat(path).st_mtime
+        except OSError:
+            modified = None
+        with self.lock:
+            if self.data is None or path != self.path or modified != self.loaded_at:
+                data = self.EMPTY
+                if modified is not None:
+                    with open(path, encoding='utf-8') as source:
+                        data = json.load(source)
+                self.path, self.loaded_at, self.data = path, modified, data
+            return self.data
+
+
+manifest = Manifest()
+
+
+def asset_url(path):
+    hashed = manifest.get()['assets'].get(path)
+    if hashed is None:
+        return url_for('static', filename=path)
+    return url_for('assets.serve', filename=hashed)
+
+
+@assets.route('/<path:filename>')
+def serve(filename):
+    available = manifest.get()['encodings'].get(filename)
+    if available is None:
+        abort(404)
+    accepted = request.accept_encodings
+    encoding = next((encoding for encoding in ('br', 'gzip') if encoding in available and accepted[encoding]), None)
+    suffix = {'br': '.br', 'gzip': '.gz'}.get(encoding, '')
+
+    response = send_from_directory(
+        os.path.join(current_app.static_folder, BUILD_DIR), filename + suffix,
+        max_age=ONE_YEAR,
+        etag=True,
+        # the type comes from the uncompressed name
+        download_name=posixpath.basename(filename),
+    )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if available:
+        response.vary.add('Accept-Encoding')
+    # the name changes whenever the content does
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    app.register_blueprint(assets)
+    app.jinja_env.globals['asset_url'] = asset_url
+
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+assets_cli = AppGroup('assets', help='Build fingerprinted static files.')
+
+
+@assets_cli.command('build')
+def build_command():
+    """Hash and precompress everything under static/ into static/dist/."""
+    built = build(current_app.static_folder)
+    sizes = built['sizes']
+    click.echo('{} files, {:.0f} KiB'.format(len(built['assets']), sizes['identity'] / 1024.0) + ''.join(
+        ', {} {:.0f} KiB'.format(encoding, sizes[encoding] / 1024.0) for encoding in ('gzip', 'br') if encoding in sizes
+    ))
+    if brotli is None:
+        click.echo('Brotli is not installed; only .gz variants were written', err=True)
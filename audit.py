@@ -0,0 +1,139 @@
+#audit: per-request N+1 and slow query detection
+#
+# Every statement run while handling a request is fingerprinted (literals and
+# IN lists collapsed) and counted. A fingerprint repeated more than
+# QUERY_AUDIT_REPEAT_THRESHOLD times is reported as a likely N+1, and any
+# statement slower than QUERY_AUDIT_SLOW_MS as slow, together with the view
+# code that issued it. With QUERY_AUDIT_STRICT on (the test profile) an N+1
+# fails the request instead, so a per-row query added to a view breaks CI.
+import os
+import re
+import sys
+import time
+from functools import lru_cache
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PARAMETERS = re.compile(r'\?|%\(\w+\)s|%s')
+PARAMETER_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+WHITESPACE = re.compile(r'\s+')
+
+SKIPPED_PATHS = (os.path.realpath(__file__), os.sep + 'site-packages' + os.sep)
+
+
+class QueryAuditError(AssertionError):
+    pass
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(statement):
+    # the same query with different values or IN list lengths -> one fingerprint
+    statement = LITERALS.sub('?', statement)
+    statement = PARAMETERS.sub('?', statement)
+    statement = PARAMETER_LISTS.sub('(?)', statement)
+    return WHITESPACE.sub(' ', statement).strip()
+
+
+@lru_cache(maxsize=1024)
+def real_path(path):
+    # code filenames and the app root may reach the same file through
+    # different symlinks or relative parts; generated code ('<string>',
+    # '<frozen ...>') has no file and is left alone
+    return os.path.realpath(path) if os.path.isabs(path) else path
+
+
+def origin():
+    # innermost frame in the project's own code (views, helpers, templates)
+    root = os.path.join(real_path(current_app.root_path), '')
+    frame = sys._getframe(1)
+    while frame is not None:
+        path = real_path(frame.f_code.co_filename)
+        if path.startswith(root) and not any(skipped in path for skipped in SKIPPED_PATHS):
+            return '{} ({}:{})'.format(frame.f_code.co_name, os.path.relpath(path, root), frame.f_lineno)
+        frame = frame.f_back
+    return 'unknown'
+
+
+class RequestAudit(object):
+    __slots__ = ('counts', 'origins', 'slow')
+
+    def __init__(self):
+        self.counts = {}
+        self.origins = {}
+        self.slow = []
+
+    def repeated(self, threshold):
+        return [
+            (count, statement, self.origins.get(statement, 'unknown'))
+            for statement, count in self.counts.items() if count > threshold
+        ]
+
+    def merge(self, other):
+        # a query worker's counts (parallel.gather); a statement repeated
+        # only across workers is reported without its origin
+        for statement, count in other.counts.items():
+            self.counts[statement] = self.counts.get(statement, 0) + count
+        for statement, where in other.origins.items():
+            self.origins.setdefault(statement, where)
+        self.slow.extend(other.slow)
+
+
+def current():
+    if has_app_context():
+        return g.get('query_audit')
+    return None
+
+
+#----------------------------------------------------------------------------#
+# Hooks.
+#----------------------------------------------------------------------------#
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['audit_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    audit = current()
+    if audit is None:
+        return
+    elapsed = time.perf_counter() - conn.info['audit_started']
+
+    key = fingerprint(statement)
+    count = audit.counts[key] = audit.counts.get(key, 0) + 1
+    # the stack is only walked for statements that get reported
+    if count == current_app.config['QUERY_AUDIT_REPEAT_THRESHOLD'] + 1:
+        audit.origins[key] = origin()
+    if elapsed * 1000 > current_app.config['QUERY_AUDIT_SLOW_MS']:
+        audit.slow.append((elapsed, key, origin()))
+
+
+def start_query_audit():
+    if current_app.config.get('QUERY_AUDIT_ENABLED', True):
+        g.query_audit = RequestAudit()
+
+
+def report_query_audit(response):
+    audit = g.pop('query_audit', None)
+    if audit is None:
+        return response
+
+    for elapsed, statement, where in audit.slow:
+        current_app.logger.warning('Slow query (%.0f ms) in %s at %s: %s', elapsed * 1000, request.endpoint, where, statement)
+
+    repeated = audit.repeated(current_app.config['QUERY_AUDIT_REPEAT_THRESHOLD'])
+    for count, statement, where in repeated:
+        current_app.logger.warning('Possible N+1: %d identical queries in %s at %s: %s', count, request.endpoint, where, statement)
+    if repeated and current_app.config.get('QUERY_AUDIT_STRICT'):
+        count, statement, where = repeated[0]
+        raise QueryAuditError('{} ran {} identical queries at {}: {}'.format(request.endpoint, count, where, statement))
+    return response
+
+
+def init_app(app):
+    app.before_request(start_query_audit)
+    app.after_request(report_query_audit)
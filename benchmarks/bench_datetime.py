@@ -0,0 +1,44 @@
+#benchmark: per-row cost of the `datetime` filter on a 1,000-show page
+#
+#   python benchmarks/bench_datetime.py [rows] [repeat]
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from filters import format_datetime
+
+
+def legacy_format_datetime(value, format='medium'):
+    # the filter as it was: every call re-parses a string and the pattern
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format, locale='en')
+
+
+def main(rows=1000, repeat=5):
+    start = datetime(2026, 1, 1, 20, 0)
+    start_times = [start + timedelta(hours=6 * i) for i in range(rows)]
+
+    cases = [
+        ('legacy: str() + dateutil + babel', lambda: [legacy_format_datetime(str(value), 'full') for value in start_times]),
+        ('filter: native datetime', lambda: [format_datetime(value, 'full') for value in start_times]),
+    ]
+    assert cases[0][1]() == cases[1][1]()
+
+    print('{} rows, best of {}'.format(rows, repeat))
+    for name, case in cases:
+        best = min(timeit.repeat(case, number=1, repeat=repeat))
+        print('  {:<36} {:8.2f} ms/page {:8.2f} us/row'.format(name, best * 1e3, best * 1e6 / rows))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
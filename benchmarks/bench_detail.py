@@ -0,0 +1,51 @@
+#benchmark: detail pages with serial vs concurrent queries
+#
+#   python benchmarks/bench_detail.py [--query-delay 5] [--iterations 50]
+#
+# Adds a fixed delay to every statement, standing in for a network round trip
+# to the database, and times the venue and artist detail routes with
+# CONCURRENT_DETAIL_QUERIES off and on. Serial latency grows with the number
+# of queries; concurrent latency with the slowest one. Uses the catalogue
+# seeded by routes.py (run that first).
+import argparse
+import random
+
+from routes import app, db, measure, routes, inject_delay, QueryCounter
+from models import Venue, Artist
+
+ENDPOINTS = ['main.show_venue', 'main.show_artist', 'api.show_venue', 'api.show_artist']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare serial and concurrent detail page queries.')
+    parser.add_argument('--query-delay', type=float, default=5, help='milliseconds added to every statement')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    args = parser.parse_args()
+
+    app.extensions['page_cache'].ttl = 0
+    with app.app_context():
+        venues = db.session.query(Venue.id).count()
+        artists = db.session.query(Artist.id).count()
+        db.session.remove()
+    if not venues or not artists:
+        raise SystemExit('no benchmark data; run benchmarks/routes.py first')
+
+    counter = QueryCounter(db.get_engine(app))
+    inject_delay(db.get_engine(app), args.query_delay)
+    client = app.test_client()
+
+    print('{} ms per statement'.format(args.query_delay))
+    for name in ENDPOINTS:
+        results = {}
+        for concurrent in (False, True):
+            app.config['CONCURRENT_DETAIL_QUERIES'] = concurrent
+            method, url, data = routes(random.Random(2), venues, artists)[name]
+            results[concurrent] = measure(client, counter, method, url, data, args.iterations, args.warmup)
+        serial, parallel = results[False], results[True]
+        print('{:<18} serial p50 {:>8.2f} ms  concurrent p50 {:>8.2f} ms  {:>5.2f}x  ({} queries)'.format(
+            name, serial['p50_ms'], parallel['p50_ms'], serial['p50_ms'] / parallel['p50_ms'], serial['queries']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#benchmark: import, app creation and first-request time in a fresh process
+#
+#   python benchmarks/bench_startup.py [--runs 10]
+#
+# Each run starts a new interpreter (like a CLI command or a forked worker
+# would), times `import app`, `create_app()` and a first request to `/`, and
+# counts database connections opened along the way. Importing and creating
+# the app are expected to open none.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+connections = []
+event.listen(Pool, 'connect', lambda *args: connections.append(1))
+imported = time.perf_counter()
+import app
+after_import = time.perf_counter()
+application = app.create_app()
+after_create = time.perf_counter()
+connections_before_request = len(connections)
+application.test_client().get('/')
+after_request = time.perf_counter()
+print(json.dumps({
+    'import_ms': (after_import - imported) * 1000,
+    'create_app_ms': (after_create - after_import) * 1000,
+    'first_request_ms': (after_request - after_create) * 1000,
+    'connections_at_startup': connections_before_request,
+}))
+'''
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold start of the app in fresh processes.')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('FYYUR_CONFIG', 'sqlite')
+
+    samples = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        output = subprocess.check_output([sys.executable, '-c', CHILD], cwd=ROOT, env=env)
+        sample = json.loads(output.decode().strip().splitlines()[-1])
+        sample['process_ms'] = (time.perf_counter() - started) * 1000
+        samples.append(sample)
+
+    for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'process_ms'):
+        print('{:<18} median {:>8.1f} ms'.format(key, median([sample[key] for sample in samples])))
+    connections = max(sample['connections_at_startup'] for sample in samples)
+    print('{:<18} {}'.format('db connections', connections))
+    if connections:
+        sys.exit('importing or creating the app opened a database connection')
+
+
+if __name__ == '__main__':
+    main()
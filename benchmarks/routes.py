@@ -0,0 +1,424 @@
+#benchmark: every route against a seeded synthetic catalogue
+#
+#   python benchmarks/routes.py --venues 10000 --artists 50000 --shows 1000000
+#   python benchmarks/routes.py --baseline benchmarks/results.json
+#
+# Seeds a local SQLite database (BENCH_DATABASE_URL to use another one) once,
+# then drives each route through the Flask test client and records p50/p95
+# latency, queries per request and peak Python memory. Results are written as
+# JSON; with --baseline the run fails when a route got slower or chattier.
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault('FYYUR_CONFIG', 'sqlite')
+os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL', 'sqlite:///' + os.path.join(ROOT, 'benchmarks', 'bench.db'))
+
+from sqlalchemy import event, func
+
+from app import create_app
+import assets
+import counters
+import matches
+from extensions import db
+from forms import GENRES, STATES
+from models import Venue, Artist, Show, venue_genres, artist_genres
+
+app = create_app()
+
+CITIES = ['San Francisco', 'New York', 'Austin', 'Chicago', 'Seattle', 'Nashville',
+          'New Orleans', 'Denver', 'Portland', 'Atlanta', 'Boston', 'Detroit']
+CITY_CENTRES = {
+    'San Francisco': (37.77, -122.42), 'New York': (40.71, -74.01), 'Austin': (30.27, -97.74),
+    'Chicago': (41.88, -87.63), 'Seattle': (47.61, -122.33), 'Nashville': (36.16, -86.78),
+    'New Orleans': (29.95, -90.07), 'Denver': (39.74, -104.99), 'Portland': (45.52, -122.68),
+    'Atlanta': (33.75, -84.39), 'Boston': (42.36, -71.06), 'Detroit': (42.33, -83.05),
+}
+WORDS = ['Blue', 'Red', 'Golden', 'Velvet', 'Electric', 'Hollow', 'Silver', 'Wild',
+         'Midnight', 'Lucky', 'Broken', 'Crystal', 'Dusty', 'Neon', 'Rolling']
+VENUE_NOUNS = ['Room', 'Hall', 'Lounge', 'Tavern', 'Club', 'Theatre', 'Garage', 'Loft']
+ARTIST_NOUNS = ['Band', 'Trio', 'Collective', 'Orchestra', 'Project', 'Kings', 'Sisters']
+
+
+#----------------------------------------------------------------------------#
+# Seeding.
+#----------------------------------------------------------------------------#
+
+def entity_rows(count, nouns, flag, rng):
+    for row_id in range(1, count + 1):
+        city = rng.choice(CITIES)
+        yield {
+            'id': row_id,
+            'name': '{} {} {}'.format(rng.choice(WORDS), rng.choice(nouns), row_id),
+            'city': city,
+            'state': rng.choice(STATES),
+            'phone': '555-{:03d}-{:04d}'.format(rng.randrange(1000), rng.randrange(10000)),
+            'image_link': 'https://example.com/{}.jpg'.format(row_id),
+            'facebook_link': 'https://www.facebook.com/{}'.format(row_id),
+            'website': 'https://example.com/{}'.format(row_id),
+            flag: rng.random() < 0.3,
+            'seeking_description': 'Looking for something new.',
+        }
+
+
+def insert_batches(table, rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+    db.session.commit()
+
+
+def seed(venues, artists, shows, batch_size=20000, seed_value=1):
+    rng = random.Random(seed_value)
+    started = time.perf_counter()
+
+    def venue_row(row):
+        # scattered around the city centre, most within 20 km
+        latitude, longitude = CITY_CENTRES[row['city']]
+        return dict(row, address='{} Main St'.format(row['id']),
+                    latitude=rng.gauss(latitude, 0.1), longitude=rng.gauss(longitude, 0.1))
+
+    venue_rows = (venue_row(row) for row in entity_rows(venues, VENUE_NOUNS, 'seeking_talent', rng))
+    insert_batches(Venue.__table__, venue_rows, batch_size)
+    insert_batches(Artist.__table__, entity_rows(artists, ARTIST_NOUNS, 'seeking_venue', rng), batch_size)
+
+    for table, owner, count in ((venue_genres, 'venue_id', venues), (artist_genres, 'artist_id', artists)):
+        links = (
+            {owner: row_id, 'genre_id': genre_id}
+            for row_id in range(1, count + 1)
+            for genre_id in rng.sample(range(1, len(GENRES) + 1), rng.randint(1, 3))
+        )
+        insert_batches(table, links, batch_size)
+
+    # shows spread over a year either side of now, one evening show per venue
+    # and per artist a day at most, so the catalogue has no double bookings:
+    # each venue's shows fall on distinct days, and on any one day distinct
+    # venues map to distinct artists (given no more venues than artists)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def show_row(position):
+        venue_id = position % venues + 1
+        day = (position // venues * 7 + venue_id) % 730
+        start_time = today + timedelta(days=day - 365, hours=rng.randint(18, 21), minutes=rng.choice((0, 15, 30, 45)))
+        return {
+            'artist_id': (venue_id + day * 37) % artists + 1,
+            'venue_id': venue_id,
+            'start_time': start_time,
+            'end_time': start_time + timedelta(minutes=rng.choice((60, 90, 120, 150))),
+        }
+
+    show_rows = (show_row(position) for position in range(shows))
+    insert_batches(Show.__table__, show_rows, batch_size)
+    # the show counters are filled in by one recount instead of per batch
+    counters.drift(repair=True)
+    # genre masks and match lists from the seeded links and shows
+    matches.rebuild()
+    print('seeded {} venues, {} artists, {} shows in {:.1f}s'.format(venues, artists, shows, time.perf_counter() - started))
+
+
+#----------------------------------------------------------------------------#
+# Routes.
+#----------------------------------------------------------------------------#
+
+def routes(rng, venues, artists):
+    venue = lambda: rng.randint(1, venues)
+    artist = lambda: rng.randint(1, artists)
+    term = lambda: rng.choice(WORDS)[:rng.randint(2, 5)].lower()
+    genre = lambda: rng.choice(GENRES)
+
+    def window():
+        # a random week within the seeded year either side of now
+        start = datetime.now().date() + timedelta(days=rng.randint(-365, 358))
+        return start.isoformat(), (start + timedelta(days=7)).isoformat()
+
+    def new_rows(model, count=1):
+        # fresh, show-less venues or artists for the delete routes to remove
+        with app.app_context():
+            ids = [
+                db.session.execute(model.__table__.insert(), {'name': 'Doomed', 'city': 'Austin', 'state': 'TX'}).inserted_primary_key[0]
+                for _ in range(count)
+            ]
+            db.session.commit()
+        return ids
+
+    new_venue = lambda: new_rows(Venue)[0]
+
+    def asset():
+        # the fingerprinted stylesheet once `flask assets build` has run,
+        # /static otherwise
+        with app.test_request_context():
+            return assets.asset_url('css/bootstrap.min.css')
+
+    venue_form = lambda: {'name': 'Bench Venue', 'city': rng.choice(CITIES), 'state': rng.choice(STATES),
+                          'address': '1 Bench St', 'genres': [genre()], 'facebook_link': 'https://www.facebook.com/bench'}
+    artist_form = lambda: {'name': 'Bench Artist', 'city': rng.choice(CITIES), 'state': rng.choice(STATES),
+                           'genres': [genre()], 'facebook_link': 'https://www.facebook.com/bench'}
+
+    def stored_venue_form():
+        # venue 1's edit form submitted as loaded, which writes nothing
+        with app.app_context():
+            row = Venue.query.get(1)
+            form = {'name': row.name, 'city': row.city, 'state': row.state, 'address': row.address or '',
+                    'phone': row.phone or '', 'image_link': row.image_link or '', 'facebook_link': row.facebook_link or '',
+                    'website_link': row.website or '', 'seeking_description': row.seeking_description or '',
+                    'genres': [genre.name for genre in row.genres], 'version': row.version}
+            if row.seeking_talent:
+                form['seeking_talent'] = 'y'
+            db.session.close()
+        return form
+
+    def near():
+        # a point in one of the seeded cities
+        latitude, longitude = CITY_CENTRES[rng.choice(CITIES)]
+        return 'lat={:.4f}&lng={:.4f}'.format(latitude + rng.uniform(-0.2, 0.2), longitude + rng.uniform(-0.2, 0.2))
+
+    def revalidate(path):
+        # a repeat view: If-None-Match from an earlier response for the URL
+        def headers():
+            return {'If-None-Match': app.test_client().get(path).headers.get('ETag', '')}
+        return headers
+
+    # endpoint -> (method, url factory, form data factory[, headers factory])
+    return {
+        'main.index': ('GET', lambda: '/', None),
+        'main.venues': ('GET', lambda: '/venues', None),
+        'main.venues?genre': ('GET', lambda: '/venues?genre={}'.format(genre()), None),
+        'main.venues?revalidate': ('GET', lambda: '/venues', None, revalidate('/venues')),
+        'main.nearby_venues': ('GET', lambda: '/venues/nearby?' + near(), None),
+        'main.nearby_venues?upcoming': ('GET', lambda: '/venues/nearby?upcoming=1&' + near(), None),
+        'main.nearby_venues?radius': ('GET', lambda: '/venues/nearby?radius=5&limit=1000&' + near(), None),
+        'main.search_venues': ('POST', lambda: '/venues/search', lambda: {'search_term': term()}),
+        'main.show_venue': ('GET', lambda: '/venues/{}'.format(venue()), None),
+        'main.venue_matches': ('GET', lambda: '/venues/{}/matches'.format(venue()), None),
+        'main.show_venue?revalidate': ('GET', lambda: '/venues/1', None, revalidate('/venues/1')),
+        'main.create_venue_form': ('GET', lambda: '/venues/create', None),
+        'main.create_venue_submission': ('POST', lambda: '/venues/create', venue_form),
+        'main.delete_venue': ('DELETE', lambda: '/venues/{}'.format(new_venue()), None),
+        'main.delete_venues': ('POST', lambda: '/venues/delete', lambda: {'ids': new_rows(Venue, 20)}),
+        'main.artists': ('GET', lambda: '/artists', None),
+        'main.artists?genre': ('GET', lambda: '/artists?genre={}'.format(genre()), None),
+        'main.delete_artists': ('POST', lambda: '/artists/delete', lambda: {'ids': new_rows(Artist, 20)}),
+        'main.search_artists': ('POST', lambda: '/artists/search', lambda: {'search_term': term()}),
+        'main.show_artist': ('GET', lambda: '/artists/{}'.format(artist()), None),
+        'main.artist_matches': ('GET', lambda: '/artists/{}/matches'.format(artist()), None),
+        'main.show_artist?revalidate': ('GET', lambda: '/artists/1', None, revalidate('/artists/1')),
+        'main.edit_artist': ('GET', lambda: '/artists/{}/edit'.format(artist()), None),
+        'main.edit_artist_submission': ('POST', lambda: '/artists/{}/edit'.format(artist()), artist_form),
+        'main.edit_venue': ('GET', lambda: '/venues/{}/edit'.format(venue()), None),
+        'main.edit_venue_submission': ('POST', lambda: '/venues/{}/edit'.format(venue()), venue_form),
+        'main.edit_venue_submission?unchanged': ('POST', lambda: '/venues/1/edit', stored_venue_form),
+        'main.create_artist_form': ('GET', lambda: '/artists/create', None),
+        'main.create_artist_submission': ('POST', lambda: '/artists/create', artist_form),
+        'main.shows': ('GET', lambda: '/shows', None),
+        'main.shows?revalidate': ('GET', lambda: '/shows', None, revalidate('/shows')),
+        'main.show_calendar': ('GET', lambda: '/shows/calendar?start={}&end={}'.format(*window()), None),
+        'main.show_calendar?city': ('GET', lambda: '/shows/calendar?start={}&end={}&city={}'.format(*window(), rng.choice(CITIES)), None),
+        'main.show_calendar?genre': ('GET', lambda: '/shows/calendar?start={}&end={}&genre={}'.format(*window(), genre()), None),
+        'main.show_calendar?venue': ('GET', lambda: '/shows/calendar?start={}&end={}&venue_id={}'.format(*window(), venue()), None),
+        'main.create_shows': ('GET', lambda: '/shows/create', None),
+        'main.create_show_submission': ('POST', lambda: '/shows/create', lambda: {
+            'artist_id': artist(), 'venue_id': venue(),
+            'start_time': (datetime.now() + timedelta(days=rng.randint(1, 365))).strftime('%Y-%m-%d %H:%M:%S')}),
+        'main.create_show_batch': ('GET', lambda: '/shows/batch', None),
+        'main.create_show_batch_submission': ('POST', lambda: '/shows/batch', lambda: {'rows': '\n'.join(
+            '{}, {}, {}'.format(artist(), venue(), (datetime.now() + timedelta(days=day)).strftime('%Y-%m-%d 20:00'))
+            for day in range(1, 41))}),
+        'main.genre_facets': ('GET', lambda: '/genres', None),
+        'main.cache_stats': ('GET', lambda: '/cache/stats', None),
+        'main.prometheus_metrics': ('GET', lambda: '/metrics', None),
+        'assets.serve': ('GET', asset, None),
+        'api.show_calendar': ('GET', lambda: '/api/v1/shows/calendar?start={}&end={}'.format(*window()), None),
+        'api.venues': ('GET', lambda: '/api/v1/venues', None),
+        'api.nearby_venues': ('GET', lambda: '/api/v1/venues/nearby?' + near(), None),
+        'api.show_venue': ('GET', lambda: '/api/v1/venues/{}'.format(venue()), None),
+        'api.venue_matches': ('GET', lambda: '/api/v1/venues/{}/matches'.format(venue()), None),
+        'api.venue_conflicts': ('GET', lambda: '/api/v1/venues/{}/conflicts?start={}&end={}'.format(venue(), *window()), None),
+        'api.artists': ('GET', lambda: '/api/v1/artists', None),
+        'api.show_artist': ('GET', lambda: '/api/v1/artists/{}'.format(artist()), None),
+        'api.artist_matches': ('GET', lambda: '/api/v1/artists/{}/matches'.format(artist()), None),
+        'api.artist_conflicts': ('GET', lambda: '/api/v1/artists/{}/conflicts?start={}&end={}'.format(artist(), *window()), None),
+        'api.shows': ('GET', lambda: '/api/v1/shows', None),
+    }
+
+
+class QueryCounter(object):
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def inject_delay(engine, milliseconds):
+    # simulates a database round trip of `milliseconds` on every statement
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        time.sleep(milliseconds / 1000)
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(client, counter, method, url, data, iterations, warmup, headers=None):
+    # latency passes run without tracemalloc; one extra traced request
+    # gives the query count and peak memory
+    def prepare():
+        # built before the clock starts, so setup work is not measured
+        return url(), data() if data else None, headers() if headers else None
+
+    def call(request):
+        response = client.open(request[0], method=method, data=request[1], headers=request[2])
+        response.get_data()
+        return response.status_code
+
+    for _ in range(warmup):
+        call(prepare())
+
+    timings = []
+    statuses = set()
+    for _ in range(iterations):
+        request = prepare()
+        started = time.perf_counter()
+        statuses.add(call(request))
+        timings.append((time.perf_counter() - started) * 1000)
+
+    request = prepare()
+    counter.count = 0
+    tracemalloc.start()
+    call(request)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'queries': counter.count,
+        'peak_kib': round(peak / 1024, 1),
+        'status': sorted(statuses),
+    }
+
+
+def compare(results, baseline, tolerance):
+    # a route regresses when its p95 grows by more than `tolerance` (and by at
+    # least a millisecond, to ignore noise on fast routes) or it issues more
+    # queries per request than before
+    regressions = []
+    for name, current in results['routes'].items():
+        previous = baseline['routes'].get(name)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance) and current['p95_ms'] - previous['p95_ms'] > 1:
+            regressions.append('{}: p95 {} ms -> {} ms'.format(name, previous['p95_ms'], current['p95_ms']))
+        if current['queries'] > previous['queries']:
+            regressions.append('{}: {} -> {} queries'.format(name, previous['queries'], current['queries']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every route against a seeded catalogue.')
+    parser.add_argument('--venues', type=int, default=10000)
+    parser.add_argument('--artists', type=int, default=50000)
+    parser.add_argument('--shows', type=int, default=1000000, help='at most 730 per venue')
+    parser.add_argument('--reseed', action='store_true', help='drop and re-seed the benchmark database')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--only', action='append', help='benchmark only these endpoints')
+    parser.add_argument('--page-cache', action='store_true', help='leave the detail page cache on')
+    parser.add_argument('--query-delay', type=float, default=0, help='milliseconds added to every statement')
+    parser.add_argument('--serial-detail', action='store_true', help='run detail page queries one after another')
+    parser.add_argument('--output', default=os.path.join(ROOT, 'benchmarks', 'results.json'))
+    parser.add_argument('--baseline', help='fail if routes regressed against this results file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 growth against the baseline')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    if not args.page_cache:
+        app.extensions['page_cache'].ttl = 0
+    if args.serial_detail:
+        app.config['CONCURRENT_DETAIL_QUERIES'] = False
+
+    with app.app_context():
+        # a scratch database: created from the models rather than migrations
+        if args.reseed:
+            db.drop_all()
+        db.create_all()
+        if db.session.query(func.count(Venue.id)).scalar() == 0:
+            seed(args.venues, args.artists, args.shows)
+        counts = {
+            'venues': db.session.query(func.count(Venue.id)).scalar(),
+            'artists': db.session.query(func.count(Artist.id)).scalar(),
+            'shows': db.session.query(func.count(Show.id)).scalar(),
+        }
+        db.session.remove()
+
+    rng = random.Random(2)
+    table = routes(rng, counts['venues'], counts['artists'])
+    missing = sorted(set(rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint != 'static')
+                     - set(name.split('?')[0] for name in table))
+    if missing:
+        print('warning: no benchmark for {}'.format(', '.join(missing)))
+
+    counter = QueryCounter(db.get_engine(app))
+    if args.query_delay:
+        inject_delay(db.get_engine(app), args.query_delay)
+    client = app.test_client()
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'database': db.get_engine(app).url.get_backend_name(),
+            'iterations': args.iterations,
+            'query_delay_ms': args.query_delay,
+            'concurrent_detail': app.config['CONCURRENT_DETAIL_QUERIES'],
+            'dataset': counts,
+        },
+        'routes': {},
+    }
+    for name, route in table.items():
+        if args.only and name not in args.only:
+            continue
+        method, url, data = route[:3]
+        headers = route[3] if len(route) > 3 else None
+        result = measure(client, counter, method, url, data, args.iterations, args.warmup, headers)
+        results['routes'][name] = result
+        print('{:<32} p50 {:>9.2f} ms  p95 {:>9.2f} ms  {:>4} queries  {:>9.1f} KiB peak'.format(
+            name, result['p50_ms'], result['p95_ms'], result['queries'], result['peak_kib']))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as source:
+            baseline = json.load(source)
+
+    with open(args.output, 'w') as target:
+        json.dump(results, target, indent=2, sort_keys=True)
+    print('results written to {}'.format(args.output))
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#bookings: double-booking detection for venues and artists
+#
+# A show occupies [start_time, end_time) both at its venue and for its
+# artist. On Postgres the exclusion constraints (models.SHOW_EXCLUSIONS) keep
+# GiST indexes over those ranges and overlaps are found with `&&` queries.
+# Other databases read the shows that could overlap through the
+# (venue_id, start_time) and (artist_id, start_time) indexes on every check,
+# so bookings committed by other processes are always seen; a batch is
+# checked against an IntervalTree built from one such query per kind.
+from bisect import bisect_left
+from datetime import timezone
+
+from sqlalchemy import and_, func, or_
+
+from extensions import db
+from models import Show
+
+OWNERS = {
+    'venue': Show.venue_id,
+    'artist': Show.artist_id,
+}
+
+
+def naive(value):
+    # SQLite hands back naive timestamps; aware ones are compared in local
+    # time, like the database does
+    if value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def utc(value):
+    # what bookings are compared by: naive timestamps are local time (see
+    # models.ShowTime), aware ones keep their offset
+    return value.astimezone(timezone.utc)
+
+
+class IntervalTree(object):
+    # static interval tree over (start, end, ...) tuples. The intervals
+    # are sorted by start and read as an implicit balanced search tree (the
+    # middle of every range is its root); max_end[i] is the latest end in the
+    # subtree rooted at i, which lets a query skip subtrees that end too early.
+
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals)
+        self.max_end = [None] * len(self.intervals)
+        self.build(0, len(self.intervals))
+
+    def build(self, low, high):
+        if low >= high:
+            return None
+        middle = (low + high) // 2
+        latest = self.intervals[middle][1]
+        for child in (self.build(low, middle), self.build(middle + 1, high)):
+            if child is not None and child > latest:
+                latest = child
+        self.max_end[middle] = latest
+        return latest
+
+    def overlapping(self, start, end):
+        # intervals with interval start < end and interval end > start, in
+        # start order
+        found = []
+        self.search(0, len(self.intervals), start, end, found)
+        return found
+
+    def search(self, low, high, start, end, found):
+        if low >= high:
+            return
+        middle = (low + high) // 2
+        if self.max_end[middle] <= start:
+            return
+        self.search(low, middle, start, end, found)
+        interval = self.intervals[middle]
+        if interval[0] >= end:
+            return
+        if interval[1] > start:
+            found.append(interval)
+        self.search(middle + 1, high, start, end, found)
+
+    def __len__(self):
+        return len(self.intervals)
+
+
+def on_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def overlaps(kind, owner_id, start_time, end_time):
+    # served by the exclusion constraint's GiST index
+    return and_(
+        OWNERS[kind] == owner_id,
+        func.tstzrange(Show.start_time, Show.end_time).op('&&')(func.tstzrange(start_time, end_time)),
+    )
+
+
+def overlapping(kind, owner_id, start_time, end_time):
+    # [(show_id, start_time, end_time)] of the venue's or artist's shows that
+    # overlap [start_time, end_time), in start order
+    if on_postgres():
+        condition = overlaps(kind, owner_id, start_time, end_time)
+    else:
+        condition = and_(OWNERS[kind] == owner_id, Show.start_time < end_time, Show.end_time > start_time)
+    rows = db.session.query(Show.id, Show.start_time, Show.end_time).filter(condition).order_by(Show.start_time, Show.id)
+    return [tuple(row) for row in rows]
+
+
+def trees_for(kind, rows, spans):
+    # {owner_id: tree} of the shows that may overlap one of the rows, read
+    # with one query over the (owner, start_time) index. Intervals are
+    # (utc start, utc end, show_id, start_time, end_time).
+    column = OWNERS[kind]
+    intervals = {show[kind + '_id']: [] for _, show in rows}
+    earliest = min(rows, key=lambda row: spans[row[0]][0])[1]['start_time']
+    latest = max(rows, key=lambda row: spans[row[0]][1])[1]['end_time']
+    found = db.session.query(column, Show.start_time, Show.end_time, Show.id).filter(
+        column.in_(intervals), Show.start_time < latest, Show.end_time > earliest
+    )
+    for owner_id, start_time, end_time, show_id in found:
+        intervals[owner_id].append((utc(start_time), utc(end_time), show_id, start_time, end_time))
+    return {owner_id: IntervalTree(owned) for owner_id, owned in intervals.items()}
+
+
+def clashes(shows):
+    # pairs of show ids that overlap, from (show_id, start_time, end_time)
+    # tuples in start order
+    pairs = []
+    active = []
+    for show in shows:
+        active = [other for other in active if other[2] > show[1]]
+        pairs.extend((other[0], show[0]) for other in active)
+        active.append(show)
+    return pairs
+
+
+def describe(kind, owner_id, show_id, start_time, end_time):
+    return '{} {} is already booked from {:%Y-%m-%d %H:%M} to {:%Y-%m-%d %H:%M} (show {})'.format(
+        kind, owner_id, start_time, end_time, show_id)
+
+
+def check(rows):
+    # rows: (number, show) pairs for new shows, each a dict with artist_id,
+    # venue_id, start_time and end_time. Returns (number, message) for every
+    # show overlapping an existing booking or an earlier row; existing
+    # bookings are fetched with one query per kind at most.
+    errors = {}
+    if not rows:
+        return []
+    spans = {number: (utc(show['start_time']), utc(show['end_time'])) for number, show in rows}
+
+    if on_postgres():
+        existing = db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_time, Show.end_time).filter(or_(*[
+            overlaps(kind, show[kind + '_id'], show['start_time'], show['end_time'])
+            for _, show in rows for kind in OWNERS
+        ])).all()
+        for number, show in rows:
+            start_time, end_time = spans[number]
+            for show_id, venue_id, artist_id, other_start, other_end in existing:
+                if number in errors or not (utc(other_start) < end_time and utc(other_end) > start_time):
+                    continue
+                for kind, owner_id in (('venue', venue_id), ('artist', artist_id)):
+                    if owner_id == show[kind + '_id']:
+                        errors[number] = describe(kind, owner_id, show_id, other_start, other_end)
+                        break
+    else:
+        for kind in OWNERS:
+            trees = trees_for(kind, rows, spans)
+            for number, show in rows:
+                if number in errors:
+                    continue
+                found = trees[show[kind + '_id']].overlapping(*spans[number])
+                if found:
+                    show_id, other_start, other_end = found[0][2:]
+                    errors[number] = describe(kind, show[kind + '_id'], show_id, other_start, other_end)
+
+    # the new shows must not overlap each other either. A venue's or
+    # artist's accepted rows are disjoint, so kept in start order only the
+    # neighbours of a new row can overlap it
+    accepted = {}
+    for number, show in rows:
+        if number in errors:
+            continue
+        start_time, end_time = spans[number]
+        keys = [(kind, show[kind + '_id']) for kind in OWNERS]
+        positions = [(key, bisect_left(accepted.setdefault(key, []), (start_time,))) for key in keys]
+        clash = next((
+            (other[2], key) for key, at in positions for other in accepted[key][max(at - 1, 0):at + 1]
+            if other[0] < end_time and other[1] > start_time
+        ), None)
+        if clash is not None:
+            errors[number] = 'overlaps row {} at {} {}'.format(clash[0], *clash[1])
+            continue
+        for key, at in positions:
+            accepted[key].insert(at, (start_time, end_time, number))
+    return sorted(errors.items())
+
@@ -0,0 +1,141 @@
+#cache: rendered-page cache for the venue and artist detail pages
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import current_app, g, session
+from werkzeug.local import LocalProxy
+
+
+class MemoryBackend(object):
+    # size-bounded, least-recently-used in-process store. Any object with the
+    # same get/set/delete/clear methods can be used as a backend instead.
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class PageCache(object):
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        # requests on several threads count into the same totals
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version=None):
+        # `version` is what the page was rendered from (its ETag); an entry
+        # rendered from anything else is stale
+        entry = self.backend.get(key)
+        if entry is not None:
+            expires_at, entry_version, body = entry
+            if time.time() <= expires_at and entry_version == version:
+                with self.lock:
+                    self.hits += 1
+                return body
+            self.backend.delete(key)
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, body, expires_at=None, version=None):
+        # entries live for ttl seconds, or less when the page itself says it
+        # goes stale sooner (an upcoming show turning into a past show)
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        self.backend.set(key, (deadline, version, body))
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self.lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'entries': len(self.backend) if hasattr(self.backend, '__len__') else None,
+        }
+
+
+def init_app(app, backend=None):
+    # each app gets its own cache, sized from its config
+    if backend is None:
+        backend = MemoryBackend(app.config.get('PAGE_CACHE_MAX_ENTRIES', 1024))
+    app.extensions['page_cache'] = PageCache(backend, app.config.get('PAGE_CACHE_TTL', 300))
+
+
+page_cache = LocalProxy(lambda: current_app.extensions['page_cache'])
+
+
+def page_key(kind, entity_id):
+    return '{}:{}'.format(kind, entity_id)
+
+
+def expire_at(start_time):
+    # lets a view cap its own cache entry, e.g. at its next upcoming show
+    g.page_expires_at = start_time.timestamp()
+
+
+def cached_page(kind):
+    # caches the rendered page of a `<kind>_id` detail view. Requests with
+    # pending flash messages are rendered fresh so the messages still show.
+    # Under @conditional an entry is only served for the ETag it was
+    # rendered under, so a write no path invalidated is never served
+    # under the new ETag.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if '_flashes' in session:
+                return view(**kwargs)
+
+            key = page_key(kind, kwargs[kind + '_id'])
+            version = g.get('page_etag')
+            body = page_cache.get(key, version)
+            if body is not None:
+                return body
+
+            g.page_expires_at = None
+            body = view(**kwargs)
+            if isinstance(body, str):
+                page_cache.set(key, body, g.page_expires_at, version)
+            return body
+        return wrapper
+    return decorator
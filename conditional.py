@@ -0,0 +1,141 @@
+#conditional: ETag / Last-Modified revalidation for pages
+#
+# @conditional(validator) runs validator(**view_args), one small query
+# returning the values a page depends on (updated_at maxima, Deletion
+# stamps, ...), before the view. The values, the URL and the site version
+# (template and asset manifest mtimes) make a weak ETag; the latest datetime
+# among them is the Last-Modified. A matching If-None-Match, or an
+# If-Modified-Since with no If-None-Match, gets a 304 without rendering.
+# Responses carry Cache-Control: no-cache, so browsers keep the page but
+# revalidate it on every view.
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from flask import current_app, g, make_response, request, session
+from sqlalchemy import event, update
+
+from extensions import db
+from models import Venue, Artist, Show, Deletion
+
+TRACKED = (Venue, Artist, Show)
+
+
+def to_utc(value):
+    # naive timestamps (SQLite, datetime.now()) are local time
+    return value.astimezone(timezone.utc)
+
+
+class SiteVersion(object):
+    # newest template or asset manifest mtime: a deploy or an assets build
+    # changes every page without touching the database. Read once, or on
+    # every request in debug mode.
+
+    def __init__(self):
+        self.value = None
+
+    def get(self):
+        if self.value is None or current_app.debug:
+            app = current_app
+            paths = [os.path.join(app.static_folder, 'dist', 'manifest.json')]
+            for root, _, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+                paths.extend(os.path.join(root, name) for name in files)
+            mtimes = [os.stat(path).st_mtime for path in paths if os.path.exists(path)]
+            self.value = datetime.fromtimestamp(max(mtimes or [0]), timezone.utc)
+        return self.value
+
+
+site_version = SiteVersion()
+
+
+def validators(values):
+    # (etag, last_modified) for a validator's values
+    version = site_version.get()
+    digest = hashlib.sha1(repr((request.full_path, version, tuple(values))).encode('utf-8')).hexdigest()
+    stamps = [to_utc(value) for value in values if isinstance(value, datetime)]
+    return digest[:32], max(stamps + [version]).replace(microsecond=0)
+
+
+def not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    return since is not None and last_modified <= since
+
+
+def conditional(validator):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # pending flash messages are part of the page
+            if '_flashes' in session:
+                return view(**kwargs)
+            values = validator(**kwargs)
+            if values is None:
+                # e.g. an unknown id; the view answers as usual
+                return view(**kwargs)
+
+            etag, last_modified = validators(values)
+            if not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                # the page cache keys its entries on this (cache.cached_page)
+                g.page_etag = etag
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            # a timestamp within the last second could still change without
+            # moving, so it is not offered as a validator yet (RFC 7232 2.2.2)
+            if last_modified < datetime.now(timezone.utc) - timedelta(seconds=1):
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+#----------------------------------------------------------------------------#
+# Keeping updated_at and Deletion current.
+#----------------------------------------------------------------------------#
+
+# Column changes set updated_at through its onupdate, including the counter
+# updates counters.py makes when a venue's or artist's shows change. A change
+# to a genres collection alone issues no UPDATE, so it is touched here.
+
+def touch_modified(session, flush_context, instances):
+    for instance in session.dirty:
+        if isinstance(instance, (Venue, Artist)) and session.is_modified(instance):
+            instance.updated_at = datetime.now()
+
+
+def note_deletion(connection, table_name):
+    connection.execute(update(Deletion.__table__).where(Deletion.table_name == table_name).values(deleted_at=datetime.now()))
+
+
+def note_deleted(connection, table_name):
+    # deleting venues or artists takes their shows along
+    note_deletion(connection, table_name)
+    if table_name != Show.__tablename__:
+        note_deletion(connection, Show.__tablename__)
+
+
+def note_deleted_row(mapper, connection, target):
+    note_deleted(connection, target.__tablename__)
+
+
+def note_bulk_delete(state):
+    # set-based deletes run through the session bypass the mapper events
+    if not state.is_delete:
+        return
+    table = getattr(state.statement, 'table', None)
+    if table is not None and table.name in [model.__tablename__ for model in TRACKED]:
+        note_deleted(state.session.connection(), table.name)
+
+
+for tracked in TRACKED:
+    event.listen(tracked, 'after_delete', note_deleted_row)
+
+event.listen(db.session, 'before_flush', touch_modified)
+event.listen(db.session, 'do_orm_execute', note_bulk_delete)
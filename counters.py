@@ -0,0 +1,196 @@
+#counters: denormalized upcoming/past show counts on Venue and Artist
+#
+#   flask counters rollover              # from cron, every few minutes
+#   flask counters check [--repair]
+#
+# Venue and Artist carry upcoming_shows_count and past_shows_count so that
+# listings never touch Show. Code that inserts or deletes shows with bulk
+# statements calls record() (or forget() when deleting venues or artists
+# with all their shows) in the same transaction; shows added or removed
+# through the ORM are counted by the mapper events below. A show counts as
+# upcoming while it starts at or after CounterClock.rolled_over_at. The
+# rollover moves the shows that started since its last run from upcoming to
+# past, which is a range scan on ix_Show_start_time_id, and advances the
+# clock; listed counts therefore lag real time by at most the cron interval.
+# Writers share-lock the clock row and the rollover locks it exclusively, so
+# on Postgres a show is never counted against the wrong clock.
+from collections import Counter
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, case, event, func, select, update
+
+from bookings import naive
+from extensions import db
+from models import Venue, Artist, Show, CounterClock
+
+OWNERS = {
+    'venue': (Venue, Show.venue_id),
+    'artist': (Artist, Show.artist_id),
+}
+
+
+def clock(connection, exclusive=False):
+    statement = select(CounterClock.rolled_over_at).where(CounterClock.id == 1)
+    return naive(connection.execute(statement.with_for_update(read=not exclusive)).scalar_one())
+
+
+def add_counts(connection, model, deltas):
+    # deltas: {owner_id: (upcoming, past)}, applied with one executemany.
+    # The statement goes straight to the connection: it is bookkeeping, not
+    # an edit the search index or booking cache should react to.
+    rows = [
+        {'owner_id': owner_id, 'upcoming': upcoming, 'past': past}
+        for owner_id, (upcoming, past) in deltas.items() if upcoming or past
+    ]
+    if rows:
+        connection.execute(update(model.__table__).where(model.id == bindparam('owner_id')).values(
+            upcoming_shows_count=model.upcoming_shows_count + bindparam('upcoming'),
+            past_shows_count=model.past_shows_count + bindparam('past'),
+        ), rows)
+
+
+def record(shows, sign=1, connection=None):
+    # shows: dicts (or objects) with venue_id, artist_id and start_time that
+    # were just inserted (sign=1) or deleted (sign=-1)
+    if not shows:
+        return
+    if connection is None:
+        connection = db.session.connection()
+    now = clock(connection)
+    for kind, (model, _) in OWNERS.items():
+        upcoming, past = Counter(), Counter()
+        for show in shows:
+            if isinstance(show, dict):
+                owner_id, start_time = show[kind + '_id'], show['start_time']
+            else:
+                owner_id, start_time = getattr(show, kind + '_id'), show.start_time
+            if naive(start_time) >= now:
+                upcoming[owner_id] += sign
+            else:
+                past[owner_id] += sign
+        add_counts(connection, model, {
+            owner_id: (upcoming[owner_id], past[owner_id]) for owner_id in set(upcoming) | set(past)
+        })
+
+
+def forget(kind, owner_ids, connection=None):
+    # call before deleting venues (or artists) together with their shows:
+    # takes those shows off the other side's counters with one aggregate
+    # instead of loading them
+    if connection is None:
+        connection = db.session.connection()
+    now = clock(connection)
+    column = OWNERS[kind][1]
+    other_model, other_column = OWNERS['artist' if kind == 'venue' else 'venue']
+    is_upcoming = case((Show.start_time >= now, 1), else_=0)
+    removed = connection.execute(
+        select(other_column, func.sum(is_upcoming), func.count()).where(column.in_(owner_ids)).group_by(other_column)
+    )
+    add_counts(connection, other_model, {
+        other_id: (-int(upcoming), int(upcoming) - count) for other_id, upcoming, count in removed
+    })
+
+
+def rollover(now=None):
+    # moves shows that started since the last rollover from upcoming to
+    # past; returns how many shows moved
+    connection = db.session.connection()
+    since = clock(connection, exclusive=True)
+    now = naive(now or datetime.now())
+    if now <= since:
+        db.session.rollback()
+        return 0
+
+    moved = 0
+    for model, column in OWNERS.values():
+        started = connection.execute(
+            select(column, func.count()).where(Show.start_time >= since, Show.start_time < now).group_by(column)
+        ).all()
+        add_counts(connection, model, {owner_id: (-count, count) for owner_id, count in started})
+        # every show has one venue and one artist: either kind sums to the total
+        moved = sum(count for _, count in started)
+    connection.execute(update(CounterClock.__table__).where(CounterClock.id == 1).values(rolled_over_at=now))
+    db.session.commit()
+    return moved
+
+
+def drift(repair=False):
+    # [(kind, owner_id, stored (upcoming, past), actual (upcoming, past))]
+    # for every venue and artist whose counters are wrong; with `repair` the
+    # actual counts are written back
+    connection = db.session.connection()
+    now = clock(connection, exclusive=True)
+    found = []
+    for kind, (model, column) in OWNERS.items():
+        is_upcoming = case((Show.start_time >= now, 1), else_=0)
+        actual = {
+            owner_id: (int(upcoming), count - int(upcoming))
+            for owner_id, upcoming, count in connection.execute(
+                select(column, func.sum(is_upcoming), func.count()).group_by(column)
+            )
+        }
+        stored = connection.execute(select(model.id, model.upcoming_shows_count, model.past_shows_count))
+        for owner_id, upcoming, past in stored:
+            counts = actual.get(owner_id, (0, 0))
+            if (upcoming, past) != counts:
+                found.append((kind, owner_id, (upcoming, past), counts))
+
+        wrong = [(owner_id, counts) for found_kind, owner_id, _, counts in found if found_kind == kind]
+        if repair and wrong:
+            connection.execute(update(model.__table__).where(model.id == bindparam('owner_id')).values(
+                upcoming_shows_count=bindparam('upcoming'),
+                past_shows_count=bindparam('past'),
+            ), [{'owner_id': owner_id, 'upcoming': upcoming, 'past': past} for owner_id, (upcoming, past) in wrong])
+    if repair:
+        db.session.commit()
+    else:
+        db.session.rollback()
+    return found
+
+
+#----------------------------------------------------------------------------#
+# Shows added or removed through the ORM.
+#----------------------------------------------------------------------------#
+
+def count_insert(mapper, connection, target):
+    record([target], 1, connection)
+
+
+def count_delete(mapper, connection, target):
+    record([target], -1, connection)
+
+
+event.listen(Show, 'after_insert', count_insert)
+event.listen(Show, 'after_delete', count_delete)
+
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+counters_cli = AppGroup('counters', help='Maintain the upcoming/past show counters.')
+
+
+@counters_cli.command('rollover')
+def rollover_command():
+    """Move shows that have started from upcoming to past."""
+    click.echo('{} shows rolled over'.format(rollover()))
+
+
+@counters_cli.command('check')
+@click.option('--repair', is_flag=True, help='Overwrite wrong counters with recounted values.')
+def check_command(repair):
+    """Recount every venue's and artist's shows and report drift."""
+    found = drift(repair)
+    for kind, owner_id, stored, actual in found[:20]:
+        click.echo('  {} {}: upcoming/past {}/{}, should be {}/{}'.format(kind, owner_id, *(stored + actual)), err=True)
+    if len(found) > 20:
+        click.echo('  ... {} more'.format(len(found) - 20), err=True)
+    if not found:
+        click.echo('counters are consistent')
+    elif repair:
+        click.echo('{} counters repaired'.format(len(found)))
+    else:
+        raise click.ClickException('{} counters drifted; run with --repair to fix them'.format(len(found)))
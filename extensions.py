@@ -0,0 +1,8 @@
+#extensions: Flask extensions, created unbound and attached in create_app
+from flask_migrate import Migrate
+from flask_moment import Moment
+from flask_sqlalchemy import SQLAlchemy
+
+db = SQLAlchemy()
+migrate = Migrate()
+moment = Moment()
@@ -1,3 +1,5 @@
+import os
+
 from fabric.api import local, settings, abort
 from fabric.contrib.console import confirm
 
@@ -13,6 +15,18 @@ def test():
         abort("Aborted at user request.")
 
 
+def bench(baseline="benchmarks/baseline.json"):
+    # route benchmarks against the seeded catalogue; fails on regressions
+    # against `baseline` when that file exists
+    command = "python benchmarks/routes.py"
+    if os.path.exists(baseline):
+        command += " --baseline " + baseline
+    with settings(warn_only=True):
+        result = local(command)
+    if result.failed and not confirm("Benchmarks regressed. Continue?"):
+        abort("Aborted at user request.")
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -0,0 +1,40 @@
+#filters: Jinja filters, kept free of app and database imports
+from datetime import datetime
+from functools import lru_cache
+
+import babel.dates
+import dateutil.parser
+from babel import Locale
+
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+
+@lru_cache(maxsize=64)
+def compiled_pattern(format, locale):
+    # parsing the pattern and loading the locale data are the expensive part
+    # of babel's format_datetime, so do both once per (format, locale)
+    pattern = DATETIME_FORMATS.get(format, format)
+    return babel.dates.parse_pattern(pattern), Locale.parse(locale)
+
+
+def to_datetime(value):
+    # views pass native datetimes; strings are still accepted, trying the
+    # strict ISO parser before falling back to dateutil's fuzzy one
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return dateutil.parser.parse(value)
+
+
+def format_datetime(value, format='medium', locale='en'):
+    date = to_datetime(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=babel.dates.UTC)
+    pattern, locale = compiled_pattern(format, locale)
+    return pattern.apply(date, locale)
+
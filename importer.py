@@ -0,0 +1,291 @@
+#importer: `flask import` bulk loader for venues, artists and shows
+#
+#   flask import venues venues.csv
+#   flask import artists artists.jsonl --batch-size 10000
+#   flask import shows shows.csv --rejects rejected.jsonl
+#
+# Files are read as a stream (CSV with a header row, or JSON lines) and
+# written in batched transactions: executemany for venues and artists, COPY
+# for shows on Postgres. Genres and states are checked against the form
+# vocabularies; shows may reference artists and venues by id or by name, may
+# give an end_time or a duration in minutes, and are rejected when they
+# double-book a venue or an artist. Venues without latitude and longitude
+# get their city's from the Place table. Imported shows rescore the match
+# lists of their artist/venue pairs; after importing venues or artists, run
+# `flask matches rebuild` to list them.
+import csv
+import json
+import time
+from datetime import timedelta
+from io import StringIO
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+import bookings
+import counters
+import matches
+import nearby
+from extensions import db
+from filters import to_datetime
+from forms import GENRES, STATES
+from models import Venue, Artist, Show, venue_genres, artist_genres, genre_ids, genre_mask, DEFAULT_SHOW_DURATION
+
+ENTITY_COLUMNS = {
+    'venues': ['name', 'city', 'state', 'address', 'phone', 'image_link',
+               'facebook_link', 'website', 'seeking_talent', 'seeking_description',
+               'latitude', 'longitude'],
+    'artists': ['name', 'city', 'state', 'phone', 'image_link',
+                'facebook_link', 'website', 'seeking_venue', 'seeking_description'],
+}
+
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y'}
+
+
+class Reject(ValueError):
+    pass
+
+
+def read_records(path):
+    # yields (line number, record) without loading the whole file
+    with open(path, newline='', encoding='utf-8') as source:
+        if path.endswith('.csv'):
+            reader = csv.DictReader(source)
+            for record in reader:
+                yield reader.line_num, record
+            return
+        for line_no, line in enumerate(source, start=1):
+            if line.strip():
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError as error:
+                    yield line_no, Reject('invalid JSON: {}'.format(error))
+
+
+def as_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in TRUE_VALUES
+
+
+def as_list(value):
+    if isinstance(value, list):
+        return value
+    return [item.strip() for item in str(value or '').split(',') if item.strip()]
+
+
+def clean_entity(kind, record):
+    row = {column: record.get(column) or None for column in ENTITY_COLUMNS[kind]}
+    if not row['name']:
+        raise Reject('name is required')
+    if row['state'] not in STATES:
+        raise Reject('unknown state {!r}'.format(row['state']))
+    flag = 'seeking_talent' if kind == 'venues' else 'seeking_venue'
+    row[flag] = as_bool(record.get(flag))
+    if kind == 'venues' and (row['latitude'] is not None or row['longitude'] is not None):
+        try:
+            row['latitude'], row['longitude'] = float(row['latitude']), float(row['longitude'])
+        except (TypeError, ValueError):
+            raise Reject('latitude and longitude must be numbers, given together')
+        if not nearby.valid(row['latitude'], row['longitude']):
+            raise Reject('latitude or longitude out of range')
+
+    genres = as_list(record.get('genres'))
+    unknown = [genre for genre in genres if genre not in GENRES]
+    if unknown:
+        raise Reject('unknown genre(s) {}'.format(', '.join(unknown)))
+    ids = genre_ids(set(genres))
+    row['genre_mask'] = genre_mask(ids)
+    return row, ids
+
+
+class References(object):
+    # resolves show artist/venue references; each lookup table is loaded
+    # with one query the first time it is needed
+
+    def __init__(self):
+        self.tables = {}
+
+    def table(self, model):
+        if model not in self.tables:
+            ids = set()
+            names = {}
+            for row_id, name in db.session.query(model.id, model.name):
+                ids.add(row_id)
+                names[name] = None if name in names else row_id
+            self.tables[model] = ids, names
+        return self.tables[model]
+
+    def resolve(self, model, record, key):
+        ids, names = self.table(model)
+        if record.get(key + '_id') not in (None, ''):
+            try:
+                row_id = int(record[key + '_id'])
+            except (TypeError, ValueError):
+                raise Reject('{}_id must be an integer'.format(key))
+            if row_id not in ids:
+                raise Reject('no {} with id {}'.format(key, row_id))
+            return row_id
+        name = record.get(key)
+        if not name:
+            raise Reject('{0}_id or {0} is required'.format(key))
+        if name not in names:
+            raise Reject('no {} named {!r}'.format(key, name))
+        if names[name] is None:
+            raise Reject('{} name {!r} is ambiguous, use {}_id'.format(key, name, key))
+        return names[name]
+
+
+def clean_show(record, references):
+    try:
+        start_time = to_datetime(record.get('start_time') or '')
+    except (TypeError, ValueError, OverflowError):
+        raise Reject('invalid start_time {!r}'.format(record.get('start_time')))
+    try:
+        if record.get('end_time'):
+            end_time = to_datetime(record['end_time'])
+        elif record.get('duration') not in (None, ''):
+            end_time = start_time + timedelta(minutes=int(record['duration']))
+        else:
+            end_time = start_time + DEFAULT_SHOW_DURATION
+        # times with and without a UTC offset are compared in UTC
+        ends_first = bookings.utc(end_time) <= bookings.utc(start_time)
+    except (TypeError, ValueError, OverflowError):
+        raise Reject('invalid end_time {!r} or duration {!r}'.format(record.get('end_time'), record.get('duration')))
+    if ends_first:
+        raise Reject('end_time must be after start_time')
+    return {
+        'artist_id': references.resolve(Artist, record, 'artist'),
+        'venue_id': references.resolve(Venue, record, 'venue'),
+        'start_time': start_time,
+        'end_time': end_time,
+    }
+
+
+def allocate_ids(model, count):
+    # Postgres hands out a block of ids up front so that genre links can be
+    # written with executemany alongside the rows themselves
+    return [row_id for row_id, in db.session.execute(
+        text("SELECT nextval(pg_get_serial_sequence('\"{}\"', 'id')) FROM generate_series(1, :count)".format(model.__tablename__)),
+        {'count': count},
+    )]
+
+
+def insert_entities(kind, batch):
+    model, association, owner = {
+        'venues': (Venue, venue_genres, 'venue_id'),
+        'artists': (Artist, artist_genres, 'artist_id'),
+    }[kind]
+    table = model.__table__
+    if kind == 'venues':
+        # one Place lookup for the batch
+        places = nearby.locate_many((row['city'], row['state']) for row, _ in batch if row['latitude'] is None)
+        for row, _ in batch:
+            if row['latitude'] is None:
+                row['latitude'], row['longitude'] = places.get((row['city'], row['state']), (None, None))
+
+    if db.engine.dialect.name == 'postgresql':
+        ids = allocate_ids(model, len(batch))
+        rows = [dict(row, id=row_id) for row_id, (row, _) in zip(ids, batch)]
+        db.session.execute(table.insert(), rows)
+    else:
+        ids = [db.session.execute(table.insert(), row).inserted_primary_key[0] for row, _ in batch]
+
+    links = [
+        {owner: row_id, 'genre_id': genre_id}
+        for row_id, (_, genres) in zip(ids, batch) for genre_id in genres
+    ]
+    if links:
+        db.session.execute(association.insert(), links)
+
+
+def insert_shows(batch):
+    if db.engine.dialect.name != 'postgresql':
+        db.session.execute(Show.__table__.insert(), batch)
+        return
+
+    # COPY is several times faster than even a batched INSERT
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow((row['artist_id'], row['venue_id'], row['start_time'].isoformat(), row['end_time'].isoformat()))
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert('COPY "Show" (artist_id, venue_id, start_time, end_time) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+@click.command('import')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per transaction.')
+@click.option('--rejects', type=click.Path(dir_okay=False), help='Write rejected rows here as JSON lines.')
+@with_appcontext
+def import_command(kind, path, batch_size, rejects):
+    """Bulk-load venues, artists or shows from a CSV or JSON lines file."""
+    references = References()
+    rejected = []
+    imported = 0
+    batch = []
+    lines = []  # (line number, record) of each batched row
+    started = time.perf_counter()
+
+    def flush():
+        if not batch:
+            return 0
+        if kind == 'shows':
+            # double bookings, against the database and within the batch
+            clashes = dict(bookings.check([(line_no, row) for (line_no, _), row in zip(lines, batch)]))
+            for line_no, record in lines:
+                if line_no in clashes:
+                    rejected.append({'line': line_no, 'error': clashes[line_no], 'record': record})
+            batch[:] = [row for (line_no, _), row in zip(lines, batch) if line_no not in clashes]
+            if batch:
+                insert_shows(batch)
+                counters.record(batch)
+                matches.rescore((row['artist_id'], row['venue_id']) for row in batch)
+        else:
+            insert_entities(kind, batch)
+        db.session.commit()
+        written = len(batch)
+        del batch[:]
+        del lines[:]
+        return written
+
+    try:
+        for line_no, record in read_records(path):
+            try:
+                if isinstance(record, Reject):
+                    raise record
+                if not isinstance(record, dict):
+                    raise Reject('expected a JSON object')
+                if kind == 'shows':
+                    batch.append(clean_show(record, references))
+                else:
+                    batch.append(clean_entity(kind, record))
+                lines.append((line_no, record))
+            except Reject as error:
+                rejected.append({'line': line_no, 'error': str(error), 'record': record if isinstance(record, dict) else None})
+                continue
+            if len(batch) >= batch_size:
+                imported += flush()
+        imported += flush()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.close()
+
+    rejected.sort(key=lambda reject: reject['line'])
+    elapsed = time.perf_counter() - started
+    click.echo('{}: {} imported, {} rejected in {:.1f}s ({:.0f} rows/s)'.format(
+        kind, imported, len(rejected), elapsed, imported / elapsed if elapsed else 0))
+
+    if rejects:
+        with open(rejects, 'w', encoding='utf-8') as target:
+            for reject in rejected:
+                target.write(json.dumps(reject) + '\n')
+    for reject in rejected[:10]:
+        click.echo('  line {}: {}'.format(reject['line'], reject['error']), err=True)
+    if len(rejected) > 10:
+        click.echo('  ... {} more'.format(len(rejected) - 10), err=True)
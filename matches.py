@@ -0,0 +1,396 @@
+#matches: artist–venue matchmaking
+#
+#   flask matches rebuild                # after bulk imports of venues or artists
+#
+# Every artist has a precomputed list of the venues that suit it best, and
+# every venue one of the artists, in the Match table (MATCH_LIST_SIZE
+# entries each), so serving a list is one indexed read. A pair scores on
+#   - genre overlap: |shared| / |either| of the genre_mask bitsets, a popcount;
+#   - place: 1 for the same city and state, 0.5 for the same state;
+#   - past co-bookings: n / (n + 1) for n shows together.
+# Candidates are the other side's entities in the same state sharing a genre
+# bit (read through the (state, genre_mask) indexes) and those booked
+# together before. Lists only take candidates that are seeking (venues
+# seeking talent, artists seeking a venue).
+#
+# refresh() recomputes an edited or new entity's own list and its entries in
+# the other side's lists, rescore() the pairs whose co-bookings changed, and
+# forget() drops deleted entities; all run inside the caller's transaction.
+# Lists a deleted entity leaves are one short until their owner is next
+# refreshed or the lists are rebuilt.
+import heapq
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, delete, func, select, tuple_
+
+from extensions import db
+from forms import GENRES
+from models import Venue, Artist, Show, Match, venue_genres, artist_genres
+
+SIDES = {
+    'artist': (Artist, Artist.seeking_venue, artist_genres, Show.artist_id),
+    'venue': (Venue, Venue.seeking_talent, venue_genres, Show.venue_id),
+}
+OTHER = {'artist': 'venue', 'venue': 'artist'}
+
+# columns whose change moves an entity's matches
+MATCH_FIELDS = ('genre_mask', 'city', 'state', 'seeking_venue', 'seeking_talent')
+
+GENRE_WEIGHT = 0.6
+PLACE_WEIGHT = 0.25
+HISTORY_WEIGHT = 0.15
+
+# owners per statement when placing entries in many lists at once
+CHUNK_SIZE = 500
+
+
+def list_size():
+    return current_app.config.get('MATCH_LIST_SIZE', 20)
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+def genres_of(mask):
+    return [name for position, name in enumerate(GENRES) if mask >> position & 1]
+
+
+def score(mask, place, other_mask, other_place, shows):
+    # place is (city, state); shows the number of shows the pair has had
+    union = mask | other_mask
+    overlap = popcount(mask & other_mask) / popcount(union) if union else 0.0
+    if place[1] is None or place[1] != other_place[1]:
+        nearness = 0.0
+    elif place[0] == other_place[0]:
+        nearness = 1.0
+    else:
+        nearness = 0.5
+    history = shows / (shows + 1.0)
+    return round(GENRE_WEIGHT * overlap + PLACE_WEIGHT * nearness + HISTORY_WEIGHT * history, 6)
+
+
+def best_first(entry):
+    # (score, candidate id, ...) entries: higher score, then lower id; the
+    # same order as ranked() and the trimming window
+    return entry[0], -entry[1]
+
+
+def profiles(kind, row_ids):
+    # {id: (genre_mask, city, state, seeking)} for the given ids
+    model, seeking, _, _ = SIDES[kind]
+    found = {}
+    for start in range(0, len(row_ids), CHUNK_SIZE):
+        rows = db.session.query(model.id, model.genre_mask, model.city, model.state, seeking.label('seeking')).filter(
+            model.id.in_(row_ids[start:start + CHUNK_SIZE])
+        )
+        found.update((row.id, row) for row in rows)
+    return found
+
+
+def profile(kind, row_id):
+    return profiles(kind, [row_id]).get(row_id)
+
+
+def candidates(kind, entities, seeking_only=False):
+    # {id: [(score, candidate id, candidate seeking)]} for the entities
+    # ({id: profile}), over the other side's entities in their state sharing
+    # a genre bit and those booked together with them; `seeking_only` skips
+    # the candidates no list would take
+    own_key = SIDES[kind][3]
+    model, seeking, _, other_key = SIDES[OTHER[kind]]
+    columns = (model.id, model.genre_mask, model.city, model.state, seeking)
+    conditions = [seeking.is_(True)] if seeking_only else []
+    ids = sorted(entities)
+
+    history = {}
+    for start in range(0, len(ids), CHUNK_SIZE):
+        rows = db.session.query(own_key, other_key, func.count()).filter(
+            own_key.in_(ids[start:start + CHUNK_SIZE])
+        ).group_by(own_key, other_key)
+        for row_id, other_id, shows in rows:
+            history.setdefault(row_id, {})[other_id] = shows
+
+    wanted = {}
+    for entity in entities.values():
+        if entity.genre_mask and entity.state:
+            wanted[entity.state] = wanted.get(entity.state, 0) | entity.genre_mask
+    # one query for every state, on the union of the masks; each state's
+    # rows are then narrowed to its own mask
+    local = {}
+    if wanted:
+        union = 0
+        for mask in wanted.values():
+            union |= mask
+        rows = db.session.query(*columns).filter(
+            model.state.in_(sorted(wanted)), model.genre_mask.op('&')(union) != 0, *conditions
+        )
+        for row in rows:
+            if row[1] & wanted[row[3]]:
+                local.setdefault(row[3], []).append(row)
+    rows = {row[0]: row for state_rows in local.values() for row in state_rows}
+    missing = sorted({other_id for booked in history.values() for other_id in booked} - set(rows))
+    for start in range(0, len(missing), CHUNK_SIZE):
+        rows.update((row[0], row) for row in db.session.query(*columns).filter(model.id.in_(missing[start:start + CHUNK_SIZE]), *conditions))
+
+    scored = {}
+    for row_id, entity in entities.items():
+        booked = history.get(row_id, {})
+        found = {row[0]: row for row in local.get(entity.state, ()) if row[1] & entity.genre_mask}
+        found.update((other_id, rows[other_id]) for other_id in booked if other_id in rows)
+        place = (entity.city, entity.state)
+        scored[row_id] = [
+            (score(entity.genre_mask, place, mask, (city, state), booked.get(other_id, 0)), other_id, bool(other_seeking))
+            for other_id, mask, city, state, other_seeking in found.values()
+        ]
+    return scored
+
+
+def ranked(kind, row_id, columns, limit):
+    # the entity's list, best first: [(score, shared genres, (candidate id,
+    # *columns))]; None for an unknown entity
+    entity = profile(kind, row_id)
+    if entity is None:
+        return None
+    model = SIDES[OTHER[kind]][0]
+    rows = db.session.query(Match.score, model.genre_mask, model.id, *columns).join(
+        model, model.id == Match.candidate_id
+    ).filter(Match.side == kind, Match.owner_id == row_id).order_by(
+        Match.score.desc(), Match.candidate_id
+    ).limit(limit)
+    return [(row[0], genres_of(entity.genre_mask & row[1]), tuple(row[2:])) for row in rows]
+
+
+#----------------------------------------------------------------------------#
+# Keeping the lists current.
+#----------------------------------------------------------------------------#
+
+def positions(side, owners):
+    # (owner_id, candidate_id, score, position) of the owners' lists, with
+    # position 1 for the best entry
+    table = Match.__table__
+    position = func.row_number().over(
+        partition_by=table.c.owner_id, order_by=(table.c.score.desc(), table.c.candidate_id)
+    ).label('position')
+    return select(table.c.owner_id, table.c.candidate_id, table.c.score, position).where(
+        table.c.side == side, table.c.owner_id.in_(owners)
+    ).subquery()
+
+
+def place(side, entries, replace=True):
+    # puts (owner_id, candidate_id, score) entries into the side's lists
+    # where they rank within the first list_size(), trimming the lists
+    # they push over; `replace` drops the pairs' current entries first
+    table = Match.__table__
+    size = list_size()
+    entries = sorted(entries)
+    for start in range(0, len(entries), CHUNK_SIZE):
+        chunk = entries[start:start + CHUNK_SIZE]
+        owners = sorted({owner_id for owner_id, _, _ in chunk})
+        if replace:
+            # the plain IN lets the planner seek the primary key per owner
+            db.session.execute(delete(table).where(
+                table.c.side == side,
+                table.c.owner_id.in_(owners),
+                tuple_(table.c.owner_id, table.c.candidate_id).in_([(owner_id, candidate_id) for owner_id, candidate_id, _ in chunk]),
+            ))
+        ranked_rows = positions(side, owners)
+        # the last entry of every full list: what a newcomer has to beat
+        last = {
+            owner_id: (last_score, -candidate_id)
+            for owner_id, candidate_id, last_score in db.session.execute(
+                select(ranked_rows.c.owner_id, ranked_rows.c.candidate_id, ranked_rows.c.score).where(ranked_rows.c.position == size)
+            )
+        }
+        kept = [
+            {'side': side, 'owner_id': owner_id, 'candidate_id': candidate_id, 'score': entry_score}
+            for owner_id, candidate_id, entry_score in chunk
+            if owner_id not in last or (entry_score, -candidate_id) > last[owner_id]
+        ]
+        if not kept:
+            continue
+        db.session.execute(table.insert(), kept)
+        # lists that were full, or short by fewer entries than they got
+        grown = sorted({entry['owner_id'] for entry in kept})
+        ranked_rows = positions(side, grown)
+        db.session.execute(delete(table).where(
+            table.c.side == side,
+            table.c.owner_id.in_(grown),
+            tuple_(table.c.owner_id, table.c.candidate_id).in_(
+                select(ranked_rows.c.owner_id, ranked_rows.c.candidate_id).where(ranked_rows.c.position > size)
+            ),
+        ))
+
+
+def best_list(kind, row_id, scored):
+    # rows of the entity's own list: its best seeking candidates
+    return [
+        {'side': kind, 'owner_id': row_id, 'candidate_id': candidate_id, 'score': entry_score}
+        for entry_score, candidate_id, _ in heapq.nlargest(list_size(), [entry for entry in scored if entry[2]], key=best_first)
+    ]
+
+
+def relist(kind, row_ids):
+    # recomputes the entities' own lists from scratch
+    table = Match.__table__
+    for start in range(0, len(row_ids), CHUNK_SIZE):
+        chunk = row_ids[start:start + CHUNK_SIZE]
+        db.session.execute(delete(table).where(table.c.side == kind, table.c.owner_id.in_(chunk)))
+        rows = [
+            row for row_id, scored in candidates(kind, profiles(kind, chunk), seeking_only=True).items()
+            for row in best_list(kind, row_id, scored)
+        ]
+        if rows:
+            db.session.execute(table.insert(), rows)
+
+
+def refresh(kind, row_id):
+    # a venue or artist was created, or edited in a MATCH_FIELDS column
+    other = OTHER[kind]
+    table = Match.__table__
+    held = dict(db.session.execute(
+        select(table.c.owner_id, table.c.score).where(table.c.side == other, table.c.candidate_id == row_id)
+    ).all())
+    forget(kind, [row_id])
+    entity = profile(kind, row_id)
+    if entity is None:
+        return
+    scored = candidates(kind, {row_id: entity})[row_id]
+    rows = best_list(kind, row_id, scored)
+    if rows:
+        db.session.execute(table.insert(), rows)
+    now = {}
+    if entity.seeking:
+        now = {candidate_id: entry_score for entry_score, candidate_id, _ in scored}
+        place(other, [(owner_id, row_id, entry_score) for owner_id, entry_score in now.items()], replace=False)
+    # a list the entity left or sank in may now have room for a candidate
+    # it never held; those few are recomputed
+    relist(other, sorted(owner_id for owner_id, held_score in held.items() if now.get(owner_id, -1) < held_score))
+
+
+def rescore(pairs):
+    # (artist_id, venue_id) pairs that were booked together again
+    pairs = sorted(set(pairs))
+    if not pairs:
+        return
+    profiles = {}
+    for kind, ids in (('artist', {artist_id for artist_id, _ in pairs}), ('venue', {venue_id for _, venue_id in pairs})):
+        model, seeking, _, _ = SIDES[kind]
+        rows = db.session.query(model.id, model.genre_mask, model.city, model.state, seeking).filter(model.id.in_(ids))
+        profiles.update(((kind, row[0]), row[1:]) for row in rows)
+    history = {}
+    for start in range(0, len(pairs), CHUNK_SIZE):
+        chunk = pairs[start:start + CHUNK_SIZE]
+        history.update(
+            ((artist_id, venue_id), shows) for artist_id, venue_id, shows in db.session.query(
+                Show.artist_id, Show.venue_id, func.count()
+            ).filter(
+                Show.artist_id.in_({artist_id for artist_id, _ in chunk}), tuple_(Show.artist_id, Show.venue_id).in_(chunk)
+            ).group_by(Show.artist_id, Show.venue_id)
+        )
+
+    for_artists, for_venues = [], []
+    for artist_id, venue_id in pairs:
+        artist, venue = profiles.get(('artist', artist_id)), profiles.get(('venue', venue_id))
+        if artist is None or venue is None:
+            continue
+        pair_score = score(artist[0], artist[1:3], venue[0], venue[1:3], history.get((artist_id, venue_id), 0))
+        if venue[3]:
+            for_artists.append((artist_id, venue_id, pair_score))
+        if artist[3]:
+            for_venues.append((venue_id, artist_id, pair_score))
+    place('artist', for_artists)
+    place('venue', for_venues)
+
+
+def forget(kind, row_ids):
+    # the entities' own lists and their entries in the other side's lists
+    table = Match.__table__
+    db.session.execute(delete(table).where(table.c.side == kind, table.c.owner_id.in_(row_ids)))
+    db.session.execute(delete(table).where(table.c.side == OTHER[kind], table.c.candidate_id.in_(row_ids)))
+
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+matches_cli = AppGroup('matches', help='Maintain the artist and venue match lists.')
+
+
+def sync_masks():
+    # genre_mask from the genre links, for rows written around the app
+    for kind, (model, _, association, _) in SIDES.items():
+        owner = association.c[kind + '_id']
+        computed = {}
+        for row_id, genre_id in db.session.query(owner, association.c.genre_id):
+            computed[row_id] = computed.get(row_id, 0) | 1 << (genre_id - 1)
+        table = model.__table__
+        db.session.execute(table.update().where(table.c.genre_mask != 0).values(genre_mask=0))
+        if computed:
+            db.session.execute(
+                table.update().where(table.c.id == bindparam('row_id')).values(genre_mask=bindparam('mask')),
+                [{'row_id': row_id, 'mask': mask} for row_id, mask in computed.items()],
+            )
+
+
+def rebuild(batch_size=10000):
+    # every list from scratch in one transaction, from a single read of
+    # Venue, Artist and the show pairs instead of candidates() per entity:
+    # seeking entities are bucketed by (state, genre bit), and an entity's
+    # candidates are the union of its state's buckets for its bits plus
+    # those it was booked with. Returns the number of lists built.
+    sync_masks()
+    table = Match.__table__
+    db.session.execute(delete(table))
+    profiles = {}
+    for kind, (model, seeking, _, _) in SIDES.items():
+        rows = db.session.query(model.id, model.genre_mask, model.city, model.state, seeking)
+        profiles[kind] = {row_id: (mask, city, state, bool(flag)) for row_id, mask, city, state, flag in rows}
+    history = db.session.query(Show.artist_id, Show.venue_id, func.count()).group_by(Show.artist_id, Show.venue_id).all()
+    bits = [(bit, 1 << bit) for bit in range(len(GENRES))]
+
+    for kind in SIDES:
+        others = profiles[OTHER[kind]]
+        buckets = {}
+        for other_id, (mask, _, state, seeking) in others.items():
+            if seeking and state:
+                for bit, flag in bits:
+                    if mask & flag:
+                        buckets.setdefault((state, bit), []).append(other_id)
+        paired = {}
+        for artist_id, venue_id, shows in history:
+            owner_id, other_id = (artist_id, venue_id) if kind == 'artist' else (venue_id, artist_id)
+            paired.setdefault(owner_id, {})[other_id] = shows
+
+        batch = []
+        for row_id, (mask, city, state, _) in profiles[kind].items():
+            shows = paired.get(row_id, {})
+            ids = set(shows)
+            if state:
+                for bit, flag in bits:
+                    if mask & flag:
+                        ids.update(buckets.get((state, bit), ()))
+            scored = []
+            for other_id in ids:
+                other_mask, other_city, other_state, seeking = others[other_id]
+                if seeking:
+                    scored.append((score(mask, (city, state), other_mask, (other_city, other_state), shows.get(other_id, 0)), other_id, True))
+            batch.extend(best_list(kind, row_id, scored))
+            if len(batch) >= batch_size:
+                db.session.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            db.session.execute(table.insert(), batch)
+    db.session.commit()
+    return sum(len(side) for side in profiles.values())
+
+
+@matches_cli.command('rebuild')
+def rebuild_command():
+    """Recompute genre masks and every match list."""
+    started = time.perf_counter()
+    built = rebuild()
+    click.echo('{} match lists rebuilt in {:.1f}s'.format(built, time.perf_counter() - started))
@@ -0,0 +1,153 @@
+#metrics: per-request timings exposed as Prometheus histograms and Server-Timing
+#
+# Every request records its SQL statement count and time (engine events),
+# template render time (Flask template signals), total time and response
+# size, keyed by endpoint. Recording is a few counters per request, so it is
+# meant to stay on in production; METRICS_ENABLED = False turns it off.
+import time
+from bisect import bisect_left
+from threading import Lock
+
+from flask import current_app, g, has_app_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram(object):
+    # cumulative-bucket histogram with one series per endpoint
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}
+        self.lock = Lock()
+
+    def observe(self, endpoint, value):
+        with self.lock:
+            series = self.series.get(endpoint)
+            if series is None:
+                series = self.series[endpoint] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} histogram'.format(self.name),
+        ]
+        with self.lock:
+            snapshot = [(endpoint, list(counts), total, count) for endpoint, (counts, total, count) in sorted(self.series.items())]
+        for endpoint, counts, total, count in snapshot:
+            label = 'endpoint="{}"'.format(endpoint)
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.name, label, bound, cumulative))
+            lines.append('{}_sum{{{}}} {}'.format(self.name, label, total))
+            lines.append('{}_count{{{}}} {}'.format(self.name, label, count))
+        return '\n'.join(lines)
+
+
+request_duration = Histogram('fyyur_request_duration_seconds', 'Time spent handling the request.', DURATION_BUCKETS)
+request_queries = Histogram('fyyur_request_queries', 'SQL statements executed per request.', QUERY_BUCKETS)
+request_sql = Histogram('fyyur_request_sql_seconds', 'Time spent in SQL statements per request.', DURATION_BUCKETS)
+request_render = Histogram('fyyur_request_render_seconds', 'Time spent rendering templates per request.', DURATION_BUCKETS)
+response_size = Histogram('fyyur_response_size_bytes', 'Response body size (unstreamed responses only).', SIZE_BUCKETS)
+
+HISTOGRAMS = (request_duration, request_queries, request_sql, request_render, response_size)
+
+
+class RequestTimings(object):
+    __slots__ = ('started', 'queries', 'sql', 'render', 'render_started')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql = 0.0
+        self.render = 0.0
+        self.render_started = None
+
+    def merge(self, other):
+        # a query worker's counts (parallel.gather)
+        self.queries += other.queries
+        self.sql += other.sql
+        self.render += other.render
+
+
+def current():
+    if has_app_context():
+        return g.get('request_timings')
+    return None
+
+
+def render():
+    # Prometheus text exposition format
+    return '\n'.join(histogram.render() for histogram in HISTOGRAMS) + '\n'
+
+
+#----------------------------------------------------------------------------#
+# Hooks.
+#----------------------------------------------------------------------------#
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = current()
+    if timings is not None:
+        timings.queries += 1
+        timings.sql += time.perf_counter() - conn.info['query_started']
+
+
+def before_render(sender, template, context, **extra):
+    timings = current()
+    if timings is not None:
+        timings.render_started = time.perf_counter()
+
+
+def after_render(sender, template, context, **extra):
+    timings = current()
+    if timings is not None and timings.render_started is not None:
+        timings.render += time.perf_counter() - timings.render_started
+        timings.render_started = None
+
+
+def start_request_timings():
+    if current_app.config.get('METRICS_ENABLED', True):
+        g.request_timings = RequestTimings()
+
+
+def record_request_timings(response):
+    timings = g.pop('request_timings', None)
+    if timings is None:
+        return response
+
+    total = time.perf_counter() - timings.started
+    endpoint = request.endpoint or 'unmatched'
+    request_duration.observe(endpoint, total)
+    request_queries.observe(endpoint, timings.queries)
+    request_sql.observe(endpoint, timings.sql)
+    request_render.observe(endpoint, timings.render)
+    if not response.is_streamed:
+        response_size.observe(endpoint, response.calculate_content_length() or 0)
+
+    if current_app.config.get('SERVER_TIMING_HEADER', True):
+        response.headers['Server-Timing'] = 'db;dur={:.2f};desc="{} queries", render;dur={:.2f}, total;dur={:.2f}'.format(
+            timings.sql * 1000, timings.queries, timings.render * 1000, total * 1000)
+    return response
+
+
+def init_app(app):
+    before_render_template.connect(before_render, app)
+    template_rendered.connect(after_render, app)
+    app.before_request(start_request_timings)
+    app.after_request(record_request_timings)
@@ -0,0 +1,93 @@
+"""normalize genres
+
+Revision ID: 0eb5bae1540a
+Revises: 170596f1010c
+Create Date: 2026-10-18 11:03:52.618277
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0eb5bae1540a'
+down_revision = '170596f1010c'
+branch_labels = None
+depends_on = None
+
+# forms.GENRES at the time of this revision; Genre ids follow this order
+GENRES = [
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk',
+    'Funk', 'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz',
+    'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll',
+    'Soul', 'Other',
+]
+
+# (owner table, association table, owner id column)
+OWNERS = [
+    ('Venue', 'venue_genres', 'venue_id'),
+    ('Artist', 'artist_genres', 'artist_id'),
+]
+
+
+def upgrade():
+    genre = op.create_table('Genre',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.bulk_insert(genre, [
+        {'id': position, 'name': name} for position, name in enumerate(GENRES, start=1)
+    ])
+
+    connection = op.get_bind()
+    for owner, association, owner_id in OWNERS:
+        table = op.create_table(association,
+        sa.Column(owner_id, sa.Integer(), nullable=False),
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ),
+        sa.ForeignKeyConstraint([owner_id], [owner + '.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint(owner_id, 'genre_id')
+        )
+        op.create_index('ix_{}_genre_id_{}'.format(association, owner_id), association, ['genre_id', owner_id], unique=False)
+
+        # copy the ", "-joined strings over; names outside the vocabulary
+        # (including ones cut short by the old String(120)) are dropped
+        rows = connection.execute(sa.text('SELECT id, genres FROM "{}"'.format(owner))).fetchall()
+        links = []
+        for row_id, genres in rows:
+            names = {name.strip() for name in (genres or '').split(',')}
+            links += [
+                {owner_id: row_id, 'genre_id': position}
+                for position, name in enumerate(GENRES, start=1) if name in names
+            ]
+        if links:
+            op.bulk_insert(table, links)
+
+        with op.batch_alter_table(owner) as batch_op:
+            batch_op.drop_column('genres')
+
+
+def downgrade():
+    connection = op.get_bind()
+    for owner, association, owner_id in OWNERS:
+        with op.batch_alter_table(owner) as batch_op:
+            batch_op.add_column(sa.Column('genres', sa.String(length=120), nullable=True))
+
+        rows = connection.execute(sa.text(
+            'SELECT a.{0}, g.name FROM {1} a JOIN "Genre" g ON g.id = a.genre_id '
+            'ORDER BY a.{0}, g.id'.format(owner_id, association)
+        )).fetchall()
+        genres = {}
+        for row_id, name in rows:
+            genres.setdefault(row_id, []).append(name)
+        for row_id, names in genres.items():
+            connection.execute(
+                sa.text('UPDATE "{}" SET genres = :genres WHERE id = :id'.format(owner)),
+                {'genres': ', '.join(names)[:120], 'id': row_id}
+            )
+
+        op.drop_index('ix_{}_genre_id_{}'.format(association, owner_id), table_name=association)
+        op.drop_table(association)
+    op.drop_table('Genre')
@@ -0,0 +1,26 @@
+"""show detail page indexes
+
+Revision ID: 170596f1010c
+Revises: da94bc72a8a4
+Create Date: 2026-10-18 10:21:37.904512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '170596f1010c'
+down_revision = 'da94bc72a8a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_artist_id_start_time', table_name='Show')
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
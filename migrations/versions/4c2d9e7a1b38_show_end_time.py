@@ -0,0 +1,55 @@
+"""show end time and double-booking constraints
+
+Revision ID: 4c2d9e7a1b38
+Revises: 0eb5bae1540a
+Create Date: 2026-10-18 18:40:12.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c2d9e7a1b38'
+down_revision = '0eb5bae1540a'
+branch_labels = None
+depends_on = None
+
+# existing shows get models.DEFAULT_SHOW_DURATION
+BACKFILL = {
+    'postgresql': 'UPDATE "Show" SET end_time = start_time + interval \'2 hours\'',
+    'sqlite': 'UPDATE "Show" SET end_time = datetime(start_time, \'+2 hours\')',
+}
+
+# Postgres rejects overlapping bookings per venue and per artist. Creating the
+# constraints fails, naming a conflicting pair, if the data already contains
+# double bookings; resolve those and run the upgrade again.
+EXCLUSIONS = [
+    ('Show_venue_no_overlap', 'venue_id'),
+    ('Show_artist_no_overlap', 'artist_id'),
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(timezone=True), nullable=True))
+    op.execute(BACKFILL.get(dialect, BACKFILL['postgresql']))
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(timezone=True), nullable=False)
+
+    if dialect != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    for name, owner in EXCLUSIONS:
+        op.execute(
+            'ALTER TABLE "Show" ADD CONSTRAINT "{}" EXCLUDE USING gist '
+            '({} WITH =, tstzrange(start_time, end_time) WITH &&)'.format(name, owner)
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name, _ in EXCLUSIONS:
+            op.drop_constraint(name, 'Show')
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.drop_column('end_time')
@@ -0,0 +1,40 @@
+"""delete shows with their venue or artist
+
+Revision ID: 5f8d2b6e0c13
+Revises: e3a7c91d5f24
+Create Date: 2026-10-18 22:03:47.180562
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5f8d2b6e0c13'
+down_revision = 'e3a7c91d5f24'
+branch_labels = None
+depends_on = None
+
+# (constraint, column, referenced table); the names Postgres gave the
+# unnamed constraints of the initial schema
+FOREIGN_KEYS = [
+    ('Show_artist_id_fkey', 'artist_id', 'Artist'),
+    ('Show_venue_id_fkey', 'venue_id', 'Venue'),
+]
+
+
+def replace_foreign_keys(**options):
+    # SQLite does not enforce foreign keys unless asked per connection, so
+    # app.delete_entities deletes the shows itself there
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for name, column, table in FOREIGN_KEYS:
+        op.drop_constraint(name, 'Show', type_='foreignkey')
+        op.create_foreign_key(name, 'Show', table, [column], ['id'], **options)
+
+
+def upgrade():
+    replace_foreign_keys(ondelete='CASCADE')
+
+
+def downgrade():
+    replace_foreign_keys()
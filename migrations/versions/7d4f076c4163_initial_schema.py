@@ -0,0 +1,65 @@
+"""initial schema
+
+Revision ID: 7d4f076c4163
+Revises: 
+Create Date: 2026-10-18 09:12:41.311024
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d4f076c4163'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Artist',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('city', sa.String(length=120), nullable=True),
+    sa.Column('state', sa.String(length=120), nullable=True),
+    sa.Column('phone', sa.String(length=120), nullable=True),
+    sa.Column('genres', sa.String(length=120), nullable=True),
+    sa.Column('image_link', sa.String(length=500), nullable=True),
+    sa.Column('facebook_link', sa.String(length=120), nullable=True),
+    sa.Column('website', sa.String(length=120), nullable=True),
+    sa.Column('seeking_description', sa.String(length=500), nullable=True),
+    sa.Column('seeking_venue', sa.Boolean(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('Venue',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('city', sa.String(length=120), nullable=True),
+    sa.Column('state', sa.String(length=120), nullable=True),
+    sa.Column('address', sa.String(length=120), nullable=True),
+    sa.Column('phone', sa.String(length=120), nullable=True),
+    sa.Column('image_link', sa.String(length=500), nullable=True),
+    sa.Column('facebook_link', sa.String(length=120), nullable=True),
+    sa.Column('website', sa.String(length=120), nullable=True),
+    sa.Column('seeking_description', sa.String(length=500), nullable=True),
+    sa.Column('seeking_talent', sa.Boolean(), nullable=True),
+    sa.Column('genres', sa.String(length=120), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('Show',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_Show_start_time_id', 'Show', ['start_time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_start_time_id', table_name='Show')
+    op.drop_table('Show')
+    op.drop_table('Venue')
+    op.drop_table('Artist')
@@ -0,0 +1,54 @@
+"""upcoming/past show counters on venues and artists
+
+Revision ID: 9b1e5f3c2a07
+Revises: 4c2d9e7a1b38
+Create Date: 2026-10-18 20:05:41.902113
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b1e5f3c2a07'
+down_revision = '4c2d9e7a1b38'
+branch_labels = None
+depends_on = None
+
+OWNERS = [
+    ('Venue', 'venue_id'),
+    ('Artist', 'artist_id'),
+]
+
+# counts as of the clock row written below, see counters.py
+BACKFILL = (
+    'UPDATE "{table}" SET '
+    'upcoming_shows_count = (SELECT count(*) FROM "Show" WHERE "Show".{owner} = "{table}".id '
+    'AND "Show".start_time >= (SELECT rolled_over_at FROM "CounterClock")), '
+    'past_shows_count = (SELECT count(*) FROM "Show" WHERE "Show".{owner} = "{table}".id '
+    'AND "Show".start_time < (SELECT rolled_over_at FROM "CounterClock"))'
+)
+
+
+def upgrade():
+    clock = op.create_table('CounterClock',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('rolled_over_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(clock, [{'id': 1, 'rolled_over_at': datetime.now()}])
+
+    for table, owner in OWNERS:
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+        op.execute(BACKFILL.format(table=table, owner=owner))
+
+
+def downgrade():
+    for table, _ in OWNERS:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('past_shows_count')
+            batch_op.drop_column('upcoming_shows_count')
+    op.drop_table('CounterClock')
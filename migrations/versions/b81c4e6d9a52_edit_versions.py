@@ -0,0 +1,29 @@
+"""version column on venues and artists
+
+Revision ID: b81c4e6d9a52
+Revises: 5f8d2b6e0c13
+Create Date: 2026-10-18 23:10:26.415870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b81c4e6d9a52'
+down_revision = '5f8d2b6e0c13'
+branch_labels = None
+depends_on = None
+
+TABLES = ['Venue', 'Artist']
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('version')
@@ -0,0 +1,24 @@
+"""venue city/state index for the show calendar
+
+Revision ID: c47e0b2f8d16
+Revises: b81c4e6d9a52
+Create Date: 2026-10-18 23:48:12.630154
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47e0b2f8d16'
+down_revision = 'b81c4e6d9a52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Venue_city_state', 'Venue', ['city', 'state'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_city_state', table_name='Venue')
@@ -0,0 +1,43 @@
+"""venue coordinates, places and the location index
+
+Revision ID: d9a35f71c2e8
+Revises: c47e0b2f8d16
+Create Date: 2026-10-19 00:31:55.208417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9a35f71c2e8'
+down_revision = 'c47e0b2f8d16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Place',
+        sa.Column('city', sa.String(length=120), nullable=False),
+        sa.Column('state', sa.String(length=120), nullable=False),
+        sa.Column('latitude', sa.Float(), nullable=False),
+        sa.Column('longitude', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('city', 'state')
+    )
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+
+    # other databases search an in-process grid, see nearby.py
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS cube')
+        op.execute('CREATE EXTENSION IF NOT EXISTS earthdistance')
+        op.execute('CREATE INDEX "ix_Venue_location" ON "Venue" USING gist (ll_to_earth(latitude, longitude))')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX "ix_Venue_location"')
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
+    op.drop_table('Place')
@@ -0,0 +1,47 @@
+"""trigram search indexes
+
+Revision ID: da94bc72a8a4
+Revises: 7d4f076c4163
+Create Date: 2026-10-18 09:40:05.127389
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'da94bc72a8a4'
+down_revision = '7d4f076c4163'
+branch_labels = None
+depends_on = None
+
+# GIN trigram indexes let ILIKE '%term%' and similarity() ranking use an index
+# instead of a sequential scan. Other databases fall back to the in-process
+# index in search.py, so there is nothing to create for them.
+SEARCH_COLUMNS = [
+    ('Venue', 'name'),
+    ('Venue', 'city'),
+    ('Venue', 'state'),
+    ('Artist', 'name'),
+    ('Artist', 'city'),
+    ('Artist', 'state'),
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column in SEARCH_COLUMNS:
+        op.create_index(
+            'ix_{}_{}_trgm'.format(table, column), table, [column],
+            postgresql_using='gin',
+            postgresql_ops={column: 'gin_trgm_ops'},
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table, column in SEARCH_COLUMNS:
+        op.drop_index('ix_{}_{}_trgm'.format(table, column), table_name=table)
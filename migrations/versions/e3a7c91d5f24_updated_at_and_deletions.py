@@ -0,0 +1,48 @@
+"""updated_at on venues, artists and shows; deletion stamps
+
+Revision ID: e3a7c91d5f24
+Revises: 9b1e5f3c2a07
+Create Date: 2026-10-18 21:12:09.557310
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a7c91d5f24'
+down_revision = '9b1e5f3c2a07'
+branch_labels = None
+depends_on = None
+
+TABLES = ['Venue', 'Artist', 'Show']
+
+
+def upgrade():
+    now = datetime.now()
+    deletions = op.create_table('Deletion',
+        sa.Column('table_name', sa.String(length=50), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('table_name')
+    )
+    op.bulk_insert(deletions, [{'table_name': table, 'deleted_at': now} for table in TABLES])
+
+    # existing rows count as changed now
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+        op.execute(sa.text('UPDATE "{}" SET updated_at = :now'.format(table)).bindparams(
+            sa.bindparam('now', now, type_=sa.DateTime(timezone=True))
+        ))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(timezone=True), nullable=False)
+        op.create_index(op.f('ix_{}_updated_at'.format(table)), table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index(op.f('ix_{}_updated_at'.format(table)), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
+    op.drop_table('Deletion')
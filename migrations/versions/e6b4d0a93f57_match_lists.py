@@ -0,0 +1,50 @@
+"""genre masks and precomputed match lists
+
+Revision ID: e6b4d0a93f57
+Revises: d9a35f71c2e8
+Create Date: 2026-10-19 02:14:08.561930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b4d0a93f57'
+down_revision = 'd9a35f71c2e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('genre_mask', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('Artist', sa.Column('genre_mask', sa.Integer(), server_default='0', nullable=False))
+    # bit (genre_id - 1) per linked genre; each link is unique, so the sum
+    # is the bitwise or
+    op.execute('UPDATE "Venue" SET genre_mask = COALESCE((SELECT SUM(1 << (genre_id - 1)) FROM venue_genres WHERE venue_id = "Venue".id), 0)')
+    op.execute('UPDATE "Artist" SET genre_mask = COALESCE((SELECT SUM(1 << (genre_id - 1)) FROM artist_genres WHERE artist_id = "Artist".id), 0)')
+    op.create_index('ix_Venue_state_genre_mask', 'Venue', ['state', 'genre_mask'], unique=False)
+    op.create_index('ix_Artist_state_genre_mask', 'Artist', ['state', 'genre_mask'], unique=False)
+
+    # filled by `flask matches rebuild`
+    op.create_table('Match',
+        sa.Column('side', sa.String(length=6), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.Column('candidate_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('side', 'owner_id', 'candidate_id')
+    )
+    op.create_index('ix_Match_side_owner_id_score', 'Match', ['side', 'owner_id', 'score'], unique=False)
+    op.create_index('ix_Match_side_candidate_id', 'Match', ['side', 'candidate_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Match_side_candidate_id', table_name='Match')
+    op.drop_index('ix_Match_side_owner_id_score', table_name='Match')
+    op.drop_table('Match')
+    op.drop_index('ix_Artist_state_genre_mask', table_name='Artist')
+    op.drop_index('ix_Venue_state_genre_mask', table_name='Venue')
+    with op.batch_alter_table('Artist') as batch_op:
+        batch_op.drop_column('genre_mask')
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.drop_column('genre_mask')
@@ -0,0 +1,34 @@
+"""server default for updated_at
+
+Revision ID: f2c8e5a17b40
+Revises: e6b4d0a93f57
+Create Date: 2026-10-19 09:42:17.304811
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8e5a17b40'
+down_revision = 'e6b4d0a93f57'
+branch_labels = None
+depends_on = None
+
+TABLES = ['Venue', 'Artist', 'Show']
+
+
+# rows written around the ORM, like the COPY in `flask import shows`, get
+# their updated_at from the database
+def upgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(timezone=True), existing_nullable=False,
+                                  server_default=sa.func.now())
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(timezone=True), existing_nullable=False,
+                                  server_default=None)
@@ -1,9 +1,73 @@
 #models: fullfiling separation of concern
-from app import db
+from datetime import datetime, timedelta
+
+from extensions import db
+from forms import GENRES
+
+# length assumed for shows listed without an end time or duration
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+
+
+# Genres are a fixed vocabulary (forms.GENRES) linked to venues and artists
+# through association tables. The (genre_id, owner_id) indexes serve genre
+# filters and facet counts without scanning Venue or Artist.
+class Genre(db.Model):
+    __tablename__ = 'Genre'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+
+    def __repr__(self):
+        return f'<Genre {self.id} {self.name}>'
+
+    @classmethod
+    def named(cls, names):
+        # the Genre rows for the given names, in vocabulary order; names
+        # outside the vocabulary are dropped
+        return cls.query.filter(cls.name.in_(list(names))).order_by(cls.id).all()
+
+
+def genre_ids(names):
+    # vocabulary ids for the given genre names; ids follow GENRES order
+    return [GENRES.index(name) + 1 for name in names if name in GENRES]
+
+
+def genre_mask(ids):
+    # the genres as one integer, bit (id - 1) per genre; GENRES has 19
+    # entries, so any set of them fits a 32-bit column
+    return sum(1 << (genre_id - 1) for genre_id in set(ids))
+
+
+@db.event.listens_for(Genre.__table__, 'after_create')
+def seed_genres(target, connection, **kw):
+    connection.execute(target.insert(), [
+        {'id': position, 'name': name} for position, name in enumerate(GENRES, start=1)
+    ])
+
+
+venue_genres = db.Table('venue_genres',
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+    db.Index('ix_venue_genres_genre_id_venue_id', 'genre_id', 'venue_id'),
+)
+
+artist_genres = db.Table('artist_genres',
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+    db.Index('ix_artist_genres_genre_id_artist_id', 'genre_id', 'artist_id'),
+)
+
 
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        # the show calendar's city/state filters pick venues through this
+        # before reading their shows by (venue_id, start_time)
+        db.Index('ix_Venue_city_state', 'city', 'state'),
+        # matchmaking candidates: same state, sharing a genre bit
+        db.Index('ix_Venue_state_genre_mask', 'state', 'genre_mask'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -16,8 +80,20 @@ class Venue(db.Model):
     website = db.Column(db.String(120)) #missing field
     seeking_description = db.Column(db.String(500)) #missing field
     seeking_talent = db.Column(db.Boolean, default=False) #missing field
-    genres = db.Column(db.String(120)) #missing field
-    shows = db.relationship('Show', backref='Venue') #missing field
+    # degrees; from the venue form or looked up in Place (nearby.locate)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # kept by counters.py, see CounterClock
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.now, server_default=db.func.now(), onupdate=datetime.now, index=True)
+    # bumped by every edit (app.edit_entity); edit forms send back the
+    # version they showed, so a concurrent edit is refused, not overwritten
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # genre_mask(genre ids) of the genre links, for matches.py scoring
+    genre_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    genres = db.relationship('Genre', secondary=venue_genres, order_by=Genre.id)
+    shows = db.relationship('Show', backref='Venue', cascade='all, delete') #missing field
 
     def __repr__(self):
         return f'<Venue {self.id} {self.name}>'
@@ -26,31 +102,152 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        # matchmaking candidates: same state, sharing a genre bit
+        db.Index('ix_Artist_state_genre_mask', 'state', 'genre_mask'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     website = db.Column(db.String(120)) #missing field
     seeking_description = db.Column(db.String(500)) #missing field
     seeking_venue = db.Column(db.Boolean, default=False) #missing field
-    genres = db.Column(db.String(120)) #missing field
-    shows = db.relationship('Show', backref='Artist') #missing field
+    # kept by counters.py, see CounterClock
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.now, server_default=db.func.now(), onupdate=datetime.now, index=True)
+    # bumped by every edit (app.edit_entity); edit forms send back the
+    # version they showed, so a concurrent edit is refused, not overwritten
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # genre_mask(genre ids) of the genre links, for matches.py scoring
+    genre_mask = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    genres = db.relationship('Genre', secondary=artist_genres, order_by=Genre.id)
+    shows = db.relationship('Show', backref='Artist', cascade='all, delete') #missing field
 
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
+# The show counters on Venue and Artist count a show as upcoming while it
+# starts at or after rolled_over_at, the time of the last `flask counters
+# rollover`; the table holds a single row.
+class CounterClock(db.Model):
+    __tablename__ = 'CounterClock'
+
+    id = db.Column(db.Integer, primary_key=True)
+    rolled_over_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+
+@db.event.listens_for(CounterClock.__table__, 'after_create')
+def start_counter_clock(target, connection, **kw):
+    connection.execute(target.insert(), {'id': 1, 'rolled_over_at': datetime.now()})
+
+
+# When rows were last hard-deleted from Venue, Artist and Show. A deleted row
+# takes its updated_at with it, so listing validators (conditional.py) read
+# this alongside max(updated_at).
+class Deletion(db.Model):
+    __tablename__ = 'Deletion'
+
+    table_name = db.Column(db.String(50), primary_key=True)
+    deleted_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+
+@db.event.listens_for(Deletion.__table__, 'after_create')
+def start_deletions(target, connection, **kw):
+    connection.execute(target.insert(), [
+        {'table_name': name, 'deleted_at': datetime.now()} for name in ('Venue', 'Artist', 'Show')
+    ])
+
+
+# Offline geocoding table: the coordinates of a city, used for venues listed
+# without their own. Loaded with `flask geo load-places`.
+class Place(db.Model):
+    __tablename__ = 'Place'
+
+    city = db.Column(db.String(120), primary_key=True)
+    state = db.Column(db.String(120), primary_key=True)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+
+
+# Precomputed matchmaking lists (matches.py): for side 'artist' the best
+# venues for artist owner_id, for side 'venue' the best artists for venue
+# owner_id. Read by (side, owner_id) in score order; (side, candidate_id)
+# finds the lists an entity appears in when it changes.
+class Match(db.Model):
+    __tablename__ = 'Match'
+    __table_args__ = (
+        db.Index('ix_Match_side_owner_id_score', 'side', 'owner_id', 'score'),
+        db.Index('ix_Match_side_candidate_id', 'side', 'candidate_id'),
+    )
+
+    side = db.Column(db.String(6), primary_key=True)
+    owner_id = db.Column(db.Integer, primary_key=True)
+    candidate_id = db.Column(db.Integer, primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+
+def default_end_time(context):
+    return context.get_current_parameters()['start_time'] + DEFAULT_SHOW_DURATION
+
+
+class ShowTime(db.TypeDecorator):
+    # a timestamp with time zone. Postgres keeps the offset; SQLite would
+    # keep only the wall time, so aware values are stored there in local
+    # time, which is how naive timestamps are read everywhere else
+    impl = db.DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None and dialect.name != 'postgresql':
+            return value.astimezone().replace(tzinfo=None)
+        return value
+
+
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        # keyset pagination on /shows walks (start_time, id) in order
+        db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+        # venue and artist pages fetch their shows in start_time order
+        db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
-    start_time = db.Column(db.DateTime(timezone=True), nullable=False)
+    # deleting a venue or artist takes its shows along (app.delete_entities)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), nullable=False)
+    start_time = db.Column(ShowTime(timezone=True), nullable=False)
+    end_time = db.Column(ShowTime(timezone=True), nullable=False, default=default_end_time)
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.now, server_default=db.func.now(), onupdate=datetime.now, index=True)
 
 
+# On Postgres a GiST exclusion constraint per venue and per artist rejects
+# overlapping [start_time, end_time) bookings and serves the range queries
+# in bookings.py. Other databases run the same checks as range queries there.
+SHOW_EXCLUSIONS = [
+    db.DDL('CREATE EXTENSION IF NOT EXISTS btree_gist'),
+    db.DDL('ALTER TABLE "Show" ADD CONSTRAINT "Show_venue_no_overlap" '
+           'EXCLUDE USING gist (venue_id WITH =, tstzrange(start_time, end_time) WITH &&)'),
+    db.DDL('ALTER TABLE "Show" ADD CONSTRAINT "Show_artist_no_overlap" '
+           'EXCLUDE USING gist (artist_id WITH =, tstzrange(start_time, end_time) WITH &&)'),
+]
+for exclusion in SHOW_EXCLUSIONS:
+    db.event.listen(Show.__table__, 'after_create', exclusion.execute_if(dialect='postgresql'))
 
-db.create_all()
\ No newline at end of file
+# On Postgres the earthdistance extension and a GiST index over each venue's
+# point answer the radius and nearest-first queries in nearby.py. Other
+# databases use the in-process grid there.
+VENUE_LOCATION_INDEX = [
+    db.DDL('CREATE EXTENSION IF NOT EXISTS cube'),
+    db.DDL('CREATE EXTENSION IF NOT EXISTS earthdistance'),
+    db.DDL('CREATE INDEX "ix_Venue_location" ON "Venue" USING gist (ll_to_earth(latitude, longitude))'),
+]
+for statement in VENUE_LOCATION_INDEX:
+    db.event.listen(Venue.__table__, 'after_create', statement.execute_if(dialect='postgresql'))
@@ -0,0 +1,349 @@
+#nearby: "venues near" radius and nearest-first search
+#
+#   flask geo load-places places.csv
+#   flask geo fill-venues
+#
+# Venues carry latitude/longitude, given on the venue form or looked up by
+# city and state in the Place table. On Postgres a GiST index over
+# ll_to_earth(latitude, longitude) (models.VENUE_LOCATION_INDEX) serves both
+# the radius filter (earth_box @>) and the nearest-first order (<->). Other
+# databases keep every venue's point in an in-process grid of CELL_DEGREES
+# cells, grouped into blocks of BLOCK_CELLS x BLOCK_CELLS cells. Searches go
+# best-first through the blocks around the query point and only look at the
+# populated cells of each, and the grid is kept current from committed
+# inserts, updates and deletes.
+import csv
+import heapq
+import math
+from threading import Lock
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, func, tuple_
+from sqlalchemy.orm import object_session
+from werkzeug.local import LocalProxy
+
+from extensions import db
+from models import Venue, Place
+
+EARTH_RADIUS_KM = 6371.0088
+CELL_DEGREES = 0.1
+LAT_CELLS = int(round(180 / CELL_DEGREES))
+LNG_CELLS = int(round(360 / CELL_DEGREES))
+BLOCK_CELLS = 10
+BLOCK_DEGREES = CELL_DEGREES * BLOCK_CELLS
+LAT_BLOCKS = LAT_CELLS // BLOCK_CELLS
+LNG_BLOCKS = LNG_CELLS // BLOCK_CELLS
+
+
+def row_cos(size, rows):
+    # the smallest cos(latitude) within each row of `size` degrees
+    return [
+        max(0.0, min(math.cos(math.radians(row * size - 90)), math.cos(math.radians((row + 1) * size - 90))))
+        for row in range(rows)
+    ]
+
+
+ROW_COS = row_cos(CELL_DEGREES, LAT_CELLS)
+BLOCK_ROW_COS = row_cos(BLOCK_DEGREES, LAT_BLOCKS)
+
+
+def on_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def valid(latitude, longitude):
+    return latitude is not None and longitude is not None and -90 <= latitude <= 90 and -180 <= longitude <= 180
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    # great-circle distance in km
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+class GridIndex(object):
+    # venue points bucketed by (lat, lng) cell, and the populated cells by
+    # block. Each cell and block holds a tuple that is replaced, never
+    # changed, so searches read it without the lock.
+
+    def __init__(self):
+        self.lock = Lock()
+        self.loaded = False
+        self.cells = {}
+        self.blocks = {}
+        self.points = {}
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.cells.clear()
+            self.blocks.clear()
+            self.points.clear()
+            rows = db.session.query(Venue.id, Venue.latitude, Venue.longitude).filter(
+                Venue.latitude.isnot(None), Venue.longitude.isnot(None)
+            )
+            buckets = {}
+            for row_id, latitude, longitude in rows:
+                if valid(latitude, longitude):
+                    self.points[row_id] = (latitude, longitude)
+                    buckets.setdefault(self.cell(latitude, longitude), []).append((row_id, latitude, longitude))
+            self.cells.update((cell, tuple(points)) for cell, points in buckets.items())
+            blocks = {}
+            for cell in buckets:
+                blocks.setdefault(self.block(cell), []).append(cell)
+            self.blocks.update((block, tuple(cells)) for block, cells in blocks.items())
+            self.loaded = True
+
+    @staticmethod
+    def cell(latitude, longitude):
+        row = min(int((latitude + 90) // CELL_DEGREES), LAT_CELLS - 1)
+        return row, int((longitude + 180) // CELL_DEGREES) % LNG_CELLS
+
+    @staticmethod
+    def block(cell):
+        return cell[0] // BLOCK_CELLS, cell[1] // BLOCK_CELLS
+
+    def move(self, row_id, latitude, longitude):
+        # (None, None) removes the venue; a grid not loaded yet reads it on
+        # load, which holds the lock while it queries
+        with self.lock:
+            if not self.loaded:
+                return
+            previous = self.points.pop(row_id, None)
+            if previous is not None:
+                cell = self.cell(*previous)
+                remaining = tuple(point for point in self.cells[cell] if point[0] != row_id)
+                if remaining:
+                    self.cells[cell] = remaining
+                else:
+                    del self.cells[cell]
+                    block = self.block(cell)
+                    cells = tuple(other for other in self.blocks[block] if other != cell)
+                    if cells:
+                        self.blocks[block] = cells
+                    else:
+                        del self.blocks[block]
+            if valid(latitude, longitude):
+                self.points[row_id] = (latitude, longitude)
+                cell = self.cell(latitude, longitude)
+                if cell not in self.cells:
+                    block = self.block(cell)
+                    self.blocks[block] = self.blocks.get(block, ()) + (cell,)
+                self.cells[cell] = self.cells.get(cell, ()) + ((row_id, latitude, longitude),)
+
+    @staticmethod
+    def bound(latitude, longitude, cos_latitude, area, size, area_row_cos):
+        # a lower bound on the distance from the point to anything in the
+        # cell or block: the haversine formula with the smallest latitude
+        # and longitude gaps and the smallest cos(latitude) it allows
+        south = area[0] * size - 90
+        lat_gap = max(0.0, south - latitude, latitude - south - size)
+        offset = (longitude - area[1] * size + 180) % 360
+        lng_gap = 0.0 if offset <= size else min(offset - size, 360 - offset)
+        h = math.sin(math.radians(lat_gap) / 2) ** 2
+        if lng_gap:
+            h += cos_latitude * area_row_cos[area[0]] * math.sin(math.radians(lng_gap) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+    def nearest(self, latitude, longitude, radius_km):
+        # yields (distance_km, venue_id) nearest first, up to radius_km.
+        # Blocks and cells are visited in order of their lower bound, and a
+        # venue is yielded once nothing unvisited could hold a nearer one.
+        # Blocks spread out from the query point's block through their
+        # neighbours (the blocks meeting the search circle are connected);
+        # a visited block queues its populated cells, so empty cells cost
+        # nothing and empty blocks one bound each.
+        start = self.block(self.cell(latitude, longitude))
+        cos_latitude = math.cos(math.radians(latitude))
+        # (bound, 0, block) or (bound, 1, cell)
+        queue = [(0.0, 0, start)]
+        seen = {start}
+        found = []
+        unseen_points = len(self.points)
+        while found or queue:
+            if found and (not queue or found[0][0] <= queue[0][0]):
+                distance, row_id = heapq.heappop(found)
+                if distance > radius_km:
+                    return
+                yield distance, row_id
+                continue
+            bound, is_cell, area = heapq.heappop(queue)
+            if bound > radius_km or not unseen_points:
+                # nothing left to find; drain what was found
+                queue = []
+                continue
+            if is_cell:
+                for row_id, point_lat, point_lng in self.cells.get(area, ()):
+                    unseen_points -= 1
+                    heapq.heappush(found, (haversine(latitude, longitude, point_lat, point_lng), row_id))
+                continue
+            for cell in self.blocks.get(area, ()):
+                cell_bound = self.bound(latitude, longitude, cos_latitude, cell, CELL_DEGREES, ROW_COS)
+                if cell_bound <= radius_km:
+                    heapq.heappush(queue, (cell_bound, 1, cell))
+            row, column = area
+            for step_row in (-1, 0, 1):
+                for step_column in (-1, 0, 1):
+                    neighbour = (row + step_row, (column + step_column) % LNG_BLOCKS)
+                    if 0 <= neighbour[0] < LAT_BLOCKS and neighbour not in seen:
+                        seen.add(neighbour)
+                        heapq.heappush(queue, (
+                            self.bound(latitude, longitude, cos_latitude, neighbour, BLOCK_DEGREES, BLOCK_ROW_COS),
+                            0, neighbour,
+                        ))
+
+
+def init_app(app):
+    # each app keeps the grid of its own database
+    app.extensions['nearby'] = GridIndex()
+
+
+grid = LocalProxy(lambda: current_app.extensions['nearby'])
+
+
+def find(columns, latitude, longitude, radius_km, limit, upcoming=False):
+    # [(distance_km, (venue id, *columns))] for up to `limit` venues within
+    # radius_km, nearest first; `upcoming` keeps venues with shows to come
+    if on_postgres():
+        point = func.ll_to_earth(latitude, longitude)
+        location = func.ll_to_earth(Venue.latitude, Venue.longitude)
+        distance = func.earth_distance(location, point)
+        query = db.session.query(distance / 1000.0, Venue.id, *columns).filter(
+            func.earth_box(point, radius_km * 1000.0).op('@>')(location),
+            distance <= radius_km * 1000.0,
+        )
+        if upcoming:
+            query = query.filter(Venue.upcoming_shows_count > 0)
+        rows = query.order_by(location.op('<->')(point)).limit(limit)
+        return [(row[0], tuple(row[1:])) for row in rows]
+
+    if not grid.loaded:
+        grid.load()
+    results = []
+    candidates = grid.nearest(latitude, longitude, radius_km)
+    while len(results) < limit:
+        # the rows for the next candidates, in one query; with the upcoming
+        # filter some drop out, so more are asked for at a time
+        wanted = limit - len(results)
+        batch = [candidate for _, candidate in zip(range(max(wanted * 2, 100) if upcoming else wanted), candidates)]
+        if not batch:
+            break
+        query = db.session.query(Venue.id, *columns).filter(Venue.id.in_([row_id for _, row_id in batch]))
+        if upcoming:
+            query = query.filter(Venue.upcoming_shows_count > 0)
+        rows = {row[0]: tuple(row) for row in query}
+        results.extend((distance, rows[row_id]) for distance, row_id in batch if row_id in rows)
+    return results[:limit]
+
+
+def locate(city, state, latitude=None, longitude=None):
+    # the venue's coordinates: those given when valid, else its city's
+    if valid(latitude, longitude):
+        return latitude, longitude
+    place = db.session.query(Place.latitude, Place.longitude).filter(Place.city == city, Place.state == state).first()
+    return tuple(place) if place is not None else (None, None)
+
+
+def locate_many(places):
+    # {(city, state): (latitude, longitude)} for the known ones, one query
+    places = list(set(places))
+    if not places:
+        return {}
+    rows = db.session.query(Place.city, Place.state, Place.latitude, Place.longitude).filter(
+        tuple_(Place.city, Place.state).in_(places)
+    )
+    return {(city, state): (latitude, longitude) for city, state, latitude, longitude in rows}
+
+
+#----------------------------------------------------------------------------#
+# Keeping the in-process grid current.
+#----------------------------------------------------------------------------#
+
+def queue_change(mapper, connection, target, deleted=False):
+    session = object_session(target)
+    if session is None:
+        return
+    point = (None, None) if deleted else (target.latitude, target.longitude)
+    session.info.setdefault('nearby_changes', []).append((target.id,) + point)
+
+
+def queue_delete(mapper, connection, target):
+    queue_change(mapper, connection, target, deleted=True)
+
+
+def relocate(row_id, latitude, longitude):
+    # a venue moved with a set-based UPDATE
+    db.session.info.setdefault('nearby_changes', []).append((row_id, latitude, longitude))
+
+
+def forget(row_ids):
+    # venues removed with a bulk DELETE
+    db.session.info.setdefault('nearby_changes', []).extend((row_id, None, None) for row_id in row_ids)
+
+
+def apply_changes(session):
+    for row_id, latitude, longitude in session.info.pop('nearby_changes', []):
+        grid.move(row_id, latitude, longitude)
+
+
+def discard_changes(session, previous_transaction):
+    session.info.pop('nearby_changes', None)
+
+
+event.listen(Venue, 'after_insert', queue_change)
+event.listen(Venue, 'after_update', queue_change)
+event.listen(Venue, 'after_delete', queue_delete)
+event.listen(db.session, 'after_commit', apply_changes)
+event.listen(db.session, 'after_soft_rollback', discard_changes)
+
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+geo_cli = AppGroup('geo', help='Geocode venues from the Place table.')
+
+
+@geo_cli.command('load-places')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def load_places_command(path):
+    """Load city coordinates from a CSV with city, state, latitude and longitude columns."""
+    with open(path, newline='', encoding='utf-8') as source:
+        rows = {}
+        for record in csv.DictReader(source):
+            try:
+                latitude, longitude = float(record['latitude']), float(record['longitude'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if record.get('city') and record.get('state') and valid(latitude, longitude):
+                rows[(record['city'], record['state'])] = {
+                    'city': record['city'], 'state': record['state'], 'latitude': latitude, 'longitude': longitude,
+                }
+    if rows:
+        table = Place.__table__
+        db.session.execute(table.delete().where(tuple_(table.c.city, table.c.state).in_(list(rows))))
+        db.session.execute(table.insert(), list(rows.values()))
+        db.session.commit()
+    click.echo('{} places loaded'.format(len(rows)))
+
+
+@geo_cli.command('fill-venues')
+def fill_venues_command():
+    """Give venues without coordinates those of their city."""
+    table = Venue.__table__
+    missing = db.session.query(Venue.city, Venue.state).filter(
+        Venue.latitude.is_(None) | Venue.longitude.is_(None)
+    ).distinct()
+    found = locate_many(tuple(place) for place in missing)
+    filled = 0
+    for (city, state), (latitude, longitude) in found.items():
+        filled += db.session.execute(table.update().where(
+            table.c.city == city, table.c.state == state,
+            table.c.latitude.is_(None) | table.c.longitude.is_(None),
+        ).values(latitude=latitude, longitude=longitude)).rowcount
+    db.session.commit()
+    click.echo('{} venues filled from {} places'.format(filled, len(found)))
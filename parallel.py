@@ -0,0 +1,107 @@
+#parallel: run a view's independent queries side by side
+#
+# gather(a, b, c) returns [a(), b(), c()]. With CONCURRENT_DETAIL_QUERIES on,
+# the first callable runs on the request thread and the rest on a bounded
+# thread pool, each in its own app context and therefore its own session and
+# pooled connection, so latency is the slowest query instead of the sum.
+# A call only goes to a worker when a worker slot and a pooled connection
+# are free at that moment; otherwise it runs on the request thread, which
+# already holds a connection, so requests never wait on each other's
+# workers. See DETAIL_QUERY_WORKERS in config.py for sizing.
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import BoundedSemaphore
+
+from flask import current_app, g
+
+import audit
+import metrics
+from extensions import db
+
+
+def pool_capacity(app):
+    # connections the engine's pool hands out at once, None when unbounded
+    options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+    if 'pool_size' not in options:
+        return None
+    return options['pool_size'] + options.get('max_overflow', 0)
+
+
+class DetailQueries(object):
+    # an app's query workers and the slots that bound the connections they
+    # hold, across all requests
+
+    def __init__(self, workers, capacity):
+        self.capacity = capacity
+        if capacity is not None:
+            # one connection is always left for the request threads
+            workers = min(workers, capacity - 1)
+        self.workers = max(workers, 0)
+        self.slots = BoundedSemaphore(self.workers) if self.workers else None
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='fyyur-query'
+        ) if self.workers else None
+
+    def reserve(self, wanted):
+        # up to `wanted` slots, as many as are free now; never waits
+        if self.slots is None:
+            return 0
+        if self.capacity is not None:
+            checkedout = getattr(db.engine.pool, 'checkedout', None)
+            if checkedout is not None:
+                wanted = min(wanted, self.capacity - checkedout())
+        taken = 0
+        while taken < wanted and self.slots.acquire(blocking=False):
+            taken += 1
+        return taken
+
+    def release(self, taken):
+        for _ in range(taken):
+            self.slots.release()
+
+
+def init_app(app):
+    # each app has its own workers; threads start on first use
+    app.extensions['parallel'] = DetailQueries(app.config['DETAIL_QUERY_WORKERS'], pool_capacity(app))
+
+
+def in_app_context(app, call, shared):
+    # the request's g is visible to the worker, but its queries go to fresh
+    # metrics and audit records so that no two threads write one counter;
+    # returns (result, {g name: record}) for gather to merge
+    def run():
+        with app.app_context():
+            vars(g).update(shared)
+            tallies = {}
+            if shared.get('request_timings') is not None:
+                g.request_timings = tallies['request_timings'] = metrics.RequestTimings()
+            if shared.get('query_audit') is not None:
+                g.query_audit = tallies['query_audit'] = audit.RequestAudit()
+            return call(), tallies
+    return run
+
+
+def gather(*calls):
+    if not current_app.config.get('CONCURRENT_DETAIL_QUERIES') or len(calls) < 2:
+        return [call() for call in calls]
+
+    app = current_app._get_current_object()
+    queries = app.extensions['parallel']
+    taken = queries.reserve(len(calls) - 1)
+    if not taken:
+        return [call() for call in calls]
+
+    shared = dict(vars(g))
+    futures = [queries.executor.submit(in_app_context(app, call, shared)) for call in calls[1:taken + 1]]
+    try:
+        # the first call and any that found no free slot run here
+        first = calls[0]()
+        rest = [call() for call in calls[taken + 1:]]
+    finally:
+        # never leave workers running past the request
+        wait(futures)
+        queries.release(taken)
+    done = [future.result() for future in futures]
+    for _, tallies in done:
+        for name, tally in tallies.items():
+            getattr(g, name).merge(tally)
+    return [first] + [result for result, _ in done] + rest
@@ -0,0 +1,213 @@
+#search: indexed, ranked name/city/state search for venues and artists
+from collections import defaultdict
+from threading import Lock
+
+from sqlalchemy import event, func, or_
+from sqlalchemy.orm import object_session
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+from extensions import db
+from models import Venue, Artist
+
+SEARCH_FIELDS = ('name', 'city', 'state')
+INDEXED_MODELS = (Venue, Artist)
+GRAM_SIZE = 3
+
+
+def grams(text):
+    # every substring of up to GRAM_SIZE characters, so that any query can be
+    # answered from the postings of its own grams
+    text = text.lower()
+    found = set()
+    for size in range(1, GRAM_SIZE + 1):
+        for start in range(len(text) - size + 1):
+            found.add(text[start:start + size])
+    return found
+
+
+def query_grams(term):
+    # the smallest set of grams that must all appear in a matching document
+    if len(term) <= GRAM_SIZE:
+        return {term}
+    return {term[start:start + GRAM_SIZE] for start in range(len(term) - GRAM_SIZE + 1)}
+
+
+def rank(term, name):
+    # lower is better: name prefix, word in name, anywhere in name, location
+    name = name.lower()
+    if name.startswith(term):
+        return 0
+    if (' ' + term) in name:
+        return 1
+    if term in name:
+        return 2
+    return 3
+
+
+class InvertedIndex(object):
+    # in-process gram index used when the database has no trigram support
+    # (SQLite test and benchmark runs). Loaded lazily from the table on first
+    # search and kept current from committed inserts, updates and deletes.
+    # Postings are changed in place, so lookups take the lock as well.
+
+    def __init__(self, model):
+        self.model = model
+        self.lock = Lock()
+        self.loaded = False
+        self.postings = defaultdict(set)
+        self.documents = {}
+
+    def load(self):
+        # read under the lock, so a commit applied meanwhile waits for it
+        with self.lock:
+            if self.loaded:
+                return
+            self.postings.clear()
+            self.documents.clear()
+            columns = [getattr(self.model, field) for field in SEARCH_FIELDS]
+            for row in db.session.query(self.model.id, *columns):
+                self.add(row[0], row[1:])
+            self.loaded = True
+
+    def move(self, row_id, values):
+        # None removes the row; an index not loaded yet reads it on load
+        with self.lock:
+            if not self.loaded:
+                return
+            if values is None:
+                self.remove(row_id)
+            else:
+                self.add(row_id, values)
+
+    def add(self, row_id, values):
+        self.remove(row_id)
+        values = tuple(value or '' for value in values)
+        self.documents[row_id] = values
+        for value in values:
+            for gram in grams(value):
+                self.postings[gram].add(row_id)
+
+    def remove(self, row_id):
+        values = self.documents.pop(row_id, None)
+        if values is None:
+            return
+        for value in values:
+            for gram in grams(value):
+                ids = self.postings.get(gram)
+                if ids is not None:
+                    ids.discard(row_id)
+                    if not ids:
+                        del self.postings[gram]
+
+    def search(self, term, limit):
+        if not self.loaded:
+            self.load()
+        matches = []
+        with self.lock:
+            postings = sorted((self.postings.get(gram, set()) for gram in query_grams(term)), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:]) if postings else set()
+            for row_id in candidates:
+                values = self.documents[row_id]
+                if any(term in value.lower() for value in values):
+                    matches.append((rank(term, values[0]), values[0].lower(), row_id, values[0]))
+        matches.sort()
+        return len(matches), [{"id": row_id, "name": name} for _, _, row_id, name in matches[:limit]]
+
+
+def init_app(app):
+    # each app indexes its own database
+    app.extensions['search'] = {model: InvertedIndex(model) for model in INDEXED_MODELS}
+
+
+indexes = LocalProxy(lambda: current_app.extensions['search'])
+
+
+def list_all(model, limit):
+    # an empty search lists everything, alphabetically
+    rows = db.session.query(model.id, model.name, func.count().over()).order_by(
+        model.name, model.id
+    ).limit(limit).all()
+
+    total = rows[0][2] if rows else 0
+    return total, [{"id": row_id, "name": name} for row_id, name, _ in rows]
+
+
+def trigram_search(model, term, limit):
+    # ILIKE '%term%' is served by the GIN trigram indexes; similarity() ranks
+    # the matches and the window count gives the total in the same round trip
+    pattern = '%{}%'.format(term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+    columns = [getattr(model, field) for field in SEARCH_FIELDS]
+    score = func.greatest(*[func.similarity(column, term) for column in columns])
+
+    rows = db.session.query(model.id, model.name, func.count().over()).filter(
+        or_(*[column.ilike(pattern, escape='\\') for column in columns])
+    ).order_by(score.desc(), model.id).limit(limit).all()
+
+    total = rows[0][2] if rows else 0
+    return total, [{"id": row_id, "name": name} for row_id, name, _ in rows]
+
+
+def find(model, term, limit=None):
+    # returns the search response the search templates expect:
+    # {'count': <total matches>, 'data': [{'id': ..., 'name': ...}, ...]}
+    term = term.strip().lower()
+    if limit is None:
+        limit = current_app.config.get('SEARCH_RESULTS_LIMIT', 50)
+    if not term:
+        total, data = list_all(model, limit)
+    elif db.engine.dialect.name == 'postgresql':
+        total, data = trigram_search(model, term, limit)
+    else:
+        total, data = indexes[model].search(term, limit)
+    return {
+        'count': total,
+        'data': data
+    }
+
+
+#----------------------------------------------------------------------------#
+# Keeping the in-process index current.
+#----------------------------------------------------------------------------#
+
+def queue_change(mapper, connection, target, deleted=False):
+    session = object_session(target)
+    if session is None:
+        return
+    values = None if deleted else tuple(getattr(target, field) for field in SEARCH_FIELDS)
+    session.info.setdefault('search_changes', []).append((type(target), target.id, values))
+
+
+def queue_delete(mapper, connection, target):
+    queue_change(mapper, connection, target, deleted=True)
+
+
+def forget(model, row_ids):
+    # rows removed with a bulk DELETE, which the mapper events never see
+    changes = db.session.info.setdefault('search_changes', [])
+    changes.extend((model, row_id, None) for row_id in row_ids)
+
+
+def reindex(model, row_id, values):
+    # a row changed with a set-based UPDATE; values follow SEARCH_FIELDS
+    changes = db.session.info.setdefault('search_changes', [])
+    changes.append((model, row_id, tuple(values)))
+
+
+def apply_changes(session):
+    for model, row_id, values in session.info.pop('search_changes', []):
+        indexes[model].move(row_id, values)
+
+
+def discard_changes(session, previous_transaction):
+    session.info.pop('search_changes', None)
+
+
+for indexed_model in INDEXED_MODELS:
+    event.listen(indexed_model, 'after_insert', queue_change)
+    event.listen(indexed_model, 'after_update', queue_change)
+    event.listen(indexed_model, 'after_delete', queue_delete)
+
+event.listen(db.session, 'after_commit', apply_changes)
+event.listen(db.session, 'after_soft_rollback', discard_changes)
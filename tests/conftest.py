@@ -0,0 +1,26 @@
+#conftest: an app on the `test` profile (strict query audit, in-memory SQLite)
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from app import create_app
+from extensions import db
+
+
+@pytest.fixture
+def app():
+    app = create_app(config.load('test'))
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,96 @@
+#test_audit: QueryAuditError for per-row queries, none for the fixed views
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from audit import QueryAuditError
+from extensions import db
+from models import Venue
+
+STATES = ['CA', 'NY', 'TX', 'WA', 'OR', 'FL', 'GA', 'IL']
+
+
+def venue_form(name, state, **fields):
+    form = {
+        'name': name, 'city': 'Springfield', 'state': state, 'address': '1 Main St',
+        'genres': ['Jazz'], 'facebook_link': 'https://www.facebook.com/fyyur', 'seeking_talent': 'y',
+    }
+    form.update(fields)
+    return form
+
+
+def artist_form(name, state):
+    return {
+        'name': name, 'city': 'Springfield', 'state': state,
+        'genres': ['Jazz'], 'facebook_link': 'https://www.facebook.com/fyyur', 'seeking_venue': 'y',
+    }
+
+
+@pytest.fixture
+def catalogue(client):
+    # a venue and an artist in each state, every artist booked at venue 1
+    for number, state in enumerate(STATES, 1):
+        assert client.post('/venues/create', data=venue_form('Venue {}'.format(number), state)).status_code == 200
+        assert client.post('/artists/create', data=artist_form('Artist {}'.format(number), state)).status_code == 200
+    start = datetime.now().replace(microsecond=0) + timedelta(days=1)
+    shows = [
+        {'artist_id': artist_id, 'venue_id': 1, 'start_time': (start + timedelta(days=artist_id)).isoformat()}
+        for artist_id in range(1, len(STATES) + 1)
+    ] + [{'artist_id': 1, 'venue_id': 2, 'start_time': (start - timedelta(days=30)).isoformat()}]
+    response = client.post('/shows/batch', json={'shows': shows})
+    assert response.status_code == 201, response.json
+    return client
+
+
+@pytest.fixture
+def n_plus_one(app):
+    # a view that loads each venue with its own query
+    def view():
+        ids = [venue_id for venue_id, in db.session.query(Venue.id)]
+        return ','.join(db.session.query(Venue).get(venue_id).name for venue_id in ids)
+    app.add_url_rule('/n-plus-one', 'n_plus_one', view)
+    return app
+
+
+def test_repeated_query_fails_the_request(n_plus_one, catalogue):
+    with pytest.raises(QueryAuditError) as error:
+        catalogue.get('/n-plus-one')
+    assert 'identical queries' in str(error.value)
+    assert 'test_audit.py' in str(error.value)
+
+
+def test_origin_found_through_a_symlinked_root(n_plus_one, catalogue, tmp_path):
+    link = tmp_path / 'fyyur'
+    os.symlink(n_plus_one.root_path, str(link))
+    n_plus_one.root_path = str(link)
+    with pytest.raises(QueryAuditError) as error:
+        catalogue.get('/n-plus-one')
+    assert '({}:'.format(os.path.join('tests', 'test_audit.py')) in str(error.value)
+
+
+def test_few_repeats_pass(n_plus_one, client):
+    for number in range(n_plus_one.config['QUERY_AUDIT_REPEAT_THRESHOLD']):
+        db.session.add(Venue(name='Venue {}'.format(number), city='Springfield', state='CA', address='1 Main St'))
+    db.session.commit()
+    assert client.get('/n-plus-one').status_code == 200
+
+
+@pytest.mark.parametrize('url', [
+    '/venues', '/artists', '/shows', '/venues/1', '/artists/1', '/venues/1/matches', '/artists/1/matches',
+    '/api/v1/venues', '/api/v1/artists', '/api/v1/shows', '/api/v1/venues/1', '/api/v1/artists/1',
+    '/api/v1/venues/1/matches', '/api/v1/artists/1/matches',
+])
+def test_views_run_no_repeated_queries(catalogue, url):
+    assert catalogue.get(url).status_code == 200
+
+
+def test_search_runs_no_repeated_queries(catalogue):
+    assert catalogue.post('/venues/search', data={'search_term': 'venue'}).status_code == 200
+    assert catalogue.post('/artists/search', data={'search_term': 'artist'}).status_code == 200
+
+
+def test_edit_relists_every_state_in_one_query(catalogue):
+    # venue 1 is on the match list of an artist in every state
+    response = catalogue.post('/venues/1/edit', data=venue_form('Venue 1', 'CA', seeking_talent=''))
+    assert response.status_code == 302
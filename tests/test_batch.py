@@ -0,0 +1,53 @@
+#test_batch: many shows in one transaction, all or nothing unless partial
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions import db
+from models import Show
+from test_audit import venue_form, artist_form
+
+START = (datetime.now() + timedelta(days=30)).replace(hour=20, minute=0, second=0, microsecond=0)
+
+
+@pytest.fixture
+def roster(client):
+    assert client.post('/venues/create', data=venue_form('Venue 1', 'CA')).status_code == 200
+    for number in (1, 2):
+        assert client.post('/artists/create', data=artist_form('Artist {}'.format(number), 'CA')).status_code == 200
+    return client
+
+
+def rows():
+    # rows 2 and 4 fail: an unknown venue and an unreadable start time
+    return [
+        {'artist_id': 1, 'venue_id': 1, 'start_time': START.isoformat()},
+        {'artist_id': 1, 'venue_id': 9, 'start_time': (START + timedelta(days=1)).isoformat()},
+        {'artist_id': 2, 'venue_id': 1, 'start_time': (START + timedelta(days=2)).isoformat()},
+        {'artist_id': 2, 'venue_id': 1, 'start_time': 'tomorrow'},
+    ]
+
+
+def test_one_bad_row_rejects_the_batch(roster):
+    response = roster.post('/shows/batch', json={'shows': rows()})
+    assert response.status_code == 400
+    assert response.json['created'] == 0
+    assert [error['row'] for error in response.json['errors']] == [2, 4]
+    assert db.session.query(Show).count() == 0
+
+
+def test_partial_saves_the_valid_rows(roster):
+    response = roster.post('/shows/batch', json={'shows': rows(), 'partial': True})
+    assert response.status_code == 200
+    assert response.json['created'] == 2
+    assert [error['row'] for error in response.json['errors']] == [2, 4]
+    assert 'no venue with id 9' in response.json['errors'][0]['error']
+    assert sorted(db.session.query(Show.artist_id, Show.venue_id)) == [(1, 1), (2, 1)]
+    assert roster.get('/api/v1/venues/1').json['upcoming_shows_count'] == 2
+
+
+def test_batch_size_is_limited(roster, app):
+    app.config['SHOW_BATCH_MAX_ROWS'] = 3
+    response = roster.post('/shows/batch', json={'shows': rows(), 'partial': True})
+    assert response.status_code == 400
+    assert db.session.query(Show).count() == 0
@@ -0,0 +1,70 @@
+#test_bookings: double bookings rejected against the database and within a batch
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from test_audit import venue_form, artist_form
+
+EVENING = (datetime.now() + timedelta(days=30)).replace(hour=20, minute=0, second=0, microsecond=0)
+
+
+def show(artist_id, venue_id, start, minutes=120):
+    return {'artist_id': artist_id, 'venue_id': venue_id, 'start_time': start.isoformat(), 'duration': minutes}
+
+
+@pytest.fixture
+def booked(client):
+    # venues 1-2 and artists 1-3; artist 1 plays venue 1 from 20:00 to 22:00
+    for number in (1, 2):
+        assert client.post('/venues/create', data=venue_form('Venue {}'.format(number), 'CA')).status_code == 200
+    for number in (1, 2, 3):
+        assert client.post('/artists/create', data=artist_form('Artist {}'.format(number), 'CA')).status_code == 200
+    assert client.post('/shows/batch', json={'shows': [show(1, 1, EVENING)]}).status_code == 201
+    return client
+
+
+@pytest.mark.parametrize('row', [
+    show(2, 1, EVENING + timedelta(hours=1)),   # the venue is taken
+    show(1, 2, EVENING - timedelta(hours=1)),   # the artist is elsewhere
+])
+def test_overlap_with_a_stored_show_is_rejected(booked, row):
+    response = booked.post('/shows/batch', json={'shows': [row]})
+    assert response.status_code == 400
+    assert response.json['created'] == 0
+    assert 'already booked' in response.json['errors'][0]['error']
+
+
+def test_back_to_back_shows_do_not_clash(booked):
+    response = booked.post('/shows/batch', json={'shows': [show(2, 1, EVENING + timedelta(hours=2))]})
+    assert response.status_code == 201
+
+
+def test_overlap_within_a_batch_is_rejected(booked):
+    later = EVENING + timedelta(days=1)
+    response = booked.post('/shows/batch', json={'shows': [
+        show(2, 2, later), show(3, 2, later + timedelta(minutes=30)), show(2, 1, later + timedelta(hours=1)),
+    ]})
+    assert response.status_code == 400
+    assert [error['row'] for error in response.json['errors']] == [2, 3]
+    assert 'overlaps row 1' in response.json['errors'][0]['error']
+
+
+def test_offsets_are_compared_in_utc(booked):
+    # the same evening, given at UTC+05:00
+    aware = EVENING.astimezone(timezone(timedelta(hours=5)))
+    response = booked.post('/shows/batch', json={'shows': [show(2, 1, aware + timedelta(hours=1))]})
+    assert response.status_code == 400
+
+
+def test_conflicts_lists_overlapping_shows(booked):
+    window = {'start': (EVENING - timedelta(hours=1)).isoformat(), 'end': (EVENING + timedelta(hours=1)).isoformat()}
+    response = booked.get('/api/v1/venues/1/conflicts', query_string=window)
+    assert response.status_code == 200
+    assert [found['id'] for found in response.json['shows']] == [1]
+    assert booked.get('/api/v1/venues/2/conflicts', query_string=window).json['shows'] == []
+
+
+def test_conflicts_needs_a_window_that_ends_after_it_starts(booked):
+    window = {'start': EVENING.isoformat(), 'end': EVENING.isoformat()}
+    assert booked.get('/api/v1/venues/1/conflicts', query_string=window).status_code == 400
+    assert booked.get('/api/v1/venues/1/conflicts').status_code == 400
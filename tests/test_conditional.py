@@ -0,0 +1,91 @@
+#test_conditional: ETags, 304s and what moves them
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import app as fyyur
+from test_audit import venue_form, artist_form
+
+
+@pytest.fixture
+def listed(client):
+    # artist 1 plays venue 1
+    for number in (1, 2):
+        assert client.post('/venues/create', data=venue_form('Venue {}'.format(number), 'CA')).status_code == 200
+        assert client.post('/artists/create', data=artist_form('Artist {}'.format(number), 'CA')).status_code == 200
+    start = (datetime.now() + timedelta(days=30)).replace(microsecond=0)
+    assert client.post('/shows/batch', json={'shows': [{'artist_id': 1, 'venue_id': 1, 'start_time': start.isoformat()}]}).status_code == 201
+    # a GET shows and so drops the flash messages, which skip revalidation
+    client.get('/')
+    return client
+
+
+def revalidate(client, url, etag):
+    return client.get(url, headers={'If-None-Match': etag})
+
+
+def test_matching_etag_gets_304(listed):
+    for url in ('/venues', '/artists', '/shows', '/venues/1', '/artists/1'):
+        first = listed.get(url)
+        assert first.status_code == 200
+        assert first.headers['Cache-Control'] == 'no-cache'
+        response = revalidate(listed, url, first.headers['ETag'])
+        assert response.status_code == 304, url
+        assert response.data == b''
+        assert response.headers['ETag'] == first.headers['ETag']
+
+
+def test_etag_differs_by_url(listed):
+    assert listed.get('/venues/1').headers['ETag'] != listed.get('/venues/2').headers['ETag']
+    assert listed.get('/venues').headers['ETag'] != listed.get('/venues?genre=Jazz').headers['ETag']
+
+
+def test_edit_moves_the_etag(listed):
+    etag = listed.get('/venues/1').headers['ETag']
+    assert listed.post('/venues/1/edit', data=venue_form('Venue One', 'CA')).status_code == 302
+    listed.get('/')
+    response = revalidate(listed, '/venues/1', etag)
+    assert response.status_code == 200
+    assert b'Venue One' in response.data
+
+
+def test_booked_artist_edit_moves_the_venue_etag(listed):
+    etags = {url: listed.get(url).headers['ETag'] for url in ('/venues/1', '/venues/2')}
+    assert listed.post('/artists/1/edit', data=artist_form('Artist One', 'CA')).status_code == 302
+    listed.get('/')
+    assert revalidate(listed, '/venues/1', etags['/venues/1']).status_code == 200
+    assert revalidate(listed, '/venues/2', etags['/venues/2']).status_code == 304
+
+
+def test_delete_moves_the_listing_etag(listed):
+    etag = listed.get('/venues').headers['ETag']
+    assert listed.delete('/venues/2').status_code == 200
+    assert revalidate(listed, '/venues', etag).status_code == 200
+
+
+def test_pending_flash_skips_revalidation(listed):
+    etag = listed.get('/venues/1').headers['ETag']
+    listed.post('/venues/1/edit', data=venue_form('Venue 1', 'CA'))
+    assert revalidate(listed, '/venues/1', etag).status_code == 200
+    assert revalidate(listed, '/venues/1', etag).status_code == 304
+
+
+def test_unknown_id_is_not_found(listed):
+    assert listed.get('/venues/9', headers={'If-None-Match': '*'}).status_code == 404
+
+
+def test_calendar_etag_follows_the_default_window(client, monkeypatch):
+    first = client.get('/shows/calendar')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert client.get('/shows/calendar', headers={'If-None-Match': etag}).status_code == 304
+
+    class Tomorrow(date):
+        @classmethod
+        def today(cls):
+            return date.fromordinal(date.today().toordinal() + 1)
+
+    monkeypatch.setattr(fyyur, 'date', Tomorrow)
+    later = client.get('/shows/calendar', headers={'If-None-Match': etag})
+    assert later.status_code == 200
+    assert later.headers['ETag'] != etag
@@ -0,0 +1,69 @@
+#test_counters: stored show counts agree with a recount after every kind of write
+from datetime import datetime, timedelta
+
+import pytest
+
+import counters
+from extensions import db
+from models import Venue, Artist, Show
+from test_audit import venue_form, artist_form
+
+START = (datetime.now() + timedelta(days=30)).replace(microsecond=0)
+
+
+@pytest.fixture
+def booked(client):
+    # every artist plays every venue once, one of them in the past
+    for number in (1, 2, 3):
+        assert client.post('/venues/create', data=venue_form('Venue {}'.format(number), 'CA')).status_code == 200
+        assert client.post('/artists/create', data=artist_form('Artist {}'.format(number), 'CA')).status_code == 200
+    shows = [
+        {'artist_id': artist_id, 'venue_id': venue_id, 'start_time': (START + timedelta(days=3 * artist_id + venue_id)).isoformat()}
+        for artist_id in (1, 2, 3) for venue_id in (1, 2, 3)
+    ]
+    shows[0]['start_time'] = (START - timedelta(days=60)).isoformat()
+    assert client.post('/shows/batch', json={'shows': shows}).status_code == 201
+    return client
+
+
+def counts(model, row_id):
+    row = db.session.query(model.upcoming_shows_count, model.past_shows_count).filter(model.id == row_id).one()
+    return tuple(row)
+
+
+def test_batch_is_counted(booked):
+    assert counters.drift() == []
+    assert counts(Venue, 1) == (2, 1)
+    assert counts(Artist, 2) == (3, 0)
+
+
+def test_no_drift_after_deletes(booked):
+    assert booked.delete('/venues/1').status_code == 200
+    assert booked.post('/artists/delete', json={'ids': [3]}).status_code == 200
+    assert counters.drift() == []
+    assert counts(Artist, 1) == (2, 0)
+    assert counts(Venue, 2) == (2, 0)
+
+
+def test_no_drift_after_orm_deletes(booked):
+    db.session.delete(db.session.query(Show).filter(Show.artist_id == 2, Show.venue_id == 2).one())
+    db.session.commit()
+    assert counters.drift() == []
+    assert counts(Venue, 2) == (2, 0)
+
+
+def test_rollover_moves_started_shows_to_past(booked):
+    assert counters.rollover(START + timedelta(days=5, hours=12)) == 1
+    assert counters.drift() == []
+    assert counts(Artist, 1) == (1, 2)
+    assert counters.rollover(START) == 0
+
+
+def test_drift_is_found_and_repaired(booked, app):
+    db.session.execute(Venue.__table__.update().where(Venue.id == 3).values(upcoming_shows_count=7))
+    db.session.commit()
+    assert counters.drift() == [('venue', 3, (7, 0), (3, 0))]
+    result = app.test_cli_runner().invoke(args=['counters', 'check', '--repair'])
+    assert result.exit_code == 0
+    assert counters.drift() == []
+    assert counts(Venue, 3) == (3, 0)
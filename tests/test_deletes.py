@@ -0,0 +1,60 @@
+#test_deletes: venues and artists go with their shows and genre links
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions import db
+from models import Venue, Show, venue_genres
+from test_audit import venue_form, artist_form
+
+START = (datetime.now() + timedelta(days=30)).replace(microsecond=0)
+
+
+@pytest.fixture
+def booked(client):
+    # artist 1 plays venues 1 and 2, artist 2 plays venue 2
+    for number in (1, 2, 3):
+        assert client.post('/venues/create', data=venue_form('Venue {}'.format(number), 'CA')).status_code == 200
+    for number in (1, 2):
+        assert client.post('/artists/create', data=artist_form('Artist {}'.format(number), 'CA')).status_code == 200
+    shows = [
+        {'artist_id': 1, 'venue_id': 1, 'start_time': START.isoformat()},
+        {'artist_id': 1, 'venue_id': 2, 'start_time': (START + timedelta(days=1)).isoformat()},
+        {'artist_id': 2, 'venue_id': 2, 'start_time': (START + timedelta(days=2)).isoformat()},
+    ]
+    assert client.post('/shows/batch', json={'shows': shows}).status_code == 201
+    return client
+
+
+def test_delete_takes_the_shows_and_genre_links(booked):
+    assert booked.delete('/venues/2').status_code == 200
+    assert db.session.query(Venue.id).order_by(Venue.id).all() == [(1,), (3,)]
+    assert db.session.query(Show.venue_id).all() == [(1,)]
+    assert db.session.query(venue_genres.c.venue_id).filter(venue_genres.c.venue_id == 2).count() == 0
+    artist = booked.get('/api/v1/artists/1').json
+    assert [show['venue_id'] for show in artist['upcoming_shows']] == [1]
+    assert artist['upcoming_shows_count'] == 1
+
+
+def test_delete_of_a_missing_venue_is_not_found(booked):
+    assert booked.delete('/venues/9').status_code == 404
+
+
+def test_batch_delete_reports_the_missing(booked):
+    response = booked.post('/venues/delete', json={'ids': [3, 1, 9]})
+    assert response.status_code == 200
+    assert response.json == {'deleted': [1, 3], 'missing': [9]}
+    assert db.session.query(Venue.id).all() == [(2,)]
+
+
+def test_batch_delete_of_artists(booked):
+    response = booked.post('/artists/delete', json={'ids': [1]})
+    assert response.json['deleted'] == [1]
+    assert db.session.query(Show.artist_id).all() == [(2,)]
+    assert booked.get('/api/v1/venues/1').json['upcoming_shows'] == []
+
+
+@pytest.mark.parametrize('payload', [{'ids': 'all'}, {'ids': []}, ['1']])
+def test_batch_delete_needs_a_list_of_ids(booked, payload):
+    assert booked.post('/venues/delete', json=payload).status_code == 400
+    assert db.session.query(Venue).count() == 3
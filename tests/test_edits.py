@@ -0,0 +1,61 @@
+#test_edits: only changed columns are written, guarded by the row version
+import pytest
+
+from extensions import db
+from models import Venue, Artist
+from test_audit import venue_form, artist_form
+
+
+@pytest.fixture
+def listed(client):
+    assert client.post('/venues/create', data=venue_form('Venue 1', 'CA')).status_code == 200
+    assert client.post('/artists/create', data=artist_form('Artist 1', 'CA')).status_code == 200
+    return client
+
+
+def stored(model, row_id=1):
+    db.session.expire_all()
+    return db.session.query(model).get(row_id)
+
+
+def test_edit_bumps_the_version(listed):
+    version = stored(Venue).version
+    response = listed.post('/venues/1/edit', data=venue_form('Venue One', 'NY', version=version))
+    assert response.status_code == 302
+    venue = stored(Venue)
+    assert (venue.name, venue.state, venue.version) == ('Venue One', 'NY', version + 1)
+
+
+def test_genre_only_edit_bumps_the_version(listed):
+    version = stored(Venue).version
+    listed.post('/venues/1/edit', data=venue_form('Venue 1', 'CA', genres=['Jazz', 'Blues'], version=version))
+    assert stored(Venue).version == version + 1
+    assert listed.get('/api/v1/venues/1').json['genres'] == ['Blues', 'Jazz']
+
+
+def test_unchanged_edit_writes_nothing(listed):
+    version = stored(Venue).version
+    assert listed.post('/venues/1/edit', data=venue_form('Venue 1', 'CA', version=version)).status_code == 302
+    assert stored(Venue).version == version
+
+
+def test_stale_version_is_a_conflict(listed):
+    version = stored(Artist).version
+    first = dict(artist_form('Artist One', 'CA'), version=version)
+    assert listed.post('/artists/1/edit', data=first).status_code == 302
+    second = dict(artist_form('Artist Uno', 'CA'), version=version)
+    response = listed.post('/artists/1/edit', data=second)
+    assert response.status_code == 409
+    assert b'Artist Uno' in response.data
+    artist = stored(Artist)
+    assert (artist.name, artist.version) == ('Artist One', version + 1)
+
+
+def test_edit_without_a_version_overwrites(listed):
+    listed.post('/artists/1/edit', data=artist_form('Artist One', 'CA'))
+    assert listed.post('/artists/1/edit', data=artist_form('Artist Uno', 'CA')).status_code == 302
+    assert stored(Artist).name == 'Artist Uno'
+
+
+def test_edit_of_a_missing_row_is_not_found(listed):
+    assert listed.post('/venues/9/edit', data=venue_form('Venue 9', 'CA')).status_code == 404
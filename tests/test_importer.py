@@ -0,0 +1,107 @@
+#test_importer: `flask import` batches, rejects and rollback
+import csv
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import counters
+import importer
+import search
+from extensions import db
+from models import Venue, Artist, Show
+
+START = (datetime.now() + timedelta(days=30)).replace(hour=20, minute=0, second=0, microsecond=0)
+
+
+def write_csv(path, rows):
+    with open(str(path), 'w', newline='', encoding='utf-8') as target:
+        writer = csv.DictWriter(target, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return str(path)
+
+
+def run(app, *args):
+    result = app.test_cli_runner().invoke(args=['import'] + [str(arg) for arg in args])
+    db.session.expire_all()
+    return result
+
+
+@pytest.fixture
+def stocked(app, tmp_path):
+    venues = write_csv(tmp_path / 'venues.csv', [
+        {'name': 'Venue {}'.format(number), 'city': 'Springfield', 'state': 'CA', 'genres': 'Jazz,Blues', 'seeking_talent': 'yes'}
+        for number in (1, 2, 3)
+    ])
+    artists = tmp_path / 'artists.jsonl'
+    artists.write_text('\n'.join(json.dumps({'name': 'Artist {}'.format(number), 'state': 'CA'}) for number in (1, 2, 3)))
+    assert run(app, 'venues', venues).exit_code == 0
+    assert run(app, 'artists', artists).exit_code == 0
+    return app
+
+
+def show(artist, venue, start, **fields):
+    return dict({'artist': artist, 'venue': venue, 'start_time': start.isoformat(), 'duration': ''}, **fields)
+
+
+def test_entities_are_imported(stocked):
+    assert db.session.query(Venue.name).order_by(Venue.id).all() == [('Venue 1',), ('Venue 2',), ('Venue 3',)]
+    assert db.session.query(Venue).get(1).genre_mask != 0
+    assert db.session.query(Artist).count() == 3
+    assert search.find(Artist, 'artist 2')['data'] == [{'id': 2, 'name': 'Artist 2'}]
+
+
+def test_bad_rows_are_rejected_and_reported(stocked, tmp_path):
+    path = write_csv(tmp_path / 'shows.csv', [
+        show('Artist 1', 'Venue 1', START),
+        show('Artist 2', 'Venue 1', START + timedelta(hours=1)),   # venue 1 is booked
+        show('Artist 2', 'Venue 9', START),                        # no such venue
+        show('Artist 3', 'Venue 2', START, duration='-30'),        # ends before it starts
+        show('Artist 3', 'Venue 3', START, duration='90'),
+    ])
+    rejects = tmp_path / 'rejects.jsonl'
+    result = run(stocked, 'shows', path, '--rejects', rejects)
+    assert result.exit_code == 0
+    assert 'shows: 2 imported, 3 rejected' in result.output
+    rejected = [json.loads(line) for line in rejects.read_text().splitlines()]
+    assert [reject['line'] for reject in rejected] == [3, 4, 5]
+    assert 'overlaps row 2 at venue 1' in rejected[0]['error']
+    assert rejected[1]['record']['venue'] == 'Venue 9'
+    assert sorted(db.session.query(Show.artist_id, Show.venue_id)) == [(1, 1), (3, 3)]
+    assert counters.drift() == []
+
+
+def test_clash_with_an_earlier_batch_is_rejected(stocked, tmp_path):
+    path = write_csv(tmp_path / 'shows.csv', [
+        show('Artist 1', 'Venue 1', START),
+        show('Artist 2', 'Venue 2', START),
+        show('Artist 1', 'Venue 3', START + timedelta(minutes=30)),
+    ])
+    result = run(stocked, 'shows', path, '--batch-size', 2)
+    assert 'shows: 2 imported, 1 rejected' in result.output
+    assert 'already booked' in result.output
+
+
+def test_failed_batch_is_rolled_back(stocked, tmp_path, monkeypatch):
+    # the second batch fails: the first stays committed, nothing of the second lands
+    path = write_csv(tmp_path / 'shows.csv', [
+        show('Artist {}'.format(number), 'Venue {}'.format(number), START + timedelta(days=day))
+        for day in (1, 2) for number in (1, 2, 3)
+    ])
+    insert_shows = importer.insert_shows
+    calls = []
+
+    def failing(batch):
+        calls.append(len(batch))
+        insert_shows(batch)
+        if len(calls) == 2:
+            raise RuntimeError('connection lost')
+    monkeypatch.setattr(importer, 'insert_shows', failing)
+
+    result = run(stocked, 'shows', path, '--batch-size', 3)
+    assert isinstance(result.exception, RuntimeError)
+    assert calls == [3, 3]
+    assert db.session.query(Show).count() == 3
+    assert counters.drift() == []
+    assert db.session.query(Venue.upcoming_shows_count).filter(Venue.id == 1).scalar() == 1
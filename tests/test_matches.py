@@ -0,0 +1,75 @@
+#test_matches: precomputed match lists, kept as a rebuild would make them
+from datetime import datetime, timedelta
+
+import pytest
+
+import matches
+from extensions import db
+from models import Match
+from test_audit import venue_form, artist_form
+
+START = (datetime.now() + timedelta(days=30)).replace(microsecond=0)
+
+
+@pytest.fixture
+def listed(app, client):
+    # short lists, so that entries are pushed out and make room again
+    app.config['MATCH_LIST_SIZE'] = 2
+    for name, state, genres in (('Jazz Club', 'CA', ['Jazz']), ('Blues Bar', 'CA', ['Blues']),
+                                ('Both Hall', 'CA', ['Jazz', 'Blues']), ('Far Club', 'NY', ['Jazz'])):
+        assert client.post('/venues/create', data=venue_form(name, state, genres=genres)).status_code == 200
+    for name, genres in (('Jazz Trio', ['Jazz']), ('Blues Duo', ['Blues']), ('Jazz Solo', ['Jazz'])):
+        form = dict(artist_form(name, 'CA'), genres=genres)
+        assert client.post('/artists/create', data=form).status_code == 200
+    return client
+
+
+def listing(client, kind, row_id):
+    response = client.get('/api/v1/{}s/{}/matches'.format(kind, row_id), query_string={'fields': 'name'})
+    assert response.status_code == 200
+    return [(entry['id'], entry['score'], entry['shared_genres']) for entry in response.json['data']]
+
+
+def lists():
+    return sorted((row.side, row.owner_id, row.candidate_id, round(row.score, 6)) for row in db.session.query(Match))
+
+
+def assert_as_rebuilt():
+    kept = lists()
+    matches.rebuild()
+    assert kept == lists()
+
+
+def test_scores_genre_place_and_history(listed):
+    # same city and state; all genres shared, or one of two
+    assert listing(listed, 'artist', 1) == [(1, 0.85, ['Jazz']), (3, pytest.approx(0.55), ['Jazz'])]
+    shows = [{'artist_id': 1, 'venue_id': 3, 'start_time': (START + timedelta(days=day)).isoformat()} for day in (1, 2, 3)]
+    assert listed.post('/shows/batch', json={'shows': shows}).status_code == 201
+    # three shows together: n / (n + 1) of the history weight
+    assert listing(listed, 'artist', 1)[1] == (3, pytest.approx(0.6625), ['Jazz'])
+    assert listing(listed, 'venue', 3)[0][0] == 1
+    assert_as_rebuilt()
+
+
+def test_lists_follow_edits(listed):
+    assert [entry[0] for entry in listing(listed, 'venue', 1)] == [1, 3]
+    # no longer seeking talent: off every artist's list
+    assert listed.post('/venues/1/edit', data=venue_form('Jazz Club', 'CA', genres=['Jazz'], seeking_talent='')).status_code == 302
+    assert 1 not in [entry[0] for entry in listing(listed, 'artist', 1)]
+    assert_as_rebuilt()
+    # a genre change moves the venue to the other artists' lists
+    assert listed.post('/venues/2/edit', data=venue_form('Blues Bar', 'CA', genres=['Jazz'])).status_code == 302
+    assert [entry[0] for entry in listing(listed, 'artist', 2)] == [3]
+    assert 2 in [entry[0] for entry in listing(listed, 'artist', 3)]
+    assert_as_rebuilt()
+    # another state shares no place, and is only listed with room to spare
+    assert listed.post('/artists/3/edit', data=dict(artist_form('Jazz Solo', 'NY'), genres=['Jazz'])).status_code == 302
+    assert [entry[0] for entry in listing(listed, 'artist', 3)] == [4]
+    assert_as_rebuilt()
+
+
+def test_deleted_entities_leave_the_lists(listed):
+    assert listed.post('/venues/delete', json={'ids': [1]}).status_code == 200
+    assert 1 not in [entry[0] for entry in listing(listed, 'artist', 1)]
+    assert db.session.query(Match).filter(Match.side == 'venue', Match.owner_id == 1).count() == 0
+    assert listed.get('/api/v1/venues/1/matches').status_code == 404
@@ -0,0 +1,69 @@
+#test_nearby: venues within a radius, nearest first, kept current as venues move
+import pytest
+
+import nearby
+from extensions import db
+from models import Place
+from test_audit import venue_form
+
+SAN_FRANCISCO = (37.7749, -122.4194)
+OAKLAND = (37.8044, -122.2712)
+NEW_YORK = (40.7128, -74.0060)
+
+
+@pytest.fixture
+def mapped(client):
+    db.session.add(Place(city='Oakland', state='CA', latitude=OAKLAND[0], longitude=OAKLAND[1]))
+    db.session.commit()
+    for name, (latitude, longitude) in (('Bay Venue', SAN_FRANCISCO), ('Big Apple Venue', NEW_YORK)):
+        form = venue_form(name, 'CA', latitude=str(latitude), longitude=str(longitude))
+        assert client.post('/venues/create', data=form).status_code == 200
+    # venue 3 has no coordinates and takes its city's
+    assert client.post('/venues/create', data=venue_form('East Bay Venue', 'CA', city='Oakland')).status_code == 200
+    # the grid loads on the first search; what follows keeps it current
+    nearest(client, *SAN_FRANCISCO)
+    return client
+
+
+def nearest(client, latitude, longitude, **args):
+    response = client.get('/api/v1/venues/nearby', query_string=dict(args, lat=latitude, lng=longitude, fields='name'))
+    assert response.status_code == 200, response.json
+    return [(venue['id'], venue['distance_km']) for venue in response.json['data']]
+
+
+def test_nearest_first_within_the_radius(mapped):
+    found = nearest(mapped, *SAN_FRANCISCO, radius=50)
+    assert [venue_id for venue_id, _ in found] == [1, 3]
+    assert found[0][1] == 0
+    assert found[1][1] == pytest.approx(nearby.haversine(*SAN_FRANCISCO + OAKLAND), abs=0.001)
+    assert [venue_id for venue_id, _ in nearest(mapped, *SAN_FRANCISCO, radius=10)] == [1]
+    assert [venue_id for venue_id, _ in nearest(mapped, *SAN_FRANCISCO, limit=1)] == [1]
+
+
+def test_across_the_antimeridian(mapped):
+    form = venue_form('Date Line Venue', 'CA', latitude='0', longitude='179.95')
+    assert mapped.post('/venues/create', data=form).status_code == 200
+    assert [venue_id for venue_id, _ in nearest(mapped, 0, -179.95, radius=50)] == [4]
+
+
+def test_edit_moves_the_venue(mapped):
+    form = venue_form('Bay Venue', 'CA', latitude=str(NEW_YORK[0] + 0.01), longitude=str(NEW_YORK[1]))
+    assert mapped.post('/venues/1/edit', data=form).status_code == 302
+    assert [venue_id for venue_id, _ in nearest(mapped, *SAN_FRANCISCO, radius=50)] == [3]
+    assert [venue_id for venue_id, _ in nearest(mapped, *NEW_YORK, radius=50)] == [2, 1]
+
+
+def test_deletes_are_forgotten(mapped):
+    assert mapped.post('/venues/delete', json={'ids': [1]}).status_code == 200
+    assert [venue_id for venue_id, _ in nearest(mapped, *SAN_FRANCISCO, radius=50)] == [3]
+
+
+def test_search_from_a_city(mapped):
+    response = mapped.get('/api/v1/venues/nearby', query_string={'city': 'Oakland', 'state': 'CA', 'radius': 50})
+    assert [venue['id'] for venue in response.json['data']] == [3, 1]
+    assert mapped.get('/api/v1/venues/nearby?city=Nowhere&state=CA').status_code == 400
+
+
+@pytest.mark.parametrize('query', ['', 'lat=91&lng=0', 'lat=0', 'lat=0&lng=0&radius=0', 'lat=0&lng=0&radius=100000'])
+def test_bad_searches(mapped, query):
+    assert mapped.get('/api/v1/venues/nearby?' + query).status_code == 400
@@ -0,0 +1,38 @@
+#test_parallel: workers count into their own records, merged into the request's
+import threading
+
+import pytest
+
+import audit
+import metrics
+from parallel import DetailQueries, gather
+
+
+@pytest.fixture
+def workers(app):
+    app.config['CONCURRENT_DETAIL_QUERIES'] = True
+    app.extensions['parallel'] = DetailQueries(2, None)
+    with app.test_request_context('/venues/1'):
+        metrics.start_request_timings()
+        audit.start_query_audit()
+        yield app
+    app.extensions['parallel'].executor.shutdown()
+
+
+def counted(statement):
+    # what the engine hooks do for one statement
+    def call():
+        metrics.current().queries += 1
+        record = audit.current()
+        record.counts[statement] = record.counts.get(statement, 0) + 1
+        return threading.current_thread().name, metrics.current()
+    return call
+
+
+def test_worker_counts_are_merged(workers):
+    results = gather(counted('a'), counted('b'), counted('b'))
+    assert [name.startswith('fyyur-query') for name, _ in results] == [False, True, True]
+    # each worker had a record of its own
+    assert len({id(timings) for _, timings in results}) == 3
+    assert metrics.current().queries == 3
+    assert audit.current().counts == {'a': 1, 'b': 2}
@@ -0,0 +1,77 @@
+#test_search: ranked partial matches, kept current as venues and artists change
+import pytest
+
+import search
+from extensions import db
+from models import Venue, Artist
+from test_audit import venue_form, artist_form
+
+
+@pytest.fixture
+def listed(client):
+    for name, state in (('The Musical Hop', 'CA'), ('Park Square Live Music', 'NY'), ('Hopscotch', 'TX')):
+        assert client.post('/venues/create', data=venue_form(name, state)).status_code == 200
+    assert client.post('/artists/create', data=artist_form('Guns N Petals', 'CA')).status_code == 200
+    # the index loads on the first search; what follows keeps it current
+    assert search.find(Venue, 'hop')['count'] == 2
+    return client
+
+
+def names(model, term):
+    return [row['name'] for row in search.find(model, term)['data']]
+
+
+def test_ranked_partial_matches(listed):
+    assert names(Venue, 'Hop') == ['Hopscotch', 'The Musical Hop']
+    assert names(Venue, 'music') == ['Park Square Live Music', 'The Musical Hop']
+    assert names(Venue, 'ny') == ['Park Square Live Music']
+    assert names(Venue, 'jazz') == []
+
+
+def test_empty_term_lists_everything(listed):
+    assert search.find(Venue, '  ') == {'count': 3, 'data': [
+        {'id': 3, 'name': 'Hopscotch'}, {'id': 2, 'name': 'Park Square Live Music'}, {'id': 1, 'name': 'The Musical Hop'},
+    ]}
+
+
+def test_limit_keeps_the_total(listed):
+    result = search.find(Venue, 'spring', limit=1)
+    assert result['count'] == 3
+    assert len(result['data']) == 1
+
+
+def test_create_is_found(listed):
+    assert listed.post('/venues/create', data=venue_form('Hop Inn', 'WA')).status_code == 200
+    assert names(Venue, 'hop') == ['Hop Inn', 'Hopscotch', 'The Musical Hop']
+
+
+def test_edit_moves_the_row(listed):
+    assert listed.post('/venues/3/edit', data=venue_form('Scotch Bar', 'TX')).status_code == 302
+    assert names(Venue, 'hop') == ['The Musical Hop']
+    assert names(Venue, 'scotch') == ['Scotch Bar']
+    assert listed.post('/artists/1/edit', data=artist_form('Guns N Roses', 'CA')).status_code == 302
+    assert names(Artist, 'petal') == []
+    assert names(Artist, 'roses') == ['Guns N Roses']
+
+
+def test_deletes_are_forgotten(listed):
+    assert listed.delete('/venues/1').status_code == 200
+    assert names(Venue, 'hop') == ['Hopscotch']
+    db.session.delete(db.session.query(Venue).get(3))
+    db.session.commit()
+    assert names(Venue, 'hop') == []
+
+
+def test_rolled_back_changes_are_not_indexed(listed):
+    db.session.query(Venue).get(2).name = 'Hop Hall'
+    db.session.flush()
+    db.session.rollback()
+    assert names(Venue, 'hall') == []
+    assert names(Venue, 'park') == ['Park Square Live Music']
+
+
+def test_search_page(listed):
+    response = listed.post('/venues/search', data={'search_term': 'hop'})
+    assert response.status_code == 200
+    assert b'Hopscotch' in response.data
+    assert b'Park Square' not in response.data